@@ -0,0 +1,606 @@
+# -*- coding: utf-8 -*-
+"""
+Scale benchmark of fabricawscfn.
+
+Drives real StackGroup tasks against a synthetic CloudFormation account, and reports
+wall time, number of API calls and peak memory for 10 to 10,000 stacks.
+The synthetic account answers API calls on botocore 'before-call' event (same as botocore Stubber),
+so requests never leave the process. Per-call latency can be injected to simulate real API.
+
+Scenarios: (N = size)
+    list_stacks    : N stacks.
+    list_resources : N stacks, (resources per stack) resources each.
+    list_exports   : N stacks, (exports per stack) exports each.
+    desc_stack     : A stack with N events. (in N stacks)
+    detect_drift   : A stack with N drifted resources. (in N stacks)
+    create         : create_all for N stacks, with parameter resolution.
+    update         : update_all for N stacks, with parameter resolution.
+    plan           : plan for N stacks. (Change sets for update)
+    update_unchanged: update_all for N stacks, already deployed with the same template and parameters.
+    list_stacks_cached: list_stacks for N stacks, served by local stack state index within TTL.
+    desc_stack_cached : desc_stack of a stack with N events, stack served by local stack state index.
+    list_exports_refreshed: list_exports after TTL, when 1 of N stacks has been updated.
+
+Each measurement runs on a new Python process to measure peak memory.
+
+Usage:
+    python benchmark/scale.py
+    python benchmark/scale.py --sizes 10,100 --scenarios list_stacks,desc_stack --latency 50
+    python benchmark/scale.py --json result.json
+    python benchmark/scale.py --compare result.json    # Exit with status 1 if regressed.
+"""
+from __future__ import print_function
+from collections import OrderedDict
+import datetime
+import json
+import optparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+PAGE_SIZE = 100
+ACCOUNT_ID = '123456789012'
+REGION = 'us-east-1'
+BASE_TIME = datetime.datetime(2018, 11, 1)
+
+
+class SyntheticAccount(object):
+    """
+    Synthetic CloudFormation account.
+    Responses are generated page by page, so that fixture itself does not dominate memory.
+    """
+    def __init__(self, size, resources_per_stack = 2, exports_per_stack = 1, created = True, latency = 0.0):
+        """
+        :param size: Number of stacks. Also number of events and drifts of the first stack.
+        :param resources_per_stack: Number of resources per stack.
+        :param exports_per_stack: Number of exports per stack.
+        :param created: Set False to start with no stacks. (For create)
+        :param latency: Injected seconds per API call.
+        """
+        self.size = size
+        self.resources_per_stack = resources_per_stack
+        self.exports_per_stack = exports_per_stack
+        self.latency = latency
+        self.stack_names = ['bench-stack%05d' % i for i in range(size)]
+        # {Stack name, Stack}
+        self.stacks = {}
+        # {Stack ID, Events appended by create / update (newest first)}
+        self.new_events = {}
+        # {Change set ID, Change set}
+        self.change_sets = OrderedDict()
+        # {Operation name, Number of calls}
+        self.calls = {}
+        self.lock = threading.Lock()
+        if created:
+            for stack_name in self.stack_names:
+                self.stacks[stack_name] = self.new_stack(stack_name, [
+                    {'ParameterKey': 'Env', 'ParameterValue': 'dev'},
+                    {'ParameterKey': 'Name', 'ParameterValue': stack_name}
+                ])
+
+    def stack_id(self, stack_name):
+        return 'arn:aws:cloudformation:%s:%s:stack/%s/00000000-0000-0000-0000-%s' % (
+            REGION, ACCOUNT_ID, stack_name, stack_name[-5:].rjust(12, '0'))
+
+    def new_stack(self, stack_name, parameters):
+        return {
+            'StackId': self.stack_id(stack_name),
+            'StackName': stack_name,
+            'StackStatus': 'CREATE_COMPLETE',
+            'CreationTime': BASE_TIME,
+            'LastUpdatedTime': BASE_TIME,
+            'Description': 'Benchmark stack %s.' % stack_name,
+            'Parameters': parameters,
+            'Outputs': [
+                {'OutputKey': 'Output%d' % i, 'OutputValue': '%s-output%d' % (stack_name, i), 'ExportName': '%s-Export%d' % (stack_name, i)}
+                for i in range(self.exports_per_stack)
+            ],
+            'DriftInformation': {'StackDriftStatus': 'DRIFTED', 'LastCheckTimestamp': BASE_TIME}
+        }
+
+    def resolve_parameters(self, stack, parameters):
+        # UsePreviousValue is replaced by the value of the stack, as CloudFormation does.
+        previous = dict((param['ParameterKey'], param['ParameterValue']) for param in (stack or {}).get('Parameters', []))
+        return [
+            {'ParameterKey': param['ParameterKey'], 'ParameterValue': previous[param['ParameterKey']]} if param.get('UsePreviousValue') else param
+            for param in parameters
+        ]
+
+    def is_target(self, stack_name):
+        # The first stack has many events and drifts.
+        return stack_name == self.stack_names[0]
+
+    def find_stack(self, name_or_id):
+        stack_name = name_or_id.split('/')[1] if name_or_id.startswith('arn:') else name_or_id
+        stack = self.stacks.get(stack_name)
+        if stack is None:
+            raise SyntheticError('ValidationError', 'Stack with id %s does not exist' % name_or_id)
+        return stack
+
+    def page(self, params, key, count, item_at):
+        start = int(params.get('NextToken') or 0)
+        end = min(start + PAGE_SIZE, count)
+        result = {key: [item_at(i) for i in range(start, end)]}
+        if end < count:
+            result['NextToken'] = str(end)
+        return result
+
+    def ListStacks(self, params):
+        stack_names = [stack_name for stack_name in self.stack_names if stack_name in self.stacks]
+
+        def summary(i):
+            stack = self.stacks[stack_names[i]]
+            return {
+                'StackId': stack['StackId'],
+                'StackName': stack['StackName'],
+                'TemplateDescription': stack['Description'],
+                'CreationTime': stack['CreationTime'],
+                'LastUpdatedTime': stack['LastUpdatedTime'],
+                'StackStatus': stack['StackStatus'],
+                'DriftInformation': {'StackDriftStatus': stack['DriftInformation']['StackDriftStatus']}
+            }
+        return self.page(params, 'StackSummaries', len(stack_names), summary)
+
+    def DescribeStacks(self, params):
+        return {'Stacks': [self.find_stack(params['StackName'])]}
+
+    def DescribeStackEvents(self, params):
+        stack = self.find_stack(params['StackName'])
+        new_events = self.new_events.get(stack['StackId'], [])
+        base_count = self.size if self.is_target(stack['StackName']) else 2
+
+        def event(i):
+            if i < len(new_events):
+                return new_events[i]
+            i = base_count - (i - len(new_events)) - 1
+            return {
+                'EventId': 'event-%d' % i,
+                'StackId': stack['StackId'],
+                'StackName': stack['StackName'],
+                'LogicalResourceId': 'Resource%d' % i,
+                'PhysicalResourceId': '%s-resource%d' % (stack['StackName'], i),
+                'ResourceType': 'AWS::SNS::Topic',
+                'Timestamp': BASE_TIME + datetime.timedelta(seconds = i),
+                'ResourceStatus': 'CREATE_COMPLETE',
+                'ResourceStatusReason': 'Resource creation Initiated'
+            }
+        return self.page(params, 'StackEvents', len(new_events) + base_count, event)
+
+    def ListStackResources(self, params):
+        stack = self.find_stack(params['StackName'])
+        return self.page(params, 'StackResourceSummaries', self.resources_per_stack, lambda i: {
+            'LogicalResourceId': 'Resource%d' % i,
+            'PhysicalResourceId': '%s-resource%d' % (stack['StackName'], i),
+            'ResourceType': 'AWS::SNS::Topic',
+            'LastUpdatedTimestamp': BASE_TIME,
+            'ResourceStatus': 'CREATE_COMPLETE'
+        })
+
+    def ListExports(self, params):
+        stack_names = [stack_name for stack_name in self.stack_names if stack_name in self.stacks]
+
+        def export(i):
+            stack = self.stacks[stack_names[i // self.exports_per_stack]]
+            output = stack['Outputs'][i % self.exports_per_stack]
+            return {'ExportingStackId': stack['StackId'], 'Name': output['ExportName'], 'Value': output['OutputValue']}
+        return self.page(params, 'Exports', len(stack_names) * self.exports_per_stack, export)
+
+    def DetectStackDrift(self, params):
+        stack = self.find_stack(params['StackName'])
+        return {'StackDriftDetectionId': 'drift-%s' % stack['StackName']}
+
+    def DescribeStackDriftDetectionStatus(self, params):
+        stack = self.find_stack(params['StackDriftDetectionId'][len('drift-'):])
+        return {
+            'StackId': stack['StackId'],
+            'StackDriftDetectionId': params['StackDriftDetectionId'],
+            'StackDriftStatus': 'DRIFTED',
+            'DetectionStatus': 'DETECTION_COMPLETE',
+            'DriftedStackResourceCount': self.size if self.is_target(stack['StackName']) else 1,
+            'Timestamp': BASE_TIME
+        }
+
+    def DescribeStackResourceDrifts(self, params):
+        stack = self.find_stack(params['StackName'])
+        count = self.size if self.is_target(stack['StackName']) else 1
+        return self.page(params, 'StackResourceDrifts', count, lambda i: {
+            'StackId': stack['StackId'],
+            'LogicalResourceId': 'Resource%d' % i,
+            'PhysicalResourceId': '%s-resource%d' % (stack['StackName'], i),
+            'ResourceType': 'AWS::SNS::Topic',
+            'StackResourceDriftStatus': 'MODIFIED',
+            'PropertyDifferences': [
+                {'PropertyPath': '/DisplayName', 'ExpectedValue': 'expected', 'ActualValue': 'actual', 'DifferenceType': 'NOT_EQUAL'}
+            ],
+            'Timestamp': BASE_TIME
+        })
+
+    def HeadObject(self, params):
+        return {'ETag': '"benchmark"', 'ContentLength': 0}
+
+    def GetTemplateSummary(self, params):
+        return {'Parameters': [
+            {'ParameterKey': 'Env', 'DefaultValue': 'dev', 'ParameterType': 'String', 'NoEcho': False, 'Description': 'Environment.'},
+            {'ParameterKey': 'Name', 'ParameterType': 'String', 'NoEcho': False, 'Description': 'Name.'}
+        ]}
+
+    def complete_event(self, stack, status):
+        with self.lock:
+            events = self.new_events.setdefault(stack['StackId'], [])
+            events.insert(0, {
+                'EventId': 'event-%s-%d' % (status, len(events)),
+                'StackId': stack['StackId'],
+                'StackName': stack['StackName'],
+                'LogicalResourceId': stack['StackName'],
+                'PhysicalResourceId': stack['StackId'],
+                'ResourceType': 'AWS::CloudFormation::Stack',
+                'Timestamp': BASE_TIME,
+                'ResourceStatus': status
+            })
+
+    def CreateStack(self, params):
+        stack = self.new_stack(params['StackName'], params.get('Parameters', []))
+        with self.lock:
+            self.stacks[params['StackName']] = stack
+        self.complete_event(stack, 'CREATE_COMPLETE')
+        return {'StackId': stack['StackId']}
+
+    def UpdateStack(self, params):
+        stack = self.find_stack(params['StackName'])
+        stack['Parameters'] = self.resolve_parameters(stack, params.get('Parameters', []))
+        self.complete_event(stack, 'UPDATE_COMPLETE')
+        return {'StackId': stack['StackId']}
+
+    def CreateChangeSet(self, params):
+        with self.lock:
+            stack = self.stacks.get(params['StackName'])
+            if stack is None and params.get('ChangeSetType') == 'CREATE':
+                stack = self.stacks[params['StackName']] = self.new_stack(params['StackName'], [])
+                stack['StackStatus'] = 'REVIEW_IN_PROGRESS'
+        if stack is None:
+            raise SyntheticError('ValidationError', 'Stack [%s] does not exist' % params['StackName'])
+        change_set_id = 'arn:aws:cloudformation:%s:%s:changeSet/%s/%s' % (REGION, ACCOUNT_ID, params['ChangeSetName'], stack['StackName'])
+        change_set = {
+            'ChangeSetId': change_set_id,
+            'ChangeSetName': params['ChangeSetName'],
+            'StackId': stack['StackId'],
+            'StackName': stack['StackName'],
+            'CreationTime': BASE_TIME,
+            'ExecutionStatus': 'AVAILABLE',
+            'Status': 'CREATE_COMPLETE',
+            'Parameters': self.resolve_parameters(stack, params.get('Parameters', [])),
+            'Changes': [{'Type': 'Resource', 'ResourceChange': {
+                'Action': 'Add' if params.get('ChangeSetType') == 'CREATE' else 'Modify',
+                'LogicalResourceId': 'Resource0',
+                'ResourceType': 'AWS::SNS::Topic',
+                'Replacement': 'False'
+            }}]
+        }
+        if params.get('ChangeSetType') != 'CREATE' and change_set['Parameters'] == stack['Parameters']:
+            change_set.update(Status = 'FAILED', ExecutionStatus = 'UNAVAILABLE', Changes = [],
+                              StatusReason = "The submitted information didn't contain changes. Submit different information to create a change set.")
+        with self.lock:
+            self.change_sets[change_set_id] = change_set
+        return {'Id': change_set_id, 'StackId': stack['StackId']}
+
+    def find_change_set(self, change_set_id):
+        change_set = self.change_sets.get(change_set_id)
+        if change_set is None:
+            raise SyntheticError('ChangeSetNotFound', 'ChangeSet [%s] does not exist' % change_set_id)
+        return change_set
+
+    def DescribeChangeSet(self, params):
+        return dict(self.find_change_set(params['ChangeSetName']))
+
+    def ListChangeSets(self, params):
+        stack = self.find_stack(params['StackName'])
+        return {'Summaries': [
+            dict((key, change_set[key]) for key in ['ChangeSetId', 'ChangeSetName', 'StackId', 'StackName', 'Status', 'ExecutionStatus', 'CreationTime'])
+            for change_set in self.change_sets.values() if change_set['StackId'] == stack['StackId']
+        ]}
+
+    def DeleteChangeSet(self, params):
+        self.find_change_set(params['ChangeSetName'])
+        with self.lock:
+            del self.change_sets[params['ChangeSetName']]
+        return {}
+
+    def ExecuteChangeSet(self, params):
+        change_set = self.find_change_set(params['ChangeSetName'])
+        stack = self.find_stack(change_set['StackName'])
+        created = stack['StackStatus'] == 'REVIEW_IN_PROGRESS'
+        stack['StackStatus'] = 'CREATE_COMPLETE' if created else 'UPDATE_COMPLETE'
+        stack['Parameters'] = change_set['Parameters']
+        with self.lock:
+            for change_set_id in [key for key, value in self.change_sets.items() if value['StackId'] == stack['StackId']]:
+                del self.change_sets[change_set_id]
+        self.complete_event(stack, stack['StackStatus'])
+        return {}
+
+    def GetCallerIdentity(self, params):
+        return {'Account': ACCOUNT_ID, 'UserId': 'BENCHMARK', 'Arn': 'arn:aws:iam::%s:user/benchmark' % ACCOUNT_ID}
+
+    def capture_params(self, params, context, **kwargs):
+        context['synthetic_params'] = params
+
+    def respond(self, model, context, **kwargs):
+        """
+        Handler of botocore 'before-call' event. Returns (HTTP response, Parsed response).
+        """
+        from botocore.awsrequest import AWSResponse
+
+        with self.lock:
+            self.calls[model.name] = self.calls.get(model.name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            parsed = getattr(self, model.name)(context['synthetic_params'])
+            status_code = 200
+        except SyntheticError as e:
+            parsed = {'Error': {'Code': e.code, 'Message': e.message}}
+            status_code = 400
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': status_code, 'RetryAttempts': 0}
+        return AWSResponse(None, status_code, {}, None), parsed
+
+
+class SyntheticError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+
+def synthetic_client_pool(account):
+    """
+    Create ClientPool whose clients are answered by the synthetic account.
+    """
+    from fabricawscfn.fabricawscfn import ClientPool
+
+    class SyntheticClientPool(ClientPool):
+        def __init__(self):
+            ClientPool.__init__(self)
+            self.registered = set()
+            self.registered_lock = threading.Lock()
+
+        def session(self, key):
+            session = ClientPool.session(self, key)
+            with self.registered_lock:
+                if key not in self.registered:
+                    # Register before creating clients. (Clients copy event handlers of the session)
+                    for service_name in ['cloudformation', 'sts', 's3']:
+                        session.events.register('before-parameter-build.%s' % service_name, account.capture_params)
+                        session.events.register('before-call.%s' % service_name, account.respond)
+                    self.registered.add(key)
+                return session
+
+    return SyntheticClientPool()
+
+
+SCENARIOS = OrderedDict([
+    ('list_stacks', lambda group: group.list_stacks()),
+    ('list_resources', lambda group: group.list_resources()),
+    ('list_exports', lambda group: group.list_exports()),
+    ('desc_stack', lambda group: group.desc_stack('stack00000')),
+    ('detect_drift', lambda group: group.detect_drift('stack00000')),
+    ('create', lambda group: group.create_all(Name = 'benchmark')),
+    ('update', lambda group: group.update_all(Name = 'benchmark')),
+    ('plan', lambda group: group.plan(Name = 'benchmark')),
+    ('update_unchanged', lambda group: group.update_all(Name = 'benchmark')),
+    ('list_stacks_cached', lambda group: group.list_stacks()),
+    ('desc_stack_cached', lambda group: group.desc_stack('stack00000')),
+    ('list_exports_refreshed', lambda group: group.list_exports()),
+])
+
+
+def deploy_all(group, account):
+    """
+    Mark templates as synchronized, and deploy all stacks once.
+    """
+    group.save_synced_manifest(dict(
+        (group.template_s3_location(stack_def.template_path), 'benchmark') for stack_def in group.stack_defs.values()
+    ))
+    group.update_all(Name = 'benchmark')
+
+
+def warm_stack_state(group, account):
+    """
+    Turn on local stack state index, and read stacks and exports once.
+    """
+    group.stack_state_cache(ttl = 3600)
+    group.list_stacks()
+    group.list_exports()
+    group.desc_stack('stack00000')
+
+
+def update_one_stack_after_ttl(group, account):
+    """
+    Warm local stack state index, then update a stack and expire TTL.
+    """
+    warm_stack_state(group, account)
+    account.stacks['bench-stack00000']['LastUpdatedTime'] = datetime.datetime(2019, 1, 1)
+    group.refresh()
+
+
+# {Scenario, Function called before measurement}
+SETUPS = {
+    'update_unchanged': deploy_all,
+    'list_stacks_cached': warm_stack_state,
+    'desc_stack_cached': warm_stack_state,
+    'list_exports_refreshed': update_one_stack_after_ttl
+}
+
+
+def peak_memory_mb():
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on Mac, Kilobytes on Linux.
+    return maxrss / 1024.0 / 1024.0 if sys.platform == 'darwin' else maxrss / 1024.0
+
+
+def run_scenario(scenario, size, options):
+    """
+    Run a scenario on current process. (Called on child process)
+    """
+    from fabric.api import env
+    import fabricawscfn
+
+    account = SyntheticAccount(
+        size,
+        resources_per_stack = options.resources_per_stack,
+        exports_per_stack = options.exports_per_stack,
+        created = scenario != 'create',
+        latency = options.latency / 1000.0
+    )
+    work_dir = tempfile.mkdtemp(prefix = 'fabricawscfn-benchmark-')
+    group = fabricawscfn.StackGroup('bench-bucket', 'templates', os.path.join(work_dir, 'templates'))
+    group.state_dir = os.path.join(work_dir, '.fabricawscfn')
+    group.client_pool = synthetic_client_pool(account)
+    for i in range(size):
+        group.define_stack('stack%05d' % i, 'bench-stack%05d' % i, 'stack%05d.yaml' % i)
+    env.Region = REGION
+    if options.regions > 1:
+        env.Regions = [REGION] * options.regions
+
+    stdout = sys.stdout
+    error = None
+    sys.stdout = open(os.devnull, 'w')
+    if scenario in SETUPS:
+        SETUPS[scenario](group, account)
+        account.calls.clear()
+    memory_before = peak_memory_mb()
+    started = time.time()
+    try:
+        SCENARIOS[scenario](group)
+    except (Exception, SystemExit) as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    finally:
+        elapsed = time.time() - started
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    return dict(
+        scenario = scenario,
+        size = size,
+        wall_s = elapsed,
+        api_calls = sum(account.calls.values()),
+        calls = account.calls,
+        peak_memory_mb = peak_memory_mb(),
+        task_memory_mb = peak_memory_mb() - memory_before,
+        error = error
+    )
+
+
+def measure(scenario, size, options):
+    child_env = dict(os.environ)
+    # Synthetic credentials. Requests never leave the process.
+    child_env.update(AWS_ACCESS_KEY_ID = 'benchmark', AWS_SECRET_ACCESS_KEY = 'benchmark', AWS_DEFAULT_REGION = REGION)
+    for name in ['AWS_PROFILE', 'AWS_DEFAULT_PROFILE', 'AWS_SESSION_TOKEN']:
+        child_env.pop(name, None)
+    package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    child_env['PYTHONPATH'] = os.pathsep.join([package_dir] + ([child_env['PYTHONPATH']] if child_env.get('PYTHONPATH') else []))
+    output = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--child', scenario, str(size),
+         '--latency', str(options.latency),
+         '--resources-per-stack', str(options.resources_per_stack),
+         '--exports-per-stack', str(options.exports_per_stack),
+         '--regions', str(options.regions)],
+        cwd = package_dir,
+        env = child_env
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compare results with baseline.
+    Regressed if API calls increased, or wall time / memory exceeded baseline by tolerance.
+    """
+    baseline_results = dict(((r['scenario'], r['size']), r) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        base = baseline_results.get((result['scenario'], result['size']))
+        if base is None:
+            continue
+        name = '%s(%d)' % (result['scenario'], result['size'])
+        if result['api_calls'] > base['api_calls']:
+            regressions.append('%s API calls %d -> %d' % (name, base['api_calls'], result['api_calls']))
+        # Small absolute slack for short measurements.
+        if result['wall_s'] > base['wall_s'] * (1 + tolerance) + 0.05:
+            regressions.append('%s wall time %.2fs -> %.2fs' % (name, base['wall_s'], result['wall_s']))
+        if result['peak_memory_mb'] > base['peak_memory_mb'] * (1 + tolerance) + 1:
+            regressions.append('%s peak memory %.1fMB -> %.1fMB' % (name, base['peak_memory_mb'], result['peak_memory_mb']))
+    return regressions
+
+
+def parse_args():
+    parser = optparse.OptionParser(usage = '%prog [options]')
+    parser.add_option('--sizes', default = ','.join(str(size) for size in DEFAULT_SIZES),
+                      help = 'Comma separated sizes. (Default %default)')
+    parser.add_option('--scenarios', default = ','.join(SCENARIOS),
+                      help = 'Comma separated scenarios. (Default all)')
+    parser.add_option('--latency', type = 'float', default = 0.0,
+                      help = 'Injected milliseconds per API call. (Default %default)')
+    parser.add_option('--resources-per-stack', type = 'int', default = 2,
+                      help = 'Number of resources per stack. (Default %default)')
+    parser.add_option('--exports-per-stack', type = 'int', default = 1,
+                      help = 'Number of exports per stack. (Default %default)')
+    parser.add_option('--regions', type = 'int', default = 1,
+                      help = 'Fan out to the regions, if more than 1. (Default %default)')
+    parser.add_option('--json', help = 'Write results to the JSON file.')
+    parser.add_option('--compare', help = 'Compare with the results JSON file, and exit with status 1 if regressed.')
+    parser.add_option('--tolerance', type = 'float', default = 0.2,
+                      help = 'Allowed ratio of wall time / memory increase for --compare. (Default %default)')
+    parser.add_option('--child', action = 'store_true', help = optparse.SUPPRESS_HELP)
+    return parser.parse_args()
+
+
+def main():
+    options, args = parse_args()
+    if options.child:
+        print(json.dumps(run_scenario(args[0], int(args[1]), options)))
+        return
+
+    scenarios = [scenario for scenario in options.scenarios.split(',') if scenario]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            sys.exit('Unknown scenario %s. (Available: %s)' % (scenario, ', '.join(SCENARIOS)))
+    sizes = [int(size) for size in options.sizes.split(',') if size]
+
+    print('%-22s %6s %10s %10s %12s  %s' % ('Scenario', 'Size', 'Wall', 'APICalls', 'PeakMemory', 'Error'))
+    results = []
+    for scenario in scenarios:
+        for size in sizes:
+            result = measure(scenario, size, options)
+            results.append(result)
+            print('%-22s %6d %9.2fs %10d %10.1fMB  %s' % (
+                scenario, size, result['wall_s'], result['api_calls'], result['peak_memory_mb'], result['error'] or ''))
+            sys.stdout.flush()
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(dict(
+                latency_ms = options.latency,
+                resources_per_stack = options.resources_per_stack,
+                exports_per_stack = options.exports_per_stack,
+                regions = options.regions,
+                results = results
+            ), f, indent = 2, sort_keys = True)
+
+    failed = [result for result in results if result['error']]
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = find_regressions(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print('Regressed: %s' % regression)
+        if regressions:
+            sys.exit(1)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark of fabricawscfn.
+
+Measures import time and task registration time (StackGroup#define_stack() + generate_task())
+for fabfiles with 10, 100 and 1000 stacks, like `fab -l` does.
+Each measurement runs on a new Python process to measure cold import.
+
+Usage:
+    python benchmark/startup.py
+"""
+from __future__ import print_function
+import json
+import os
+import subprocess
+import sys
+
+# Targets. Exit with status 1 if exceeded.
+IMPORT_TARGET_MS = 50
+REGISTRATION_TARGET_MS = {10: 10, 100: 25, 1000: 150}
+
+MEASURE = '''
+import json, sys, time
+t0 = time.time()
+import fabric.api
+t1 = time.time()
+import fabricawscfn
+t2 = time.time()
+group = fabricawscfn.StackGroup('bucket', 'prefix', 'templates')
+for i in range(%(stacks)d):
+    group.define_stack('stack%%d' %% i, 'example-stack%%d' %% i, 'stack%%d.yaml' %% i)
+namespace = {}
+group.generate_task(namespace)
+t3 = time.time()
+print(json.dumps(dict(
+    fabric_ms = (t1 - t0) * 1000,
+    import_ms = (t2 - t1) * 1000,
+    registration_ms = (t3 - t2) * 1000,
+    tasks = len(namespace),
+    boto3_loaded = 'boto3' in sys.modules,
+    prettytable_loaded = 'prettytable' in sys.modules
+)))
+'''
+
+
+def measure(stacks):
+    package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    output = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', MEASURE % dict(stacks = stacks)],
+        cwd = package_dir
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    exceeded = False
+    print('%6s %8s %10s %16s %6s %8s' % ('Stacks', 'Import', '(fabric)', 'Registration', 'Tasks', 'boto3'))
+    for stacks in sorted(REGISTRATION_TARGET_MS):
+        result = measure(stacks)
+        print('%6d %6.1fms %8.1fms %14.1fms %6d %8s' % (
+            stacks,
+            result['import_ms'],
+            result['fabric_ms'],
+            result['registration_ms'],
+            result['tasks'],
+            'loaded' if result['boto3_loaded'] else '-'
+        ))
+        if result['import_ms'] > IMPORT_TARGET_MS or result['registration_ms'] > REGISTRATION_TARGET_MS[stacks]:
+            exceeded = True
+        if result['boto3_loaded'] or result['prettytable_loaded']:
+            exceeded = True
+    if exceeded:
+        print('Exceeded startup target. (import %dms, registration %s)' % (IMPORT_TARGET_MS, REGISTRATION_TARGET_MS))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
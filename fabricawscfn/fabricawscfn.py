@@ -1,20 +1,50 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 from collections import OrderedDict
-from sets import Set
+import contextlib
 import datetime
+import functools
+import itertools
 import json
-
-import botocore
-import boto3
-from boto3.session import Session
+import os
+import re
+import sys
+import threading
+import time
 
 from fabric.api import *
 from fabric.operations import *
 from fabric.utils import *
 from fabric.colors import green, blue, yellow, red
 
-from prettytable import PrettyTable
+
+class LazyModule(object):
+    """
+    Module that is imported on first attribute access.
+    boto3, botocore, etc. are slow to import, so they are not imported until really used. (e.g. fab -l)
+    """
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attr):
+        import importlib
+        module = importlib.import_module(self.__name)
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # Sub module. (e.g. botocore.exceptions)
+            return importlib.import_module('%s.%s' % (self.__name, attr))
+
+botocore = LazyModule('botocore')
+yaml = LazyModule('yaml')
+
+
+def PrettyTable(*args, **kwargs):
+    """
+    Create prettytable.PrettyTable. (Import prettytable lazily)
+    """
+    from prettytable import PrettyTable as _PrettyTable
+    return _PrettyTable(*args, **kwargs)
 
 
 def confirm(func):
@@ -24,8 +54,6 @@ def confirm(func):
     :param func: Task function.
     :return: Decorated function.
     """
-    import functools
-
     def confirmed():
         from fabric.contrib.console import confirm as _confirm
         if env.NeedConfirm and not env.Confirmed:
@@ -36,15 +64,1259 @@ def confirm(func):
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        if confirmed():
-            func(*args, **kwargs)
+        # *_async methods are called by program, so never prompt.
+        if in_async_call() or confirmed():
+            return func(*args, **kwargs)
         else:
             abort(red('Canceled.'))
 
     return wrapper
 
 
+def _construct_cfn_tag(loader, tag_suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep = True)
+    else:
+        value = loader.construct_mapping(node, deep = True)
+
+    if tag_suffix in ['Ref', 'Condition']:
+        return {tag_suffix: value}
+    if tag_suffix == 'GetAtt' and isinstance(value, basestring):
+        value = value.split('.', 1)
+    return {'Fn::%s' % tag_suffix: value}
+
+
+def _construct_ordered_mapping(loader, node):
+    loader.flatten_mapping(node)
+    return OrderedDict(loader.construct_pairs(node, deep = True))
+
+
+_cfn_yaml_loader = None
+
+def cfn_yaml_loader():
+    """
+    YAML loader that understands CloudFormation short form intrinsic functions (!Ref, !Sub, ...).
+    Short forms are converted to long form. (e.g. !Ref Foo -> {'Ref': 'Foo'})
+    """
+    global _cfn_yaml_loader
+    if _cfn_yaml_loader is None:
+        class CfnYamlLoader(yaml.SafeLoader):
+            pass
+
+        # Keep definition order. (e.g. Parameters)
+        CfnYamlLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _construct_ordered_mapping)
+        CfnYamlLoader.add_multi_constructor('!', _construct_cfn_tag)
+        _cfn_yaml_loader = CfnYamlLoader
+    return _cfn_yaml_loader
+
+
+def load_template(template_local_path):
+    """
+    Load CloudFormation template (YAML or JSON) on local dir.
+
+    :param template_local_path: Template file path.
+    :return: Template as dict.
+    """
+    with open(template_local_path) as f:
+        return yaml.load(f, Loader = cfn_yaml_loader())
+
+
+def intrinsic_key(value):
+    """
+    Make comparable key of the export name / import value.
+    Fn::Sub is compared by its (not substituted) template string.
+
+    :param value: Literal string or intrinsic function.
+    :return: Key string.
+    """
+    if isinstance(value, dict) and value.keys() == ['Fn::Sub']:
+        value = value['Fn::Sub']
+        if isinstance(value, list):
+            value = value[0]
+    if isinstance(value, basestring):
+        return value
+    return json.dumps(value, sort_keys = True)
+
+
+def find_import_values(node):
+    """
+    Find all Fn::ImportValue in the template.
+
+    :param node: Template or part of template.
+    :return: List of import value keys.
+    """
+    found = []
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == 'Fn::ImportValue':
+                    found.append(intrinsic_key(value))
+                else:
+                    nodes.append(value)
+        elif isinstance(node, list):
+            nodes.extend(node)
+    return found
+
+
+def file_hash(path, algorithm = 'sha256'):
+    """
+    Calculate hash of the file content.
+
+    :param path: File path.
+    :param algorithm: Hash algorithm. (Default SHA-256)
+    :return: Hex digest.
+    """
+    import hashlib
+
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parameter_value(value):
+    """
+    Convert YAML / JSON value to stack parameter value.
+
+    :param value: String, number, bool or list. (List is joined by comma, for CommaDelimitedList)
+    :return: Parameter value string.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, list):
+        return ','.join(parameter_value(v) for v in value)
+    return value if isinstance(value, basestring) else str(value)
+
+
+def ssm_parameter_name(value):
+    """
+    :param value: Parameter value.
+    :return: Name of SSM parameter if the value is reference to SSM Parameter Store. ('ssm:NAME') Otherwise None.
+    """
+    if isinstance(value, basestring) and value.startswith('ssm:'):
+        return value[len('ssm:'):]
+    return None
+
+
+STACK_OUTPUT_REFERENCE = re.compile(r'\{\{stack:([^.{}]+)\.Outputs\.([^.{}]+)\}\}')
+
+
+def stack_output_references(value):
+    """
+    Find references to outputs of defined stacks ('{{stack:ALIAS.Outputs.KEY}}') in parameter value.
+
+    :param value: Parameter value.
+    :return: List of (Stack alias, Output key).
+    """
+    if not isinstance(value, basestring):
+        return []
+    return STACK_OUTPUT_REFERENCE.findall(value)
+
+
+def parameters_from_template(template):
+    """
+    Extract parameter definitions from template, in the same format as get_template_summary.
+
+    :param template: Template as dict.
+    :return: Parameter definitions.
+    """
+    param_defs = []
+    for param_key, param in (template.get('Parameters') or {}).items():
+        param_def = {
+            'ParameterKey': param_key,
+            'ParameterType': param.get('Type'),
+            'NoEcho': parameter_value(param.get('NoEcho', False)) == 'true'
+        }
+        if 'Default' in param:
+            param_def['DefaultValue'] = parameter_value(param['Default'])
+        if 'Description' in param:
+            param_def['Description'] = param['Description']
+        param_defs.append(param_def)
+    return param_defs
+
+
+TEMPLATE_SECTIONS = ['AWSTemplateFormatVersion', 'Description', 'Metadata', 'Parameters', 'Rules', 'Mappings',
+                     'Conditions', 'Transform', 'Resources', 'Outputs', 'Hooks']
+RESOURCE_ATTRIBUTES = ['Type', 'Properties', 'DependsOn', 'Condition', 'CreationPolicy', 'DeletionPolicy',
+                       'UpdatePolicy', 'UpdateReplacePolicy', 'Metadata', 'Version']
+PSEUDO_PARAMETERS = ['AWS::AccountId', 'AWS::NotificationARNs', 'AWS::NoValue', 'AWS::Partition', 'AWS::Region',
+                     'AWS::StackId', 'AWS::StackName', 'AWS::URLSuffix']
+# Max size of TemplateBody. Larger templates must be validated / deployed by TemplateURL.
+MAX_TEMPLATE_BODY_BYTES = 51200
+# Max size of template on S3.
+MAX_TEMPLATE_BYTES = 1024 * 1024
+
+
+def check_template(template):
+    """
+    Check structure of the template without calling API.
+    Checks sections, resource definitions, and references by Ref / Fn::GetAtt / Fn::Sub / DependsOn / conditions.
+
+    :param template: Template as dict.
+    :return: List of error messages. Empty if no errors.
+    """
+    if not isinstance(template, dict):
+        return ['Template is not a mapping.']
+
+    # Macros may accept other sections / resource attributes. (e.g. Globals of AWS::Serverless)
+    transformed = 'Transform' in template
+    errors = ['Unknown section %s.' % section for section in template if section not in TEMPLATE_SECTIONS and not transformed]
+    for section in ['Parameters', 'Mappings', 'Conditions', 'Resources', 'Outputs']:
+        if section in template and not isinstance(template[section], dict):
+            return errors + ['%s must be a mapping.' % section]
+
+    parameters = template.get('Parameters') or {}
+    conditions = template.get('Conditions') or {}
+    resources = template.get('Resources') or {}
+    outputs = template.get('Outputs') or {}
+    if not resources:
+        errors.append('Resources must have at least one resource.')
+
+    for param_key, param in parameters.items():
+        if not isinstance(param, dict) or 'Type' not in param:
+            errors.append('Parameter %s has no Type.' % param_key)
+    for logical_id, resource in resources.items():
+        if not isinstance(resource, dict) or not isinstance(resource.get('Type'), basestring):
+            errors.append('Resource %s has no Type.' % logical_id)
+            continue
+        for attribute in resource:
+            if attribute not in RESOURCE_ATTRIBUTES and not transformed:
+                errors.append('Resource %s has unknown attribute %s.' % (logical_id, attribute))
+        depends_on = resource.get('DependsOn', [])
+        for dependency in depends_on if isinstance(depends_on, list) else [depends_on]:
+            if dependency not in resources:
+                errors.append('Resource %s depends on undefined resource %s.' % (logical_id, dependency))
+    for output_key, output in outputs.items():
+        if not isinstance(output, dict) or 'Value' not in output:
+            errors.append('Output %s has no Value.' % output_key)
+    for section_name, section in [('Resource', resources), ('Output', outputs)]:
+        for key, value in section.items():
+            condition = value.get('Condition') if isinstance(value, dict) else None
+            if condition is not None and condition not in conditions:
+                errors.append('%s %s uses undefined condition %s.' % (section_name, key, condition))
+
+    # Macros may add resources / parameters, so references can not be checked.
+    if transformed:
+        return errors
+
+    def check_ref(section_key, name, refs):
+        if isinstance(name, basestring) and name not in refs:
+            errors.append('%s refers undefined %s.' % (section_key, name))
+
+    ref_names = set(parameters) | set(resources) | set(PSEUDO_PARAMETERS)
+    sub_variable = re.compile(r'\$\{([^!}][^}]*)\}')
+    nodes = list(itertools.chain(
+        (('Condition %s' % key, value) for key, value in conditions.items()),
+        (('Resource %s' % key, value) for key, value in resources.items()),
+        (('Output %s' % key, value) for key, value in outputs.items())
+    ))
+    while nodes:
+        section_key, node = nodes.pop()
+        if isinstance(node, list):
+            nodes.extend((section_key, value) for value in node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        if len(node) == 1:
+            function, value = list(node.items())[0]
+            if function == 'Ref':
+                check_ref(section_key, value, ref_names)
+            elif function == 'Fn::GetAtt':
+                if isinstance(value, basestring):
+                    value = value.split('.', 1)
+                if isinstance(value, list) and len(value) == 2:
+                    check_ref(section_key, value[0], resources)
+                else:
+                    errors.append('%s has malformed Fn::GetAtt.' % section_key)
+            elif function == 'Fn::Sub':
+                variables = {}
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[1], dict):
+                    value, variables = value
+                if isinstance(value, basestring):
+                    for variable in sub_variable.findall(value):
+                        if variable not in variables:
+                            check_ref(section_key, variable.split('.', 1)[0], ref_names)
+            elif function == 'Fn::If' and isinstance(value, list) and value:
+                check_ref(section_key, value[0], conditions)
+            elif function == 'Condition' and section_key.startswith('Condition '):
+                check_ref(section_key, value, conditions)
+        nodes.extend((section_key, value) for value in node.values())
+    return errors
+
+
+def check_template_file(template_local_path):
+    """
+    Load template on local dir, and check its structure. (Module level function, to run in worker processes)
+
+    :param template_local_path: Template file path.
+    :return: List of error messages. Empty if no errors.
+    """
+    try:
+        if os.path.getsize(template_local_path) > MAX_TEMPLATE_BYTES:
+            return ['Template exceeds %d bytes.' % MAX_TEMPLATE_BYTES]
+        template = load_template(template_local_path)
+    except (IOError, OSError) as e:
+        return ['Can not read template. %s' % e]
+    except yaml.YAMLError as e:
+        return ['Can not parse template. %s' % e]
+    errors = check_template(template)
+    if errors:
+        return errors
+
+    # Nested templates referred by relative path are packaged by sync_templates.
+    for logical_id, resource in (template.get('Resources') or {}).items():
+        if resource['Type'] != 'AWS::CloudFormation::Stack':
+            continue
+        properties = resource.get('Properties')
+        template_url = properties.get('TemplateURL') if isinstance(properties, dict) else None
+        if isinstance(template_url, basestring) and '://' not in template_url:
+            if not os.path.isfile(os.path.join(os.path.dirname(template_local_path), template_url)):
+                errors.append('Nested template %s of resource %s does not exist.' % (template_url, logical_id))
+    return errors
+
+
+class TemplateSummaryCache(object):
+    """
+    Local cache of template parameter definitions, keyed by template content hash.
+    Least recently used entries are evicted when the number of entries exceeds max_entries.
+    """
+    def __init__(self, cache_dir, max_entries = 256):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def __entry_path(self, content_hash):
+        return os.path.join(self.cache_dir, '%s.json' % content_hash)
+
+    def get(self, content_hash):
+        path = self.__entry_path(content_hash)
+        try:
+            with open(path) as f:
+                param_defs = json.load(f)
+        except (IOError, ValueError):
+            return None
+        # Touch for LRU.
+        os.utime(path, None)
+        return param_defs
+
+    def put(self, content_hash, param_defs):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        with open(self.__entry_path(content_hash), 'w') as f:
+            json.dump(param_defs, f)
+        self.evict()
+
+    def evict(self):
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key = os.path.getmtime)
+        for path in entries[:len(entries) - self.max_entries]:
+            os.remove(path)
+
+
+class StackStateStore(object):
+    """
+    Local index of stack summaries, descriptions and exports per AWS target (profile / region), in SQLite.
+    Within TTL, reads are served without calling API.
+    After TTL, refreshed by listing stacks. Descriptions and exports of changed stacks are marked as stale.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS listings (target TEXT PRIMARY KEY, listed_at REAL, exports_cached INTEGER DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS stacks (
+            target TEXT, stack_name TEXT, position INTEGER, version TEXT, summary TEXT, description TEXT, exports_stale INTEGER,
+            PRIMARY KEY (target, stack_name));
+        CREATE TABLE IF NOT EXISTS exports (target TEXT, stack_name TEXT, export TEXT);
+        CREATE INDEX IF NOT EXISTS exports_stack ON exports (target, stack_name);
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+
+    @contextlib.contextmanager
+    def transaction(self):
+        import sqlite3
+
+        state_dir = os.path.dirname(self.path)
+        if state_dir and not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        # Wait for other processes writing the index.
+        conn = sqlite3.connect(self.path, timeout = 30)
+        try:
+            with conn:
+                conn.executescript(self.SCHEMA)
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def encode(value):
+        def default(o):
+            if isinstance(o, datetime.datetime):
+                return {'$datetime': o.isoformat()}
+            raise TypeError('%r is not JSON serializable' % o)
+        return json.dumps(value, default = default)
+
+    @staticmethod
+    def parse_datetime(text):
+        """
+        Parse datetime.isoformat(). (Faster than dateutil.parser)
+        """
+        from dateutil.tz import tzutc, tzoffset
+
+        tz = None
+        if len(text) > 6 and text[-6] in '+-' and text[-3] == ':':
+            text, offset = text[:-6], text[-6:]
+            seconds = (int(offset[1:3]) * 60 + int(offset[4:6])) * 60 * (-1 if offset[0] == '-' else 1)
+            tz = tzutc() if seconds == 0 else tzoffset(None, seconds)
+        value = datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f' if '.' in text else '%Y-%m-%dT%H:%M:%S')
+        return value.replace(tzinfo = tz)
+
+    @classmethod
+    def decode(cls, text):
+        def object_hook(o):
+            if len(o) == 1 and '$datetime' in o:
+                return cls.parse_datetime(o['$datetime'])
+            return o
+        return json.loads(text, object_hook = object_hook)
+
+    def version_of(self, summary):
+        """
+        Version of the stack. Changes when the stack is created, updated, changes status or detected drifts.
+        """
+        drift_info = summary.get('DriftInformation', {})
+        return self.encode([
+            summary['StackId'],
+            summary['StackStatus'],
+            summary.get('LastUpdatedTime') or summary['CreationTime'],
+            drift_info.get('StackDriftStatus'),
+            drift_info.get('LastCheckTimestamp')
+        ])
+
+    def is_fresh(self, target):
+        with self.transaction() as conn:
+            row = conn.execute('SELECT listed_at FROM listings WHERE target = ?', (target,)).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def refresh(self, target, summaries):
+        """
+        Apply listed stacks to the index.
+
+        :param target: Target key.
+        :param summaries: All stack summaries of the target, listed by list_stacks.
+        :return: Number of stacks created, changed or deleted since last refresh.
+        """
+        with self.transaction() as conn:
+            known = dict(
+                (stack_name, (position, version)) for stack_name, position, version
+                in conn.execute('SELECT stack_name, position, version FROM stacks WHERE target = ?', (target,))
+            )
+            changes = 0
+            for position, summary in enumerate(summaries):
+                stack_name = summary['StackName']
+                version = self.version_of(summary)
+                known_position, known_version = known.pop(stack_name, (None, None))
+                if known_version != version:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO stacks (target, stack_name, position, version, summary, description, exports_stale) VALUES (?, ?, ?, ?, ?, NULL, 1)',
+                        (target, stack_name, position, version, self.encode(summary))
+                    )
+                    changes += 1
+                elif known_position != position:
+                    conn.execute('UPDATE stacks SET position = ? WHERE target = ? AND stack_name = ?', (position, target, stack_name))
+            # Deleted stacks.
+            for stack_name in known:
+                conn.execute('DELETE FROM stacks WHERE target = ? AND stack_name = ?', (target, stack_name))
+                conn.execute('DELETE FROM exports WHERE target = ? AND stack_name = ?', (target, stack_name))
+                changes += 1
+            conn.execute('INSERT OR IGNORE INTO listings (target) VALUES (?)', (target,))
+            conn.execute('UPDATE listings SET listed_at = ? WHERE target = ?', (time.time(), target))
+        return changes
+
+    def invalidate(self, target = None):
+        """
+        Refresh on next read, regardless of TTL.
+
+        :param target: Target key. (OPTIONAL. Default all targets)
+        """
+        with self.transaction() as conn:
+            if target is None:
+                conn.execute('UPDATE listings SET listed_at = 0')
+            else:
+                conn.execute('UPDATE listings SET listed_at = 0 WHERE target = ?', (target,))
+
+    def summaries(self, target):
+        with self.transaction() as conn:
+            rows = conn.execute('SELECT summary FROM stacks WHERE target = ? ORDER BY position', (target,)).fetchall()
+        return [self.decode(summary) for summary, in rows]
+
+    def description(self, target, stack_name):
+        """
+        :return: (Listed or not, Result of describe_stacks or None)
+        """
+        with self.transaction() as conn:
+            row = conn.execute('SELECT description FROM stacks WHERE target = ? AND stack_name = ?', (target, stack_name)).fetchone()
+        if row is None:
+            return False, None
+        return True, self.decode(row[0]) if row[0] is not None else None
+
+    def put_description(self, target, stack_name, description):
+        """
+        Store description of the stack, and replace exports of the stack by its outputs.
+
+        :param description: Result of describe_stacks. None if the stack has been deleted.
+        """
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM exports WHERE target = ? AND stack_name = ?', (target, stack_name))
+            if description is None:
+                conn.execute('DELETE FROM stacks WHERE target = ? AND stack_name = ?', (target, stack_name))
+                return
+            conn.execute(
+                'UPDATE stacks SET description = ?, exports_stale = 0 WHERE target = ? AND stack_name = ?',
+                (self.encode(description), target, stack_name)
+            )
+            for output in description.get('Outputs', []):
+                if output.get('ExportName'):
+                    conn.execute('INSERT INTO exports (target, stack_name, export) VALUES (?, ?, ?)', (target, stack_name, self.encode({
+                        'ExportingStackId': description['StackId'],
+                        'Name': output['ExportName'],
+                        'Value': output['OutputValue']
+                    })))
+
+    def exports(self, target):
+        """
+        :return: (Exports, Names of the stacks whose exports are stale) (None, None) if exports are not cached.
+        """
+        with self.transaction() as conn:
+            row = conn.execute('SELECT exports_cached FROM listings WHERE target = ?', (target,)).fetchone()
+            if row is None or not row[0]:
+                return None, None
+            exports = conn.execute('SELECT export FROM exports WHERE target = ? ORDER BY rowid', (target,)).fetchall()
+            stale_stack_names = conn.execute('SELECT stack_name FROM stacks WHERE target = ? AND exports_stale = 1', (target,)).fetchall()
+        return [self.decode(export) for export, in exports], [stack_name for stack_name, in stale_stack_names]
+
+    def put_exports(self, target, exports):
+        """
+        Replace all exports of the target by listed exports.
+        """
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM exports WHERE target = ?', (target,))
+            for export in exports:
+                # arn:aws:cloudformation:REGION:ACCOUNT:stack/STACK_NAME/ID
+                conn.execute(
+                    'INSERT INTO exports (target, stack_name, export) VALUES (?, ?, ?)',
+                    (target, export['ExportingStackId'].split('/')[1], self.encode(export))
+                )
+            conn.execute('UPDATE stacks SET exports_stale = 0 WHERE target = ?', (target,))
+            conn.execute('UPDATE listings SET exports_cached = 1 WHERE target = ?', (target,))
+
+
+def find_defined_stack_name(stack_name_index, stack_name):
+    """
+    Find defined stack name that matches the stack name.
+    Matches the defined stack name itself, and chained stack (DEFINED_STACK_NAME-xxx).
+    Lookups only the prefixes split by '-', so cost does not depend on number of defined stacks.
+    Longest prefix wins. (e.g. 'app-db-replica' matches 'app-db' rather than 'app')
+
+    :param stack_name_index: {Actual stack name, Stack alias}
+    :param stack_name: Stack name.
+    :return: Defined stack name. None if not matched.
+    """
+    if stack_name in stack_name_index:
+        return stack_name
+    pos = stack_name.rfind('-')
+    while pos > 0:
+        prefix = stack_name[:pos]
+        if prefix in stack_name_index:
+            return prefix
+        pos = stack_name.rfind('-', 0, pos)
+    return None
+
+
+class StackHierarchy(object):
+    """
+    Tree of stacks, built in one pass over stack summaries by ParentId / RootId.
+    Nested stacks are indexed under their parent and root stacks, so lookups never scan the summaries again.
+    """
+    def __init__(self, summaries):
+        # {Stack ID, Summary}
+        self.stacks = {}
+        # Summaries of root (not nested) stacks, in listed order.
+        self.roots = []
+        # {Stack name, Summary of root stack}
+        self.roots_by_name = {}
+        # {Parent stack ID, [Summaries of child stacks]}
+        self.children = {}
+        # {Root stack ID, Number of nested stacks}
+        self.nested_counts = {}
+        for summary in summaries:
+            self.stacks[summary['StackId']] = summary
+            parent_id = summary.get('ParentId')
+            if parent_id is None:
+                self.roots.append(summary)
+                self.roots_by_name[summary['StackName']] = summary
+            else:
+                self.children.setdefault(parent_id, []).append(summary)
+                root_id = summary.get('RootId', parent_id)
+                self.nested_counts[root_id] = self.nested_counts.get(root_id, 0) + 1
+
+    def root(self, stack_name):
+        """
+        :param stack_name: Stack name.
+        :return: Summary of the root stack. None if not exists.
+        """
+        return self.roots_by_name.get(stack_name)
+
+    def parent(self, summary):
+        """
+        :param summary: Summary of nested stack.
+        :return: Summary of the parent stack. None if not nested or the parent is not listed.
+        """
+        return self.stacks.get(summary.get('ParentId'))
+
+    def iter_nested(self, stack_id):
+        """
+        Iterate nested stacks under the stack, depth first.
+
+        :param stack_id: Stack ID.
+        :return: Iterator of (Depth, Summary). Depth of children is 1.
+        """
+        pending = [(1, child) for child in reversed(self.children.get(stack_id, []))]
+        while pending:
+            depth, summary = pending.pop()
+            yield depth, summary
+            pending.extend((depth + 1, child) for child in reversed(self.children.get(summary['StackId'], [])))
+
+    def tree_stack_names(self, stack_name):
+        """
+        :param stack_name: Stack name.
+        :return: Names of the stack and its nested stacks, depth first.
+        """
+        root = self.root(stack_name)
+        if root is None:
+            return [stack_name]
+        return [stack_name] + [summary['StackName'] for depth, summary in self.iter_nested(root['StackId'])]
+
+
+def parallel_map(func, items, workers):
+    """
+    Apply function to items on worker threads.
+
+    :param func: Function.
+    :param items: Items.
+    :param workers: Max number of worker threads.
+    :return: Results in the same order as items.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    items = list(items)
+    if not items:
+        return []
+    pool = ThreadPool(max(1, min(int(workers), len(items))))
+    try:
+        # Wait with timeout, to accept ctrl+C.
+        return pool.map_async(func, items).get(60 * 60 * 24)
+    finally:
+        pool.terminate()
+
+
+def parallel_imap(func, items, workers):
+    """
+    Same as parallel_map(), but yield each result as soon as it is available.
+
+    :param func: Function.
+    :param items: Items.
+    :param workers: Max number of worker threads.
+    :return: Generator of results in the same order as items.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    items = list(items)
+    if not items:
+        return
+    pool = ThreadPool(max(1, min(int(workers), len(items))))
+    try:
+        results = pool.imap(func, items)
+        for _ in items:
+            # Wait with timeout, to accept ctrl+C.
+            yield results.next(60 * 60 * 24)
+    finally:
+        pool.terminate()
+
+
+def parallel_process_map(func, items, processes = None):
+    """
+    Apply function to items on worker processes. For CPU bound work. (e.g. parsing templates)
+    Few items are processed in the current process, because starting processes costs more.
+
+    :param func: Module level function.
+    :param items: Items. (Must be picklable)
+    :param processes: Max number of worker processes. (Default number of CPUs)
+    :return: Results in the same order as items.
+    """
+    import multiprocessing
+
+    items = list(items)
+    processes = min(int(processes or multiprocessing.cpu_count()), len(items) // 8)
+    if processes < 2:
+        return [func(item) for item in items]
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Wait with timeout, to accept ctrl+C.
+        return pool.map_async(func, items, chunksize = max(1, len(items) // (processes * 4))).get(60 * 60 * 24)
+    finally:
+        pool.terminate()
+
+
+# Stack parameters of *_async method running on current thread.
+_async_context = threading.local()
+
+
+def in_async_call():
+    return getattr(_async_context, 'params', None) is not None
+
+
+def echo(*args, **kwargs):
+    """
+    Print progress of stack operation. Suppressed in *_async calls, because they return results as data.
+    """
+    if not in_async_call():
+        print(*args, **kwargs)
+
+
+class RowWriter(object):
+    """
+    Write table rows as JSON Lines or CSV as soon as they are fetched, instead of PrettyTable.
+    Values are written without color. CSV header is written once, so rows must have the same columns unless csv_columns is specified.
+    """
+    FORMATS = ['jsonl', 'csv']
+
+    def __init__(self, output_format, stream = None, csv_columns = None):
+        """
+        Create RowWriter.
+
+        :param output_format: 'jsonl' or 'csv'.
+        :param stream: Stream to write.(OPTIONAL. Default stdout)
+        :param csv_columns: CSV header that contains columns of all rows. Missing columns of a row are empty.(OPTIONAL. Default columns of the first row)
+        """
+        if output_format not in self.FORMATS:
+            abort(red('Unknown output format %s. (Available: %s)' % (output_format, ', '.join(self.FORMATS))))
+        self.output_format = output_format
+        self.stream = stream or sys.stdout
+        self.csv_columns = list(csv_columns) if csv_columns is not None else None
+        self.__lock = threading.Lock()
+        self.__csv_header_written = False
+
+    def to_value(self, value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        return value
+
+    def write(self, columns, row):
+        """
+        Write a row.
+
+        :param columns: Column names.
+        :param row: Raw values. (Not colored)
+        """
+        values = [self.to_value(value) for value in row]
+        with self.__lock:
+            if self.output_format == 'jsonl':
+                self.stream.write(json.dumps(OrderedDict(zip(columns, values))) + '\n')
+            else:
+                import csv
+                writer = csv.writer(self.stream)
+                if self.csv_columns is None:
+                    self.csv_columns = list(columns)
+                if not self.__csv_header_written:
+                    writer.writerow(self.csv_columns)
+                    self.__csv_header_written = True
+                row_values = dict(zip(columns, values))
+                writer.writerow([
+                    '' if value is None else (value.encode('utf-8') if isinstance(value, unicode) else value)
+                    for value in [row_values.get(column) for column in self.csv_columns]
+                ])
+            self.stream.flush()
+
+
+def backoff_intervals(initial = 2, maximum = 30, factor = 1.5):
+    """
+    Generate polling intervals that grows from initial to maximum.
+
+    :param initial: First interval seconds.
+    :param maximum: Max interval seconds.
+    :param factor: Growth factor per poll.
+    """
+    interval = initial
+    while True:
+        yield interval
+        interval = min(interval * factor, maximum)
+
+
+def is_stack_not_found(error):
+    """
+    Check the error of CloudFormation API means the stack does not exist.
+
+    :param error: botocore.exceptions.ClientError
+    :return: True if the stack does not exist.
+    """
+    return error.response['Error']['Code'] == 'ValidationError' and 'does not exist' in error.response['Error']['Message']
+
+
+class ClientPool(object):
+    """
+    Cache of boto3 sessions and clients per (profile, region, credentials).
+    Sessions share botocore data loader, so service models are loaded only once.
+    """
+    def __init__(self, max_pool_connections = 10, retries = None):
+        self.config_args = dict(max_pool_connections = max_pool_connections)
+        if retries is not None:
+            self.config_args['retries'] = retries
+        self.__config = None
+        self.__lock = threading.RLock()
+        self.__data_loader = None
+        # {Session key, boto3 session}
+        self.__sessions = {}
+        # {(Session key, Service name, Is resource), boto3 client or resource}
+        self.__clients = {}
+
+    def config(self):
+        if self.__config is None:
+            from botocore.config import Config
+            self.__config = Config(**self.config_args)
+        return self.__config
+
+    def has_session(self, key):
+        return key in self.__sessions
+
+    def session(self, key):
+        """
+        Get session.
+
+        :param key: (Profile name, Region, Access key ID, Secret access key)
+        :return: boto3 session.
+        """
+        with self.__lock:
+            if key not in self.__sessions:
+                import botocore.session
+                from boto3.session import Session
+
+                profile_name, region_name, access_key_id, secret_access_key = key
+                botocore_session = botocore.session.Session()
+                if self.__data_loader is None:
+                    self.__data_loader = botocore_session.get_component('data_loader')
+                else:
+                    botocore_session.register_component('data_loader', self.__data_loader)
+                self.__sessions[key] = Session(
+                    profile_name = profile_name,
+                    region_name = region_name,
+                    aws_access_key_id = access_key_id,
+                    aws_secret_access_key = secret_access_key,
+                    botocore_session = botocore_session
+                )
+            return self.__sessions[key]
+
+    def client(self, key, service_name):
+        with self.__lock:
+            if (key, service_name, False) not in self.__clients:
+                self.__clients[(key, service_name, False)] = self.session(key).client(service_name, config = self.config())
+            return self.__clients[(key, service_name, False)]
+
+    def resource(self, key, service_name):
+        with self.__lock:
+            if (key, service_name, True) not in self.__clients:
+                self.__clients[(key, service_name, True)] = self.session(key).resource(service_name, config = self.config())
+            return self.__clients[(key, service_name, True)]
+
+
+class TokenBucket(object):
+    """
+    Token bucket shared by threads. Adjusted by AIMD (Additive increase / Multiplicative decrease) on responses.
+    Unlimited until the first throttling response, unless max rate is specified.
+    """
+    MIN_RATE = 0.5
+    # Calls/sec added per second without throttling.
+    INCREASE_PER_SECOND = 1.0
+    DECREASE_FACTOR = 0.7
+
+    def __init__(self, max_rate = None):
+        """
+        :param max_rate: Max calls per second. (OPTIONAL. Default unlimited)
+        """
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.tokens = 1.0
+        self.lock = threading.Lock()
+        now = time.time()
+        self.refilled_at = now
+        self.adjusted_at = now
+        self.decreased_at = 0.0
+        # Send times in last second, to measure current rate.
+        self.sent_times = []
+
+    def acquire(self):
+        """
+        Take a token. Blocks until available.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.sent_times = [sent_time for sent_time in self.sent_times if now - sent_time < 1.0]
+                if self.rate is None:
+                    self.sent_times.append(now)
+                    return
+                # Allow burst of 1 second.
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.refilled_at) * self.rate)
+                self.refilled_at = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.sent_times.append(now)
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            now = time.time()
+            if self.rate is not None:
+                self.rate = self.rate + (now - self.adjusted_at) * self.INCREASE_PER_SECOND
+                if self.max_rate is not None:
+                    self.rate = min(self.rate, self.max_rate)
+            self.adjusted_at = now
+
+    def on_throttled(self):
+        with self.lock:
+            now = time.time()
+            # Throttled responses of the same burst decrease rate only once.
+            if now - self.decreased_at < 1.0:
+                return
+            current_rate = self.rate if self.rate is not None else len(self.sent_times)
+            self.rate = max(self.MIN_RATE, current_rate * self.DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            self.adjusted_at = now
+            self.decreased_at = now
+
+
+class ApiRateLimiter(object):
+    """
+    Client side rate limiter of CloudFormation API, shared by all clients and threads.
+    A token bucket per target (profile, region, account) and operation family (describe or mutate).
+    Each attempt (includes retry) takes a token, and throttling responses slow down the bucket.
+    """
+    THROTTLING_ERROR_CODES = [
+        'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+        'TooManyRequestsException', 'RequestLimitExceeded']
+
+    def __init__(self):
+        # {Operation family, Max calls per second} None means unlimited until throttled.
+        self.max_rates = {'describe': None, 'mutate': None}
+        # {(Session key, Operation family), TokenBucket}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def operation_family(operation_name):
+        for prefix in ['Describe', 'List', 'Get', 'Validate', 'Estimate']:
+            if operation_name.startswith(prefix):
+                return 'describe'
+        return 'mutate'
+
+    def bucket(self, key, event_name):
+        # e.g. before-send.cloudformation.DescribeStacks
+        family = self.operation_family(event_name.split('.')[-1])
+        with self.lock:
+            if (key, family) not in self.buckets:
+                self.buckets[(key, family)] = TokenBucket(self.max_rates[family])
+            return self.buckets[(key, family)]
+
+    def attach(self, client, key):
+        """
+        Register event handlers to boto3 client or resource.
+
+        :param client: boto3 client or resource.
+        :param key: Session key. Clients of the same key share buckets.
+        :return: The client or resource.
+        """
+        events = client.meta.client.meta.events if hasattr(client.meta, 'client') else client.meta.events
+
+        def before_send(event_name, **kwargs):
+            self.bucket(key, event_name).acquire()
+
+        def needs_retry(event_name, response = None, **kwargs):
+            if response is None:
+                return
+            http_response, parsed = response
+            if parsed.get('Error', {}).get('Code') in self.THROTTLING_ERROR_CODES:
+                self.bucket(key, event_name).on_throttled()
+            elif http_response.status_code < 400:
+                self.bucket(key, event_name).on_success()
+
+        # unique_id prevents duplicate registration.
+        events.register('before-send', before_send, unique_id = 'fabricawscfn-rate-limiter-before-send')
+        events.register('needs-retry', needs_retry, unique_id = 'fabricawscfn-rate-limiter-needs-retry')
+        return client
+
+
+class ApiInstrumentation(object):
+    """
+    Record API calls of boto3 clients per task, by botocore events.
+    Latency is measured from 'before-parameter-build' to 'after-call', so it includes retries.
+    Records call count, latency histogram, retries and bytes per operation.
+    """
+    # Upper bounds of latency histogram buckets. (milliseconds)
+    LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+    def __init__(self):
+        self.enabled = False
+        # JSON file to write summaries.
+        self.output_path = None
+        self.__lock = threading.Lock()
+        self.__task_name = None
+        self.__started = None
+        # {Service.Operation, Stats}
+        self.__operations = OrderedDict()
+        # Summaries of finished tasks.
+        self.__summaries = []
+
+    def attach(self, client):
+        """
+        Register event handlers to boto3 client or resource, if turned on.
+
+        :param client: boto3 client or resource.
+        :return: The client or resource.
+        """
+        if self.enabled:
+            events = client.meta.client.meta.events if hasattr(client.meta, 'client') else client.meta.events
+            # unique_id prevents duplicate registration.
+            events.register('before-parameter-build', self.before_parameter_build, unique_id = 'fabricawscfn-instrumentation-before-parameter-build')
+            events.register_first('before-call', self.before_call, unique_id = 'fabricawscfn-instrumentation-before-call')
+            events.register('after-call', self.after_call, unique_id = 'fabricawscfn-instrumentation-after-call')
+        return client
+
+    def before_parameter_build(self, context, **kwargs):
+        context['instrumentation_started'] = time.time()
+        context['instrumentation_request_bytes'] = 0
+
+    def before_call(self, params, context, **kwargs):
+        # Not called if the other handler returned response. (e.g. Stubber)
+        body = params.get('body')
+        if isinstance(body, dict):
+            # Query protocol. Body is form encoded later.
+            from urllib import urlencode
+            body = urlencode(body, True)
+        context['instrumentation_request_bytes'] = len(body) if body else 0
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        if 'instrumentation_started' not in context:
+            return
+        latency_ms = (time.time() - context['instrumentation_started']) * 1000
+        response_bytes = http_response.headers.get('content-length')
+        if response_bytes is None and http_response.raw is not None and not model.has_streaming_output:
+            response_bytes = len(http_response.content or '')
+
+        name = '%s.%s' % (model.service_model.service_name, model.name)
+        with self.__lock:
+            stats = self.__operations.get(name)
+            if stats is None:
+                stats = self.__operations[name] = dict(
+                    calls = 0, errors = 0, retries = 0, request_bytes = 0, response_bytes = 0,
+                    total_ms = 0.0, max_ms = 0.0, histogram = [0] * (len(self.LATENCY_BUCKETS_MS) + 1)
+                )
+            stats['calls'] += 1
+            if http_response.status_code >= 300:
+                stats['errors'] += 1
+            stats['retries'] += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            stats['request_bytes'] += context['instrumentation_request_bytes']
+            stats['response_bytes'] += int(response_bytes or 0)
+            stats['total_ms'] += latency_ms
+            stats['max_ms'] = max(stats['max_ms'], latency_ms)
+            bucket = len(self.LATENCY_BUCKETS_MS)
+            for i, upper_bound in enumerate(self.LATENCY_BUCKETS_MS):
+                if latency_ms <= upper_bound:
+                    bucket = i
+                    break
+            stats['histogram'][bucket] += 1
+
+    def start(self, task_name):
+        with self.__lock:
+            self.__task_name = task_name
+            self.__started = time.time()
+            self.__operations = OrderedDict()
+
+    def finish(self):
+        """
+        Show summary of API calls in the task, and write summaries to JSON file if specified.
+        Tasks without API calls are ignored.
+        """
+        with self.__lock:
+            operations = self.__operations
+            self.__operations = OrderedDict()
+        if not operations:
+            return
+        elapsed = time.time() - self.__started
+
+        print(blue('API calls of task %s: %d calls in %.2fs' % (
+            self.__task_name, sum(stats['calls'] for stats in operations.values()), elapsed
+        ), bold = True))
+        table = PrettyTable(['Operation', 'Calls', 'Errors', 'Retries', 'Avg(ms)', 'Max(ms)', 'Sent', 'Received', 'Latency(ms)'])
+        table.align['Operation'] = 'l'
+        table.align['Latency(ms)'] = 'l'
+        for name, stats in sorted(operations.items(), key = lambda item: item[1]['total_ms'], reverse = True):
+            table.add_row([
+                name,
+                stats['calls'],
+                stats['errors'],
+                stats['retries'],
+                '%.1f' % (stats['total_ms'] / stats['calls']),
+                '%.1f' % stats['max_ms'],
+                stats['request_bytes'],
+                stats['response_bytes'],
+                self.format_histogram(stats['histogram'])
+            ])
+        print(table)
+
+        if self.output_path:
+            self.__summaries.append(OrderedDict([
+                ('task', self.__task_name),
+                ('started', datetime.datetime.utcfromtimestamp(self.__started).isoformat() + 'Z'),
+                ('elapsed_s', elapsed),
+                ('latency_buckets_ms', self.LATENCY_BUCKETS_MS),
+                ('operations', operations)
+            ]))
+            with open(self.output_path, 'w') as f:
+                json.dump({'tasks': self.__summaries}, f, indent = 2)
+
+    def format_histogram(self, histogram):
+        """
+        Format histogram like '<=10:3 <=25:1 >5000:1'. (Empty buckets are omitted)
+        """
+        labels = ['<=%d' % upper_bound for upper_bound in self.LATENCY_BUCKETS_MS] + ['>%d' % self.LATENCY_BUCKETS_MS[-1]]
+        return ' '.join('%s:%d' % (label, count) for label, count in zip(labels, histogram) if count)
+
+
+class StackEventTracker(object):
+    """
+    Track stack operation by tailing stack events, instead of boto3 waiter.
+    Polls fast at first and slow down while no events arrive, returns as soon as stack reaches terminal status.
+    """
+    TERMINAL_STATUSES = [
+        'CREATE_COMPLETE', 'CREATE_FAILED',
+        'ROLLBACK_COMPLETE', 'ROLLBACK_FAILED',
+        'DELETE_COMPLETE', 'DELETE_FAILED',
+        'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE', 'UPDATE_ROLLBACK_FAILED',
+        'IMPORT_COMPLETE', 'IMPORT_ROLLBACK_COMPLETE', 'IMPORT_ROLLBACK_FAILED']
+
+    def __init__(self, stack_group, stack_id, last_event_id = None):
+        """
+        Create StackEventTracker.
+
+        :param stack_group: StackGroup.
+        :param stack_id: Stack ID. (Use ID instead of name to track deleted stack)
+        :param last_event_id: Cursor. Events until this event are ignored.(OPTIONAL. Default track all events)
+        """
+        self.stack_group = stack_group
+        self.stack_id = stack_id
+        # Stack name to attribute events of stacks tracked at the same time. (e.g. create_all)
+        self.stack_name = stack_id.split('/')[1] if stack_id.startswith('arn:') else stack_id
+        self.last_event_id = last_event_id
+
+    @classmethod
+    def from_latest_event(cls, stack_group, stack_id):
+        """
+        Create StackEventTracker that ignores existing events.
+        """
+        events = stack_group.cfn_client().describe_stack_events(StackName = stack_id)['StackEvents']
+        return cls(stack_group, stack_id, events[0]['EventId'] if events else None)
+
+    def fetch_new_events(self):
+        """
+        Fetch events after the cursor, and move the cursor to latest event.
+
+        :return: New events. (oldest first)
+        """
+        paginator = self.stack_group.cfn_client().get_paginator('describe_stack_events')
+        new_events = []
+        for page in paginator.paginate(StackName = self.stack_id):
+            reached = False
+            for event in page['StackEvents']:
+                if event['EventId'] == self.last_event_id:
+                    reached = True
+                    break
+                new_events.append(event)
+            if reached:
+                break
+        if new_events:
+            self.last_event_id = new_events[0]['EventId']
+        new_events.reverse()
+        return new_events
+
+    def print_event(self, event):
+        echo('  [%s] %s %s %s %s %s' % (
+            self.stack_name,
+            self.stack_group.format_datetime(event['Timestamp']),
+            self.stack_group.colored_status(event['ResourceStatus']),
+            event['ResourceType'],
+            event['LogicalResourceId'],
+            event.get('ResourceStatusReason', '')
+        ))
+
+    def wait(self, success_status):
+        """
+        Wait for stack to reach terminal status, with streaming new events to console.
+        Gives up after StackGroup#stack_operation_timeout seconds, as boto3 waiter does.
+
+        :param success_status: Expected terminal status. (e.g. CREATE_COMPLETE)
+        :return: Terminal status.
+        :raise Exception: Stack reached other terminal status, or timed out.
+        """
+        timeout = self.stack_group.stack_operation_timeout
+        deadline = time.time() + timeout if timeout is not None else None
+        intervals = backoff_intervals()
+        while True:
+            terminal_status = None
+            events = self.fetch_new_events()
+            for event in events:
+                self.print_event(event)
+                # Stack itself event. (Not nested stack resource)
+                if event['PhysicalResourceId'] == event['StackId'] and event['ResourceStatus'] in self.TERMINAL_STATUSES:
+                    terminal_status = event['ResourceStatus']
+
+            if terminal_status == success_status:
+                return terminal_status
+            if terminal_status is not None:
+                raise Exception('Stack %s finished with status %s.' % (self.stack_id, terminal_status))
+
+            if events:
+                # Restart from short interval while stack is active.
+                intervals = backoff_intervals()
+            interval = next(intervals)
+            if deadline is not None:
+                if time.time() >= deadline:
+                    raise Exception('Timed out waiting for stack %s to reach %s. (%d seconds)' % (self.stack_name, success_status, timeout))
+                interval = min(interval, max(0, deadline - time.time()))
+            time.sleep(interval)
+
+
 class StackGroup(object):
+    LISTED_STACK_STATUSES = [
+        'CREATE_IN_PROGRESS', 'CREATE_FAILED', 'CREATE_COMPLETE',
+        'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE',
+        'DELETE_IN_PROGRESS', 'DELETE_FAILED', # 'DELETE_COMPLETE',
+        'UPDATE_IN_PROGRESS', 'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_COMPLETE',
+        'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_FAILED', 'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_ROLLBACK_COMPLETE',
+        'REVIEW_IN_PROGRESS']
+    # S3 folder (under templates_s3_prefix) of packaged child templates.
+    PACKAGED_TEMPLATES_DIR = '.packaged'
+
+    STACK_COLUMNS = ['StackAlias', 'StackName', 'ParentStackName', 'NestedStacks', 'Status', 'DriftStatus', 'CreatedTime', 'UpdatedTime', 'Description']
+    RESOURCE_COLUMNS = ['StackName', 'LogicalID', 'PhysicalID', 'Type', 'Status', 'UpdatedTime']
+    EXPORT_COLUMNS = ['StackAlias', 'ExportedStackName', 'ExportName', 'ExportValue']
+
     def __init__(self, templates_s3_bucket, templates_s3_prefix, templates_local_dir = '.'):
         """
         Create StackGroup.
@@ -59,10 +1331,50 @@ class StackGroup(object):
         self.templates_s3_prefix = templates_s3_prefix
         self.templates_local_dir = templates_local_dir
         self.default_stack_args_ = {}
-
-        # boto3 client cache.
-        self.__cfn_client = None
-        self.__cfn_resource = None
+        # Local dir for manifest, cache.
+        self.state_dir = '.fabricawscfn'
+        # TTL(seconds) of local stack state index. Turned on by stack_state_cache().
+        self.stack_state_ttl = None
+        # Stack parameter file. Turned on by parameter_file().
+        self.parameter_file_path = None
+
+        # boto3 session, client cache.
+        self.client_pool = ClientPool()
+        # Turned on by 'instrument' task.
+        self.instrumentation = ApiInstrumentation()
+        # Shared by all CloudFormation clients.
+        self.rate_limiter = ApiRateLimiter()
+        # {Session key, AWS account ID}
+        self.account_ids = {}
+        # (Profile, Region) of the current thread, while fan out to multiple regions / profiles.
+        self.__target = threading.local()
+
+        self.__task_ids = itertools.count()
+
+        # Max seconds to wait for a stack to reach terminal status. (Same as boto3 waiter. None to wait forever)
+        self.stack_operation_timeout = 60 * 60
+
+        # Executor for *_async methods. (Created at first use)
+        self.async_workers = 32
+        self.__async_executor = None
+        self.__async_executor_lock = threading.Lock()
+
+        # Plan being applied by 'apply' task.
+        self.__plan = None
+        self.__plan_lock = threading.Lock()
+        self.__fingerprints_lock = threading.Lock()
+
+        # Cache of parameter files and SSM parameters while running. Shared by all stacks.
+        # {Parameter file path, {Stack alias, {Parameter key, Value}}}
+        self.__parameter_files = {}
+        # {(Session key, SSM parameter name), Value}
+        self.__ssm_parameters = {}
+        # Values of SecureString parameters, masked on console.
+        self.__secure_values = set()
+        self.__parameters_lock = threading.Lock()
+        # {(Session key, Stack alias), {Output key, Value}} (None if the stack does not exist)
+        self.__stack_outputs = {}
+        self.__stack_outputs_lock = threading.Lock()
 
         # Task execute confirm.
         env.NeedConfirm = False
@@ -74,8 +1386,24 @@ class StackGroup(object):
             wrapper = task(name = task_name, alias = task_alias)
         else:
             wrapper = task(name = task_name)
-        rand = '%d' % (time.time() * 100000)
-        namespace['task_%s_%s' % (task_name, rand)] = wrapper(task_method)
+        # Unique variable name in namespace.
+        namespace['task_%s_%d' % (task_name, next(self.__task_ids))] = wrapper(self.__instrumented(task_name, task_method))
+
+    def __instrumented(self, task_name, task_method):
+        """
+        Wrap task method to show summary of API calls at the end of the task, while instrumentation is turned on.
+        """
+        @functools.wraps(task_method)
+        def wrapper(*args, **kwargs):
+            if not self.instrumentation.enabled:
+                return task_method(*args, **kwargs)
+            self.instrumentation.start(task_name)
+            try:
+                return task_method(*args, **kwargs)
+            finally:
+                self.instrumentation.finish()
+
+        return wrapper
 
     def need_confirm(self, confirm_message):
         env.NeedConfirm = True
@@ -118,11 +1446,482 @@ class StackGroup(object):
         else:
             return str
 
+    def effective_env(self):
+        """
+        Fabric env, overridden by stack parameters of *_async method running on current thread.
+        """
+        if not in_async_call():
+            return env
+        merged = dict(env)
+        merged.update(_async_context.params)
+        return merged
+
     def actual_templates_s3_bucket(self):
-        return self.templates_s3_bucket % env
+        return self.templates_s3_bucket % self.effective_env()
 
     def actual_templates_s3_prefix(self):
-        return self.templates_s3_prefix % env
+        return self.templates_s3_prefix % self.effective_env()
+
+    def template_local_path(self, template_path):
+        return '%s/%s' % (self.templates_local_dir, template_path)
+
+    def template_s3_location(self, template_path):
+        return '%s/%s/%s' % (self.actual_templates_s3_bucket(), self.actual_templates_s3_prefix(), template_path)
+
+    def local_template_paths(self):
+        """
+        Find templates (*.yaml) on local dir.
+
+        :return: Template relative paths.
+        """
+        template_paths = []
+        for dir_path, dir_names, file_names in os.walk(self.templates_local_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith('.yaml'):
+                    file_path = os.path.join(dir_path, file_name)
+                    template_paths.append(os.path.relpath(file_path, self.templates_local_dir).replace(os.sep, '/'))
+        return template_paths
+
+    def __package_template(self, template_path, packaged, children, ancestors):
+        """
+        Package the template and its nested templates recursively.
+
+        :return: (Body, Content hash, Packaged or not)
+        """
+        import hashlib
+        import posixpath
+
+        if template_path in packaged:
+            return packaged[template_path]
+        if template_path in ancestors:
+            abort(red('Circular nested stack %s.' % ' -> '.join(ancestors + [template_path])))
+
+        file_path = self.template_local_path(template_path)
+        if not os.path.isfile(file_path):
+            abort(red('Nested template %s of %s does not exist.' % (template_path, ancestors[-1] if ancestors else '-')))
+        with open(file_path, 'rb') as f:
+            body = f.read()
+        is_packaged = False
+        # Parse only templates that may have nested stacks.
+        if b'AWS::CloudFormation::Stack' in body:
+            try:
+                template = load_template(file_path)
+            except yaml.YAMLError as e:
+                print(yellow('Can not parse template %s. Nested stacks are not packaged. %s' % (file_path, e)))
+                template = None
+            resources = template.get('Resources') if isinstance(template, dict) else None
+            for resource in (resources or {}).values():
+                if not isinstance(resource, dict) or resource.get('Type') != 'AWS::CloudFormation::Stack':
+                    continue
+                properties = resource.get('Properties') or {}
+                template_url = properties.get('TemplateURL')
+                # Intrinsic function or URL is used as it is.
+                if not isinstance(template_url, basestring) or '://' in template_url:
+                    continue
+                child_path = posixpath.normpath(posixpath.join(posixpath.dirname(template_path), template_url))
+                child_body, child_hash, _ = self.__package_template(child_path, packaged, children, ancestors + [template_path])
+                child_key = '%s/%s.yaml' % (self.PACKAGED_TEMPLATES_DIR, child_hash)
+                children[child_key] = (child_body, child_hash, child_path)
+                properties['TemplateURL'] = 'https://s3.amazonaws.com/%s' % self.template_s3_location(child_key)
+                is_packaged = True
+            if is_packaged:
+                # JSON is also valid template, and keeps long form intrinsic functions.
+                body = json.dumps(template, indent = 2, default = str)
+
+        packaged[template_path] = (body, hashlib.sha256(body).hexdigest(), is_packaged)
+        return packaged[template_path]
+
+    def package_templates(self, template_paths):
+        """
+        Package templates that have nested stacks (AWS::CloudFormation::Stack) with relative TemplateURL.
+        TemplateURL is replaced by S3 URL of the child template, keyed by content hash of the (packaged) child.
+        So a changed template changes keys of itself and its ancestors only.
+
+        :param template_paths: Template relative paths.
+        :return: ({Template path, (Body, Content hash)} of packaged templates,
+                  {Template path on S3, (Body, Content hash, Template path)} of child templates)
+        """
+        packaged = {}
+        children = OrderedDict()
+        roots = OrderedDict()
+        for template_path in template_paths:
+            body, content_hash, is_packaged = self.__package_template(template_path, packaged, children, [])
+            if is_packaged:
+                roots[template_path] = (body, content_hash)
+        return roots, children
+
+    def local_template_hash(self, template_path):
+        """
+        Content hash of the template on local dir, as synchronized by sync_templates. (Packaged if it has nested stacks)
+        """
+        roots, children = self.package_templates([template_path])
+        if template_path in roots:
+            return roots[template_path][1]
+        return file_hash(self.template_local_path(template_path))
+
+    def template_s3_version(self, template_path):
+        """
+        Version of the template object on S3, as synchronized by anyone. (VersionId if versioning is enabled, else ETag)
+
+        :param template_path: Template relative path.
+        :return: Version string. None if the object can not be read.
+        """
+        try:
+            head = self.s3_client().head_object(
+                Bucket = self.actual_templates_s3_bucket(),
+                Key = '%s/%s' % (self.actual_templates_s3_prefix(), template_path)
+            )
+        except botocore.exceptions.ClientError:
+            return None
+        return head.get('VersionId') or head.get('ETag')
+
+    def template_summary_cache(self):
+        return TemplateSummaryCache(os.path.join(self.state_dir, 'cache', 'template-summary'))
+
+    def stack_state_store(self):
+        """
+        Local stack state index.
+
+        :return: StackStateStore. None if not turned on by stack_state_cache().
+        """
+        if self.stack_state_ttl is None:
+            return None
+        return StackStateStore(os.path.join(self.state_dir, 'stack-state.db'), self.stack_state_ttl)
+
+    def load_synced_manifest(self):
+        """
+        Load content hashes of the templates synchronized to S3.
+
+        :return: {Template S3 location, Content hash}
+        """
+        try:
+            with open(os.path.join(self.state_dir, 'synced-templates.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save_synced_manifest(self, manifest):
+        """
+        Save content hashes of the templates synchronized to S3.
+
+        :param manifest: {Template S3 location, Content hash}
+        """
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        with open(os.path.join(self.state_dir, 'synced-templates.json'), 'w') as f:
+            json.dump(manifest, f, indent = 2, sort_keys = True)
+
+    def load_validated_templates(self):
+        """
+        Load content hashes of the templates validated by validate_template task.
+
+        :return: {Content hash, {Remote: Validated by API or not, ValidatedTime}}
+        """
+        try:
+            with open(os.path.join(self.state_dir, 'validated-templates.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save_validated_templates(self, validated, max_entries = 4096):
+        """
+        Save content hashes of the validated templates. Oldest entries are evicted when exceeds max_entries.
+
+        :param validated: {Content hash, {Remote: Validated by API or not, ValidatedTime}}
+        :param max_entries: Max number of entries. (Default 4096)
+        """
+        if len(validated) > max_entries:
+            newest = sorted(validated, key = lambda content_hash: validated[content_hash]['ValidatedTime'])[-max_entries:]
+            validated = dict((content_hash, validated[content_hash]) for content_hash in newest)
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        with open(os.path.join(self.state_dir, 'validated-templates.json'), 'w') as f:
+            json.dump(validated, f, indent = 2, sort_keys = True)
+
+    def load_plan(self):
+        """
+        Load change sets recorded by plan task.
+
+        :return: {Profile, Region, CreatedTime, Stacks: {Stack alias, Planned change set}}
+        """
+        try:
+            with open(os.path.join(self.state_dir, 'plan.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save_plan(self, plan):
+        """
+        Save change sets recorded by plan task. Remove the file if no change sets.
+
+        :param plan: {Profile, Region, CreatedTime, Stacks: {Stack alias, Planned change set}}
+        """
+        path = os.path.join(self.state_dir, 'plan.json')
+        if not plan.get('Stacks'):
+            if os.path.isfile(path):
+                os.remove(path)
+            return
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        with open(path, 'w') as f:
+            json.dump(plan, f, indent = 2, sort_keys = True)
+
+    def load_fingerprints(self):
+        """
+        Load fingerprints of stacks deployed by fabricawscfn.
+
+        :return: {Stack ID, {Fingerprint, UpdatedTime}}
+        """
+        try:
+            with open(os.path.join(self.state_dir, 'fingerprints.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def deployed_fingerprint(self, stack):
+        """
+        Get fingerprint of the deployed stack.
+        Fingerprint is valid only if the stack has not been updated by others since recorded.
+
+        :param stack: Result of describe_stacks.
+        :return: Fingerprint. None if unknown.
+        """
+        if stack['StackStatus'] not in ['CREATE_COMPLETE', 'UPDATE_COMPLETE']:
+            return None
+        recorded = self.load_fingerprints().get(stack['StackId'])
+        if recorded is None or recorded['UpdatedTime'] != (stack.get('LastUpdatedTime') or stack['CreationTime']).isoformat():
+            return None
+        return recorded['Fingerprint']
+
+    def record_fingerprint(self, stack_id, fingerprint):
+        """
+        Record fingerprint of the stack, after deployed.
+
+        :param stack_id: Stack ID.
+        :param fingerprint: Fingerprint. Do nothing if None.
+        """
+        if fingerprint is None:
+            return
+        stack = self.cfn_client().describe_stacks(StackName = stack_id)['Stacks'][0]
+        with self.__fingerprints_lock:
+            fingerprints = self.load_fingerprints()
+            fingerprints[stack_id] = dict(
+                Fingerprint = fingerprint,
+                UpdatedTime = (stack.get('LastUpdatedTime') or stack['CreationTime']).isoformat()
+            )
+            if not os.path.isdir(self.state_dir):
+                os.makedirs(self.state_dir)
+            with open(os.path.join(self.state_dir, 'fingerprints.json'), 'w') as f:
+                json.dump(fingerprints, f, indent = 2, sort_keys = True)
+
+    def stack_name_index(self):
+        """
+        Build index of defined stacks.
+
+        :return: {Actual stack name, Stack alias}
+        """
+        return OrderedDict((stack_def.actual_stack_name(), stack_def.stack_alias) for stack_def in self.stack_defs.values())
+
+    def rate_limit(self, describe = None, mutate = None):
+        """
+        Limit CloudFormation API calls per second, shared by all threads.
+        Rate is adapted to throttling responses regardless of this setting.
+
+        :param describe: Max calls per second of Describe / List / Get APIs. (OPTIONAL. Default unlimited until throttled)
+        :param mutate: Max calls per second of other APIs. (Create, Update, Delete, etc.) (OPTIONAL. Default unlimited until throttled)
+        :return: self
+        """
+        self.rate_limiter.max_rates = {
+            'describe': float(describe) if describe is not None else None,
+            'mutate': float(mutate) if mutate is not None else None
+        }
+        self.rate_limiter.buckets = {}
+        return self
+
+    def stack_state_cache(self, ttl = 60):
+        """
+        Cache stack summaries, descriptions and exports in local state dir. (Used by list_stacks, desc_stack and list_exports)
+        After TTL, only stacks changed since last read are described again.
+
+        :param ttl: Seconds to serve reads without calling API. (Default 60)
+        :return: self
+        """
+        self.stack_state_ttl = float(ttl)
+        return self
+
+    def parameter_file(self, path):
+        """
+        Read stack parameters from YAML / JSON file, keyed by stack alias. (e.g. {foo: {VpcCidr: 10.0.0.0/16}})
+        Value 'ssm:NAME' is read from SSM Parameter Store.
+        Parameters specified by fabric env (e.g. params task) take precedence.
+
+        :param path: File path. (allow placeholder. will be replace by env. e.g. 'params/%(EnvName)s.yaml')
+        :return: self
+        """
+        self.parameter_file_path = path
+        return self
+
+    def parameter_file_params(self, alias):
+        """
+        Stack parameters in the parameter file. The file is read once while running.
+
+        :param alias: Stack alias.
+        :return: {Parameter key, Value} Empty if parameter file is not used or not exists.
+        """
+        if self.parameter_file_path is None:
+            return {}
+        path = self.parameter_file_path % self.effective_env()
+        with self.__parameters_lock:
+            if path not in self.__parameter_files:
+                params = {}
+                if os.path.isfile(path):
+                    with open(path) as f:
+                        params = yaml.safe_load(f) or {}
+                    if not isinstance(params, dict) or not all(isinstance(v, dict) for v in params.values() if v is not None):
+                        abort(red('Parameter file %s must be a mapping of stack alias to parameters.' % path))
+                self.__parameter_files[path] = params
+        return dict(
+            (param_key, parameter_value(value)) for param_key, value in (self.__parameter_files[path].get(alias) or {}).items()
+        )
+
+    def resolve_ssm_parameters(self, params):
+        """
+        Resolve references to SSM Parameter Store ('ssm:NAME') in parameter values.
+        Parameters not read yet in this run are read by GetParameters, 10 names per call.
+
+        :param params: {Parameter key, Value}
+        :return: {Parameter key, Resolved value}
+        """
+        names = set(ssm_parameter_name(value) for value in params.values())
+        names.discard(None)
+        if not names:
+            return params
+
+        key = self.session_key()
+        # Held while reading, so concurrent stacks never read the same parameters.
+        with self.__parameters_lock:
+            missing = sorted(name for name in names if (key, name) not in self.__ssm_parameters)
+            if missing:
+                ssm = self.ssm_client()
+                chunks = [missing[i:i + 10] for i in range(0, len(missing), 10)]
+                results = self.parallel_map(lambda chunk: ssm.get_parameters(Names = chunk, WithDecryption = True), chunks, 8)
+                invalid_names = list(itertools.chain.from_iterable(result.get('InvalidParameters', []) for result in results))
+                if invalid_names:
+                    raise Exception('SSM parameter %s does not exist.' % ', '.join(invalid_names))
+                for result in results:
+                    for parameter in result['Parameters']:
+                        # Name with version or label, as requested. (e.g. NAME:1)
+                        self.__ssm_parameters[(key, parameter['Name'] + parameter.get('Selector', ''))] = parameter['Value']
+                        if parameter['Type'] == 'SecureString':
+                            self.__secure_values.add(parameter['Value'])
+
+        resolved = {}
+        for param_key, value in params.items():
+            name = ssm_parameter_name(value)
+            resolved[param_key] = value if name is None else self.__ssm_parameters[(key, name)]
+        return resolved
+
+    def stack_outputs(self, aliases):
+        """
+        Outputs of the defined stacks. Stacks not described yet in this run are described at the same time.
+
+        :param aliases: Stack aliases.
+        :return: {Stack alias, {Output key, Value}} (None if the stack does not exist)
+        """
+        key = self.session_key()
+        aliases = set(aliases)
+        with self.__stack_outputs_lock:
+            missing = sorted(alias for alias in aliases if (key, alias) not in self.__stack_outputs)
+            for alias in missing:
+                if not self.stack_defs.has_key(alias):
+                    raise Exception('Stack %s is not defined.' % alias)
+
+            def describe(alias):
+                stack = self.describe_stack(self.stack_defs[alias].actual_stack_name())
+                if stack is None:
+                    return None
+                return dict((output['OutputKey'], output['OutputValue']) for output in stack.get('Outputs', []))
+
+            for alias, outputs in zip(missing, self.parallel_map(describe, missing, 8)):
+                self.__stack_outputs[(key, alias)] = outputs
+            return dict((alias, self.__stack_outputs[(key, alias)]) for alias in aliases)
+
+    def forget_stack_outputs(self, alias = None):
+        """
+        Forget outputs of the stack read in this run, after the stack is changed.
+
+        :param alias: Stack alias. (OPTIONAL. Default all stacks)
+        """
+        with self.__stack_outputs_lock:
+            if alias is None:
+                self.__stack_outputs.clear()
+            else:
+                self.__stack_outputs.pop((self.session_key(), alias), None)
+
+    def resolve_stack_outputs(self, params):
+        """
+        Resolve references to outputs of defined stacks ('{{stack:ALIAS.Outputs.KEY}}') in parameter values.
+
+        :param params: {Parameter key, Value}
+        :return: {Parameter key, Resolved value}
+        """
+        references = list(itertools.chain.from_iterable(stack_output_references(value) for value in params.values()))
+        if not references:
+            return params
+        outputs = self.stack_outputs(alias for alias, output_key in references)
+
+        def output_value(match):
+            alias, output_key = match.groups()
+            if outputs[alias] is None:
+                raise Exception('Stack %s does not exist. (Referred by {{stack:%s.Outputs.%s}})' % (alias, alias, output_key))
+            if output_key not in outputs[alias]:
+                raise Exception('Stack %s has no output %s.' % (alias, output_key))
+            return outputs[alias][output_key]
+
+        return dict(
+            (param_key, STACK_OUTPUT_REFERENCE.sub(output_value, value) if isinstance(value, basestring) else value)
+            for param_key, value in params.items()
+        )
+
+    def resolve_params(self, params):
+        """
+        Resolve references to SSM parameters and outputs of defined stacks in parameter values.
+
+        :param params: {Parameter key, Value}
+        :return: {Parameter key, Resolved value}
+        """
+        return self.resolve_stack_outputs(self.resolve_ssm_parameters(params))
+
+    def masked_params(self, stack_params):
+        """
+        Mask values read from SecureString parameters, to show stack parameters on console.
+
+        :param stack_params: Stack parameters.
+        :return: Stack parameters.
+        """
+        return [
+            dict(param, ParameterValue = '****') if param.get('ParameterValue') in self.__secure_values else param
+            for param in stack_params
+        ]
+
+    def prefetch_stack_params(self, stack_defs):
+        """
+        Read SSM parameters and outputs of stacks referred by the stacks at once, before the stacks are deployed in parallel.
+        Outputs of the stacks that do not exist yet are read again after they are created.
+
+        :param stack_defs: StackDefs.
+        """
+        params = {}
+        for stack_def in stack_defs:
+            for param_key, value in stack_def.specified_params().items():
+                params['%s.%s' % (stack_def.stack_alias, param_key)] = value
+        try:
+            self.resolve_ssm_parameters(params)
+            references = itertools.chain.from_iterable(stack_output_references(value) for value in params.values())
+            self.stack_outputs(alias for alias, output_key in references)
+        except Exception as e:
+            abort(red(str(e)))
 
     def default_stack_args(self, **kwargs):
         """
@@ -135,17 +1934,18 @@ class StackGroup(object):
         self.default_stack_args_ = kwargs
         return self
 
-    def define_stack(self, alias, stack_name, template_path, **kwargs):
+    def define_stack(self, alias, stack_name, template_path, depends_on = None, **kwargs):
         """
         Define stack.
 
         :param alias: Stack alias.
         :param stack_name: Stack name.(allow placeholder. will be replace by env.)
         :param template_path: Template file relative path.
+        :param depends_on: Aliases of the stacks that this stack depends on.(OPTIONAL. Used by bulk tasks)
         :param kwargs: Optional stack arguments.
         :return: self
         """
-        stack_def = StackDef(self, alias, stack_name, template_path, **kwargs)
+        stack_def = StackDef(self, alias, stack_name, template_path, depends_on, **kwargs)
         self.stack_defs[alias] = stack_def
 
         return self
@@ -161,17 +1961,27 @@ class StackGroup(object):
         self.__add_fabric_task(namespace, 'profile', self.profile, 'p')
         self.__add_fabric_task(namespace, 'region', self.region, 'r')
         self.__add_fabric_task(namespace, 'account', self.account, 'a')
+        self.__add_fabric_task(namespace, 'profiles', self.profiles, 'ps')
+        self.__add_fabric_task(namespace, 'regions', self.regions, 'rs')
         self.__add_fabric_task(namespace, 'force', self.force)
         self.__add_fabric_task(namespace, 'params', self.params, 'pm')
+        self.__add_fabric_task(namespace, 'instrument', self.instrument)
+        self.__add_fabric_task(namespace, 'refresh', self.refresh)
         self.__add_fabric_task(namespace, 'console', self.console, 'c')
         self.__add_fabric_task(namespace, 'validate_template', self.validate_template, 'vt')
         self.__add_fabric_task(namespace, 'sync_templates', self.sync_templates, 'st')
         self.__add_fabric_task(namespace, 'list_stacks', self.list_stacks, 'ls')
         self.__add_fabric_task(namespace, 'desc_stack', self.desc_stack, 'ds')
         self.__add_fabric_task(namespace, 'detect_drift', self.detect_drift, 'dd')
+        self.__add_fabric_task(namespace, 'detect_drift_all', self.detect_drift_all, 'dda')
         self.__add_fabric_task(namespace, 'list_resources', self.list_resources, 'lr')
         self.__add_fabric_task(namespace, 'list_exports', self.list_exports, 'le')
         self.__add_fabric_task(namespace, 'dryrun', self.dryrun, 'd')
+        self.__add_fabric_task(namespace, 'create_all', self.create_all, 'ca')
+        self.__add_fabric_task(namespace, 'update_all', self.update_all, 'ua')
+        self.__add_fabric_task(namespace, 'delete_all', self.delete_all, 'da')
+        self.__add_fabric_task(namespace, 'plan', self.plan)
+        self.__add_fabric_task(namespace, 'apply', self.apply)
 
         # Add stack tasks.
         for stack_def in self.stack_defs.values():
@@ -181,45 +1991,249 @@ class StackGroup(object):
                 task_name = '%s_%s' % (operation_name, stack_def.stack_alias)
                 self.__add_fabric_task(namespace, task_name, operation)
 
-        return self
+        return self
+
+    def client_config(self, max_pool_connections = 10, retries = None):
+        """
+        Configure boto3 clients.
+
+        :param max_pool_connections: Max number of HTTP connections per client. (Default 10)
+        :param retries: Retry config of botocore. (e.g. {'max_attempts': 10})
+        :return: self
+        """
+        self.client_pool = ClientPool(max_pool_connections, retries)
+        return self
+
+    def session_key(self):
+        """
+        Decide profile, region and account.
+        Profile is decided by
+        1. Specify 'profile' task.
+        2. Specify environment variable 'AWS_PROFILE'.
+        3. Default profile.
+
+        :return: (Profile name, Region, Access key ID, Secret access key)
+        """
+        target_profile, target_region = getattr(self.__target, 'value', None) or (None, None)
+        if target_profile is not None:
+            profile_name = target_profile
+        elif 'Profile' in env:
+            profile_name = env['Profile']
+        else:
+            profile_name = os.environ.get('AWS_PROFILE') or os.environ.get('AWS_DEFAULT_PROFILE')
+        region_name = target_region if target_region is not None else env.get('Region')
+        return (profile_name, region_name, env.get('AccessKeyId'), env.get('SecretAccessKey'))
+
+    def session(self):
+        key = self.session_key()
+        if not self.client_pool.has_session(key) and 'Profile' not in env and not env.get('Profiles') and key[0] is not None:
+            variable_name = 'AWS_PROFILE' if 'AWS_PROFILE' in os.environ else 'AWS_DEFAULT_PROFILE'
+            # To stderr, so stdout has rows only in output mode. (e.g. list_stacks:output=jsonl)
+            print(green('Use AWS Profile is %s. (by Environment variable %s)' % (key[0], variable_name), bold = True), file = sys.stderr)
+        return self.client_pool.session(key)
+
+    def cfn_client(self):
+        self.session()
+        key = self.session_key()
+        return self.instrumentation.attach(self.rate_limiter.attach(self.client_pool.client(key, 'cloudformation'), key))
+
+    def cfn_resource(self):
+        self.session()
+        key = self.session_key()
+        return self.instrumentation.attach(self.rate_limiter.attach(self.client_pool.resource(key, 'cloudformation'), key))
+
+    def s3_client(self):
+        self.session()
+        return self.instrumentation.attach(self.client_pool.client(self.session_key(), 's3'))
+
+    def ssm_client(self):
+        self.session()
+        return self.instrumentation.attach(self.client_pool.client(self.session_key(), 'ssm'))
+
+    def account_id(self):
+        """
+        Get AWS account ID of current session.
+        """
+        key = self.session_key()
+        if key not in self.account_ids:
+            self.session()
+            self.account_ids[key] = self.client_pool.client(key, 'sts').get_caller_identity()['Account']
+        return self.account_ids[key]
+
+    def targets(self):
+        """
+        Get target profiles and regions specified by 'profiles' and 'regions' task.
+
+        :return: List of (Profile name, Region). None means default.
+        """
+        profiles = env.get('Profiles') or [None]
+        regions = env.get('Regions') or [None]
+        return [(profile, region) for profile in profiles for region in regions]
+
+    def in_fan_out(self):
+        return True if (env.get('Profiles') or env.get('Regions')) else False
+
+    def __with_current_target(self, func):
+        """
+        Wrap function to use boto3 clients for the same target (and stack parameters of *_async method) as current thread, on worker threads.
+        """
+        target = getattr(self.__target, 'value', None)
+        params = getattr(_async_context, 'params', None)
+
+        def call(item):
+            self.__target.value = target
+            _async_context.params = params
+            try:
+                return func(item)
+            finally:
+                self.__target.value = None
+                _async_context.params = None
+
+        return call
+
+    def parallel_map(self, func, items, workers):
+        """
+        Same as parallel_map(), and boto3 clients in worker threads are for the same target as current thread.
+        """
+        return parallel_map(self.__with_current_target(func), items, workers)
+
+    def parallel_imap(self, func, items, workers):
+        """
+        Same as parallel_imap(), and boto3 clients in worker threads are for the same target as current thread.
+        """
+        return parallel_imap(self.__with_current_target(func), items, workers)
+
+    def fan_out(self, func, workers = 8):
+        """
+        Call function for each target profile / region at the same time.
+        boto3 clients used in the function are for the target.
+
+        :param func: Function without arguments.
+        :param workers: Number of targets to call at the same time. (Default 8)
+        :return: List of (Region, Account ID, Result)
+        """
+        params = getattr(_async_context, 'params', None)
+
+        def call(target):
+            self.__target.value = target
+            _async_context.params = params
+            try:
+                return self.session().region_name, self.account_id(), func()
+            finally:
+                self.__target.value = None
+                _async_context.params = None
+
+        return parallel_map(call, self.targets(), workers)
+
+    def collect_rows(self, fetch_rows):
+        """
+        Fetch table rows from current target, or all targets while fan out.
+
+        :param fetch_rows: Function that returns table rows.
+        :return: (Additional columns, Table rows) Region and Account columns are added while fan out.
+        """
+        if not self.in_fan_out():
+            return [], fetch_rows()
+        rows = []
+        for region, account_id, target_rows in self.fan_out(fetch_rows):
+            rows.extend([region, account_id] + row for row in target_rows)
+        return ['Region', 'Account'], rows
+
+    def stream_rows(self, output, columns, iter_rows):
+        """
+        Write raw rows of current target, or all targets while fan out, as soon as they are fetched.
+
+        :param output: Output format. 'jsonl' or 'csv'.
+        :param columns: Column names.
+        :param iter_rows: Function that returns iterator of raw rows.
+        """
+        writer = RowWriter(output)
+        if not self.in_fan_out():
+            for row in iter_rows():
+                writer.write(columns, row)
+            return
+
+        def write_rows():
+            prefix = [self.session().region_name, self.account_id()]
+            for row in iter_rows():
+                writer.write(['Region', 'Account'] + columns, prefix + row)
+
+        self.fan_out(write_rows)
+
+    def __stack_state_target(self):
+        profile_name, region_name, access_key_id, secret_access_key = self.session_key()
+        return json.dumps([profile_name, self.session().region_name, access_key_id])
+
+    def fresh_stack_state(self):
+        """
+        Local stack state index for current target. Refreshed by listing stacks if TTL expired.
+
+        :return: (StackStateStore, Target key) (None, None) if not turned on.
+        """
+        store = self.stack_state_store()
+        if store is None:
+            return None, None
+        target = self.__stack_state_target()
+        if not store.is_fresh(target):
+            store.refresh(target, list(self.__list_stack_summaries()))
+        return store, target
+
+    def forget_stack_state(self):
+        """
+        Refresh local stack state index for current target on next read. (Call after changing stacks)
+        """
+        store = self.stack_state_store()
+        if store is not None:
+            store.invalidate(self.__stack_state_target())
+
+    def __list_stack_summaries(self):
+        paginator = self.cfn_client().get_paginator('list_stacks')
+        for page in paginator.paginate(StackStatusFilter = self.LISTED_STACK_STATUSES):
+            for summary in page['StackSummaries']:
+                yield summary
+
+    def iter_stack_summaries(self):
+        """
+        Iterate summaries of all stacks page by page, or from local stack state index.
+
+        :return: Iterator of stack summaries.
+        """
+        store, target = self.fresh_stack_state()
+        if store is None:
+            return self.__list_stack_summaries()
+        return iter(store.summaries(target))
+
+    def stack_hierarchy(self):
+        """
+        Build tree of all stacks, in one pass over stack summaries.
 
-    def cfn_client(self):
-        if self.__cfn_client is None:
-            import os
-
-            # Decide profile.
-            # 1. Specify 'profile' task.
-            # 2. Specify environment variable 'AWS_PROFILE'.
-            # 3. Default profile.
-            profile_name = None
-            if 'Profile' in env:
-                profile_name = env['Profile']
-            elif 'AWS_PROFILE' in os.environ:
-                profile_name = os.environ['AWS_PROFILE']
-                print(green('Use AWS Profile is %s. (by Environment variable AWS_PROFILE)' % profile_name, bold = True))
-            elif 'AWS_DEFAULT_PROFILE' in os.environ:
-                profile_name = os.environ['AWS_DEFAULT_PROFILE']
-                print(green('Use AWS Profile is %s. (by Environment variable AWS_DEFAULT_PROFILE)' % profile_name, bold = True))
-
-            session = Session(
-                profile_name = profile_name,
-                region_name = env.get('Region'),
-                aws_access_key_id = env.get('AccessKeyId'),
-                aws_secret_access_key = env.get('SecretAccessKey')
-            )
-            self.__cfn_client = session.client('cloudformation')
-        return self.__cfn_client
+        :return: StackHierarchy.
+        """
+        return StackHierarchy(self.iter_stack_summaries())
 
-    def cfn_resource(self):
-        if self.__cfn_resource is None:
-            session = Session(
-                profile_name = env.get('Profile'),
-                region_name = env.get('Region'),
-                aws_access_key_id = env.get('AccessKeyId'),
-                aws_secret_access_key = env.get('SecretAccessKey')
-            )
-            self.__cfn_resource = session.resource('cloudformation')
-        return self.__cfn_resource
+    def describe_stack(self, stack_name):
+        """
+        Describe stack, or get it from local stack state index.
+
+        :param stack_name: Stack name or stack ID.
+        :return: Result of describe_stacks. None if the stack does not exist.
+        """
+        store, target = self.fresh_stack_state()
+        listed = False
+        if store is not None:
+            listed, description = store.description(target, stack_name)
+            if description is not None:
+                return description
+            if not listed and not stack_name.startswith('arn:'):
+                return None
+        try:
+            description = self.cfn_client().describe_stacks(StackName = stack_name)['Stacks'][0]
+        except botocore.exceptions.ClientError:
+            # Stack does not exists
+            return None
+        if listed:
+            store.put_description(target, stack_name, description)
+        return description
 
     def profile(self, profile):
         """
@@ -228,9 +2242,6 @@ class StackGroup(object):
         """
         print(green('Use AWS Profile is %s.' % profile, bold = True))
         env.Profile = profile
-        self.__cfn_client = None
-        self.__cfn_resource = None
-
         return self
 
     def region(self, region):
@@ -241,9 +2252,6 @@ class StackGroup(object):
         """
         print(green('Use AWS Region is %s.' % region, bold = True))
         env.Region = region
-        self.__cfn_client = None
-        self.__cfn_resource = None
-
         return self
 
     def account(self, access_key_id, secret_access_key):
@@ -255,8 +2263,27 @@ class StackGroup(object):
         """
         env.AccessKeyId = access_key_id
         env.SecretAccessKey = secret_access_key
-        self.__cfn_client = None
-        self.__cfn_resource = None
+        return self
+
+    def profiles(self, *profiles):
+        """
+        Set AWS Profiles. list_stacks, list_resources, list_exports and desc_stack run on all profiles at the same time.
+
+        :param profiles: Profile names.
+        """
+        print(green('Use AWS Profiles are %s.' % ', '.join(profiles), bold = True))
+        env.Profiles = list(profiles)
+
+        return self
+
+    def regions(self, *regions):
+        """
+        Set AWS Regions. list_stacks, list_resources, list_exports and desc_stack run on all regions at the same time.
+
+        :param regions: AWS regions.
+        """
+        print(green('Use AWS Regions are %s.' % ', '.join(regions), bold = True))
+        env.Regions = list(regions)
 
         return self
 
@@ -278,218 +2305,707 @@ class StackGroup(object):
 
         return self
 
+    def instrument(self, output = None):
+        """
+        Record API calls (count, latency, retries, bytes) and show summary at the end of each task.
+
+        :param output: JSON file to write summaries.(OPTIONAL)
+        """
+        self.instrumentation.enabled = True
+        self.instrumentation.output_path = output
+        return self
+
+    def refresh(self):
+        """
+        Refresh local stack state index on next read, regardless of TTL.
+        """
+        store = self.stack_state_store()
+        if store is not None:
+            store.invalidate()
+        self.forget_stack_outputs()
+        return self
+
     def console(self):
         """
         Open AWS Console on your default Web browser.
         """
         import webbrowser
-        session = boto3.session.Session()
+        session = self.session()
         webbrowser.open('https://%(region)s.console.aws.amazon.com/cloudformation/home?region=%(region)s#/stacks?filter=active' % dict(
             region = session.region_name
         ))
 
-    def validate_template(self, alias_or_template_path):
+    def validate_template(self, alias_or_template_path = None, remote = True, workers = 8, processes = None):
         """
-        Validate template on local dir.
-
-        :param alias_or_template_path: Stack alias or Template file relative path.
+        Validate templates on local dir.
+        Structure and references are checked locally on worker processes, and then validated by ValidateTemplate API.
+        Templates are not validated again until changed.
+
+        :param alias_or_template_path: Stack alias or Template file relative path. (OPTIONAL. Default all templates on local dir)
+        :param remote: Set False to check locally only. (Default True)
+        :param workers: Number of API calls at the same time. (Default 8)
+        :param processes: Number of worker processes to check templates. (Default number of CPUs)
         """
-        if self.stack_defs.has_key(alias_or_template_path):
-            template_path = self.stack_defs[alias_or_template_path].template_path
+        remote = not (remote == False or remote == 'False')
+        if alias_or_template_path is None:
+            template_paths = self.local_template_paths()
+        elif self.stack_defs.has_key(alias_or_template_path):
+            template_paths = [self.stack_defs[alias_or_template_path].template_path]
         else:
-            template_path = alias_or_template_path
+            template_paths = [alias_or_template_path]
+
+        # {Template path, Content hash}
+        content_hashes = OrderedDict()
+        for template_path in template_paths:
+            template_local_path = self.template_local_path(template_path)
+            if not os.path.isfile(template_local_path):
+                abort(red('Template %s does not exist.' % template_local_path))
+            content_hashes[template_path] = file_hash(template_local_path)
+
+        validated = self.load_validated_templates()
+        pending = [template_path for template_path, content_hash in content_hashes.items()
+                   if content_hash not in validated or (remote and not validated[content_hash]['Remote'])]
+        print('Validating templates on %s... (%d templates, %d unchanged)' % (
+            self.templates_local_dir, len(pending), len(template_paths) - len(pending)
+        ))
 
-        template_local_path = '%s/%s' % (
-            self.templates_local_dir,
-            template_path
-        )
-        print('Validating template %s...' % template_local_path)
-        local(
-            "aws cloudformation validate-template --template-body file://%s --output table" % template_local_path
-        )
+        # {Template path, Error messages}
+        errors = OrderedDict(zip(pending, parallel_process_map(
+            check_template_file, [self.template_local_path(template_path) for template_path in pending], processes
+        )))
+
+        # Skipped by API, because too large to validate by body and not synchronized.
+        skipped = set()
+        if remote:
+            manifest = self.load_synced_manifest()
+            cfn = self.cfn_client()
+
+            def validate(template_path):
+                with open(self.template_local_path(template_path), 'rb') as f:
+                    body = f.read()
+                if len(body) <= MAX_TEMPLATE_BODY_BYTES:
+                    template_args = dict(TemplateBody = body)
+                elif manifest.get(self.template_s3_location(template_path)) == self.local_template_hash(template_path):
+                    template_args = dict(TemplateURL = 'https://s3.amazonaws.com/%s' % self.template_s3_location(template_path))
+                else:
+                    return None
+                try:
+                    cfn.validate_template(**template_args)
+                except botocore.exceptions.ClientError as e:
+                    if e.response['Error']['Code'] != 'ValidationError':
+                        raise
+                    return [e.response['Error']['Message']]
+                return []
+
+            checked = [template_path for template_path, template_errors in errors.items() if not template_errors]
+            for template_path, template_errors in zip(checked, self.parallel_map(validate, checked, workers)):
+                if template_errors is None:
+                    skipped.add(template_path)
+                else:
+                    errors[template_path] = template_errors
+
+        now = time.time()
+        for template_path, template_errors in errors.items():
+            if template_errors:
+                print(red('invalid: %s' % self.template_local_path(template_path)))
+                for error in template_errors:
+                    print('  %s' % error)
+            else:
+                validated[content_hashes[template_path]] = dict(
+                    Remote = remote and template_path not in skipped,
+                    ValidatedTime = now
+                )
+        for template_path in skipped:
+            print(yellow('Template %s exceeds %d bytes. Validated locally only. (sync_templates to validate by API)' % (
+                self.template_local_path(template_path), MAX_TEMPLATE_BODY_BYTES
+            )))
+        self.save_validated_templates(validated)
+
+        invalids = [template_path for template_path, template_errors in errors.items() if template_errors]
+        if invalids:
+            abort(red('%d of %d templates are invalid.' % (len(invalids), len(template_paths))))
+        print(green('%d templates are valid.' % len(template_paths)))
 
     @confirm
-    def sync_templates(self):
+    def sync_templates(self, full = False, workers = 8):
         """
         Synchronize templates local dir to S3 bucket.
-        """
-        s3url = 's3://%s/%s' % (self.actual_templates_s3_bucket(), self.actual_templates_s3_prefix())
-        print('Synchronizing templates local %s to %s...' % (self.templates_local_dir, s3url))
-        local('%(Account)s aws %(Profile)s%(Region)s s3 sync %(LocalDir)s %(S3Url)s --delete --exclude "*" --include \"*.yaml\"' % dict(
-            Account = ' %s AWS_ACCESS_KEY_ID=%s; %s AWS_SECRET_ACCESS_KEY=%s; ' % (
-                'set' if os.name == 'nt' else 'export',
-                env.get('AccessKeyId'),
-                'set' if os.name == 'nt' else 'export',
-                env.get('SecretAccessKey')
-            ) if 'AccessKeyId' in env else '',
-            Profile = ' --profile %s' % env.get('Profile') if 'Profile' in env else '',
-            Region = ' --region %s' % env.get('Region') if 'Region' in env else '',
-            LocalDir = self.templates_local_dir,
-            S3Url = s3url
-        ))
 
-    def list_stacks(self):
-        """
-        List stacks.
+        :param full: Set True to compare with S3 objects instead of local manifest. (Default False)
+        :param workers: Number of files to upload at the same time. (Default 8)
         """
-        paginator = self.cfn_client().get_paginator('list_stacks')
+        full = full == True or full == 'True'
+        bucket = self.actual_templates_s3_bucket()
+        prefix = self.actual_templates_s3_prefix()
+        s3_location = self.template_s3_location('')
+        print('Synchronizing templates local %s to s3://%s/%s...' % (self.templates_local_dir, bucket, prefix))
+
+        # {Template path, (Local file path, Content hash)}
+        local_templates = OrderedDict()
+        for template_path in self.local_template_paths():
+            file_path = self.template_local_path(template_path)
+            local_templates[template_path] = (file_path, file_hash(file_path))
+
+        # Packaged templates and nested child templates are uploaded from memory. {Template path, Body}
+        bodies = {}
+        roots, children = self.package_templates(local_templates.keys())
+        for template_path, (body, content_hash) in roots.items():
+            local_templates[template_path] = (local_templates[template_path][0], content_hash)
+            bodies[template_path] = body
+        for template_path, (body, content_hash, child_path) in children.items():
+            local_templates[template_path] = ('(packaged %s)' % child_path, content_hash)
+            bodies[template_path] = body
+        # Nested child templates are referenced by content hash only, unless used by defined stacks.
+        stack_template_paths = set(stack_def.template_path for stack_def in self.stack_defs.values())
+        for child_path in set(child_path for body, content_hash, child_path in children.values()):
+            if child_path not in stack_template_paths:
+                # Not listed if not *.yaml. (e.g. *.yml, *.json)
+                local_templates.pop(child_path, None)
+                bodies.pop(child_path, None)
+
+        # {Template path, Content hash} of the templates on S3.
+        manifest = self.load_synced_manifest()
+        remote_hashes = dict(
+            (location[len(s3_location):], content_hash) for location, content_hash in manifest.items() if location.startswith(s3_location)
+        )
+        def local_md5(template_path):
+            import hashlib
+            if template_path in bodies:
+                return hashlib.md5(bodies[template_path]).hexdigest()
+            return file_hash(local_templates[template_path][0], 'md5')
+
+        if full or not remote_hashes:
+            # Compare by ETag(MD5) of S3 objects.
+            remote_hashes = {}
+            paginator = self.s3_client().get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket = bucket, Prefix = prefix + '/'):
+                for content in page.get('Contents', []):
+                    template_path = content['Key'][len(prefix) + 1:]
+                    if not template_path.endswith('.yaml'):
+                        continue
+                    local_template = local_templates.get(template_path)
+                    if local_template is not None and content['ETag'].strip('"') == local_md5(template_path):
+                        remote_hashes[template_path] = local_template[1]
+                    else:
+                        remote_hashes[template_path] = None
 
-        print('Fetching stacks...')
-        pages = []
-        next_token = None
-        while True:
-            page_iter = paginator.paginate(
-                StackStatusFilter = [
-                    'CREATE_IN_PROGRESS', 'CREATE_FAILED', 'CREATE_COMPLETE',
-                    'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE',
-                    'DELETE_IN_PROGRESS', 'DELETE_FAILED', # 'DELETE_COMPLETE',
-                    'UPDATE_IN_PROGRESS', 'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_COMPLETE',
-                    'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_FAILED', 'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_ROLLBACK_COMPLETE',
-                    'REVIEW_IN_PROGRESS'],
-                PaginationConfig = {
-                    'MaxItems': 500,
-                    'StartingToken': next_token
+        uploads = [(template_path, file_path) for template_path, (file_path, content_hash) in local_templates.items()
+                   if remote_hashes.get(template_path) != content_hash]
+        deletes = [template_path for template_path in remote_hashes if template_path not in local_templates]
+
+        s3_client = self.s3_client()
+
+        def upload(item):
+            template_path, file_path = item
+            if template_path in bodies:
+                body = bodies[template_path]
+            else:
+                with open(file_path, 'rb') as f:
+                    body = f.read()
+            s3_client.put_object(Bucket = bucket, Key = '%s/%s' % (prefix, template_path), Body = body)
+            return len(body)
+
+        uploaded_bytes = 0
+        for (template_path, file_path), size in zip(uploads, parallel_map(upload, uploads, workers)):
+            print('upload: %s to s3://%s/%s/%s' % (file_path, bucket, prefix, template_path))
+            uploaded_bytes += size
+
+        # DeleteObjects accepts up to 1000 keys per request.
+        for i in range(0, len(deletes), 1000):
+            result = s3_client.delete_objects(
+                Bucket = bucket,
+                Delete = {
+                    'Objects': [{'Key': '%s/%s' % (prefix, template_path)} for template_path in deletes[i:i + 1000]],
+                    'Quiet': True
                 }
             )
-            for page in page_iter:
-                pages.append(page)
-            next_token = pages[-1].get('NextToken', None)
-            if not next_token:
-                break
+            if result.get('Errors'):
+                abort(red('Failed to delete %s.' % ', '.join(error['Key'] for error in result['Errors'])))
+        for template_path in deletes:
+            print('delete: s3://%s/%s/%s' % (bucket, prefix, template_path))
+
+        # Record synchronized templates.
+        for location in [location for location in manifest if location.startswith(s3_location)]:
+            del manifest[location]
+        for template_path, (file_path, content_hash) in local_templates.items():
+            manifest[self.template_s3_location(template_path)] = content_hash
+        self.save_synced_manifest(manifest)
+
+        print(green('Uploaded %d files (%d bytes), deleted %d files, %d files unchanged.' % (
+            len(uploads), uploaded_bytes, len(deletes), len(local_templates) - len(uploads)
+        )))
+
+    def iter_stack_rows(self, nested = False):
+        """
+        Iterate rows of defined stacks. Stacks that have not been created yet come last.
+        Nested stacks belong to the alias of their root stack.
 
-        # TODO Refactoring.
-        defined_stack_names = Set()
-        defined_stack_aliases = {}
-        for stack_def in self.stack_defs.values():
-            defined_stack_names.add(stack_def.actual_stack_name())
-            defined_stack_aliases[stack_def.actual_stack_name()] = stack_def.stack_alias
-
-        def is_in_stack_group(stack_name):
-            for defined_stack_name in defined_stack_names:
-                # startswith(...-) for Chained stack.
-                if stack_name == defined_stack_name or stack_name.startswith(defined_stack_name + '-'):
-                    return True
-            return False
+        :param nested: Set True to include nested stacks, under their root stack. (Default False)
+        :return: Generator of rows. (Columns are STACK_COLUMNS)
+        """
+        # {Actual stack name, Stack alias}
+        defined_stack_aliases = self.stack_name_index()
+        # Removed when the stack found.
+        not_exist_stack_aliases = OrderedDict(defined_stack_aliases)
+
+        def row(stack_alias, summary, parent_stack_name, nested_stacks):
+            return [
+                stack_alias,
+                summary['StackName'],
+                parent_stack_name,
+                nested_stacks,
+                summary['StackStatus'],
+                summary['DriftInformation']['StackDriftStatus'],
+                summary['CreationTime'],
+                summary.get('LastUpdatedTime'),
+                summary.get('TemplateDescription', '')
+            ]
+
+        # Existing stacks.
+        hierarchy = self.stack_hierarchy()
+        for summary in hierarchy.roots:
+            stack_name = summary['StackName']
+            # Defined stack itself, or chained stack. (DEFINED_STACK_NAME-xxx)
+            defined_stack_name = find_defined_stack_name(defined_stack_aliases, stack_name)
+            if defined_stack_name is None:
+                continue
+            stack_alias = defined_stack_aliases[defined_stack_name]
+            not_exist_stack_aliases.pop(stack_name, None)
+            yield row(stack_alias, summary, None, hierarchy.nested_counts.get(summary['StackId'], 0))
+            if nested:
+                for depth, nested_summary in hierarchy.iter_nested(summary['StackId']):
+                    yield row(stack_alias, nested_summary, hierarchy.parent(nested_summary)['StackName'], None)
+        # Stacks that have not been created yet.
+        for not_exist_stack_name, not_exist_stack_alias in not_exist_stack_aliases.items():
+            yield [not_exist_stack_alias, not_exist_stack_name, None, None, 'Not created', None, None, None, None]
+
+    def list_stacks(self, output = None, nested = False):
+        """
+        List stacks. Nested stacks are collapsed into their root stack.
+
+        :param output: Write rows in the format 'jsonl' or 'csv'. (OPTIONAL. Default table)
+        :param nested: Set True to show nested stacks under their root stack. (Default False)
+        """
+        nested = nested == True or nested == 'True'
+        columns = self.STACK_COLUMNS
+        iter_rows = lambda: self.iter_stack_rows(nested)
+        if output:
+            self.stream_rows(output, columns, iter_rows)
+            return
+
+        def format_rows(rows):
+            # {Stack name, Depth of nested stack} (Parents come before children)
+            depths = {}
+            for row in rows:
+                stack_alias, stack_name, parent_stack_name, nested_stacks, status, drift_status, created_time, updated_time, description = row
+                if status == 'Not created':
+                    yield [stack_alias, stack_name, '-', status, '-', '-', '-', '-']
+                    continue
+                depth = depths[stack_name] = depths.get(parent_stack_name, -1) + 1
+                yield [
+                    stack_alias,
+                    '%s%s' % ('  ' * depth, self.shorten(stack_name, 70 - depth * 2, 5)),
+                    nested_stacks if nested_stacks is not None else '',
+                    self.colored_status(status),
+                    self.colored_drift_status(drift_status),
+                    self.format_datetime(created_time),
+                    self.format_datetime(updated_time) if updated_time is not None else '-',
+                    self.shorten(description, 70, 0)
+                ]
+
+        print('Fetching stacks...')
+        extra_columns, rows = self.collect_rows(lambda: list(format_rows(iter_rows())))
 
-        table = PrettyTable(['StackAlias', 'StackName', 'Status', 'DriftStatus', 'CreatedTime', 'UpdatedTime', 'Description'])
+        table = PrettyTable(extra_columns + [column for column in columns if column != 'ParentStackName'])
         table.align['StackAlias'] = 'l'
         table.align['StackName'] = 'l'
         table.align['Description'] = 'l'
         table.padding_width = 1
-        # Append existing stacks.
-        for page in pages:
-            summaries = page['StackSummaries']
-            for summary in summaries:
-                stack_name = summary['StackName']
-                if is_in_stack_group(stack_name):
-                    table.add_row([
-                        # TODO Show Alias at chaining stack.
-                        defined_stack_aliases.pop(stack_name) if defined_stack_aliases.has_key(stack_name) else '', # pop!
-                        self.shorten(stack_name, 70, 5),
-                        self.colored_status(summary['StackStatus']),
-                        self.colored_drift_status(summary['DriftInformation']['StackDriftStatus']),
-                        self.format_datetime(summary['CreationTime']),
-                        self.format_datetime(summary['LastUpdatedTime']) if summary.has_key('LastUpdatedTime') else '-',
-                        self.shorten(summary.get('TemplateDescription', ''), 70, 0)
-                    ])
-        # Append stacks that have not been created yet.
-        for not_exist_stack_name, not_exist_stack_alias in defined_stack_aliases.items():
-            table.add_row([
-                not_exist_stack_alias,
-                not_exist_stack_name,
-                'Not created',
-                '-',
-                '-',
-                '-',
-                '-'
-            ])
+        for row in rows:
+            table.add_row(row)
 
         print(blue('Stacks:', bold = True))
         print(table)
 
-    def desc_stack(self, alias_or_stackname):
+    def desc_stack(self, alias_or_stackname, events = 20, resources = False, drifts = False, output = None):
         """
         Describe existing stack.
+        Stack, events, resources and drifts are fetched at the same time.
 
         :param alias_or_stackname: Stack alias or Stack name.
+        :param events: Number of latest events to show. (Default 20)
+        :param resources: Set True to show resources. (Default False)
+        :param drifts: Set True to show resource drifts of the last drift detection. (Default False)
+        :param output: Write rows in the format 'jsonl' or 'csv'. (OPTIONAL. Default table)
+                       Each row has 'Section' column. (Stack, Parameters, Outputs, Events, Resources, Drifts)
         """
         if self.stack_defs.has_key(alias_or_stackname):
             stack_name = self.stack_defs[alias_or_stackname].actual_stack_name()
         else:
             stack_name = alias_or_stackname
+        events = int(events)
+        resources = resources == True or resources == 'True'
+        drifts = drifts == True or drifts == 'True'
+
+        # {Section name, Columns}
+        section_columns = OrderedDict([
+            ('Stack', ['StackName', 'Status', 'DriftStatus', 'CreatedTime', 'UpdatedTime', 'DriftDetectedTime', 'Description']),
+            ('Parameters', ['Key', 'Value']),
+            ('Outputs', ['Key', 'Value', 'Description']),
+            ('Events', ['Timestamp', 'Status', 'Type', 'LogicalID', 'StatusReason'])
+        ])
+        if resources:
+            section_columns['Resources'] = ['LogicalID', 'PhysicalID', 'Type', 'Status', 'UpdatedTime']
+        if drifts:
+            section_columns['Drifts'] = ['PhysicalID', 'Type', 'Status', 'Property', 'Diff', 'Expected', 'Actual']
+
+        def fetch_stack():
+            stack = self.describe_stack(stack_name)
+            if stack is None:
+                return None
+            return OrderedDict([
+                ('Stack', [[
+                    stack['StackName'],
+                    stack['StackStatus'],
+                    stack['DriftInformation']['StackDriftStatus'],
+                    stack['CreationTime'],
+                    stack.get('LastUpdatedTime'),
+                    stack['DriftInformation'].get('LastCheckTimestamp'),
+                    stack.get('Description', '')
+                ]]),
+                ('Parameters', [
+                    [
+                        param['ParameterKey'],
+                        param['ParameterValue']
+                    ] for param in stack.get('Parameters', [])
+                ]),
+                ('Outputs', [
+                    [
+                        output['OutputKey'],
+                        output['OutputValue'],
+                        output.get('Description')
+                    ] for output in stack.get('Outputs', [])
+                ])
+            ])
 
-        stack = self.cfn_resource().Stack(stack_name)
-        try:
-            stack.stack_id
-        except botocore.exceptions.ClientError:
-            # Stack does not exists
-            print(yellow('Stack %s does not exists.' % stack.name))
+        def fetch_events():
+            # Stop paging after latest events.
+            paginator = self.cfn_client().get_paginator('describe_stack_events')
+            rows = []
+            for page in paginator.paginate(StackName = stack_name, PaginationConfig = {'MaxItems': events}):
+                for event in page['StackEvents']:
+                    rows.append([
+                        event['Timestamp'],
+                        event['ResourceStatus'],
+                        event['ResourceType'],
+                        event['LogicalResourceId'],
+                        event.get('ResourceStatusReason')
+                    ])
+            return {'Events': rows[:events]}
+
+        def fetch_resources():
+            paginator = self.cfn_client().get_paginator('list_stack_resources')
+            rows = []
+            for page in paginator.paginate(StackName = stack_name):
+                for summary in page['StackResourceSummaries']:
+                    rows.append([
+                        summary['LogicalResourceId'],
+                        summary.get('PhysicalResourceId', ''),
+                        summary['ResourceType'],
+                        summary['ResourceStatus'],
+                        summary['LastUpdatedTimestamp']
+                    ])
+            return {'Resources': rows}
+
+        def fetch_drifts():
+            return {'Drifts': list(self.__iter_resource_drifts(stack_name))}
+
+        fetchers = [fetch_stack, fetch_events]
+        if resources:
+            fetchers.append(fetch_resources)
+        if drifts:
+            fetchers.append(fetch_drifts)
+
+        def call(fetcher):
+            try:
+                return fetcher()
+            except botocore.exceptions.ClientError as e:
+                # Stack does not exists. (Detected by fetch_stack) Other errors are not ignored.
+                if fetcher is fetch_stack or e.response['Error']['Code'] != 'ValidationError':
+                    raise
+                return {}
+
+        def fetch_sections():
+            """
+            Fetch all sections at the same time.
+
+            :return: {Section name, Raw rows} None if stack does not exists.
+            """
+            results = self.parallel_map(call, fetchers, len(fetchers))
+            if results[0] is None:
+                return None
+            # Empty if the section could not be fetched.
+            sections = dict((section_name, []) for section_name in section_columns)
+            for result in results:
+                sections.update(result)
+            return sections
+
+        if output:
+            # One CSV header for all sections. (Columns of other sections are empty)
+            csv_columns = ['Section'] + (['Region', 'Account'] if self.in_fan_out() else [])
+            for columns in section_columns.values():
+                csv_columns.extend(column for column in columns if column not in csv_columns)
+            writer = RowWriter(output, csv_columns = csv_columns)
+
+            def write_sections(prefix_columns, prefix):
+                sections = fetch_sections()
+                if sections is None:
+                    # Warn to stderr, not to break output.
+                    warn('Stack %s does not exists%s.' % (stack_name, ' in %s (%s)' % tuple(prefix) if prefix else ''))
+                    return
+                for section_name, columns in section_columns.items():
+                    for row in sections[section_name]:
+                        writer.write(['Section'] + prefix_columns + columns, [section_name] + prefix + row)
+
+            if not self.in_fan_out():
+                write_sections([], [])
+            else:
+                self.fan_out(lambda: write_sections(['Region', 'Account'], [self.session().region_name, self.account_id()]))
             return
 
+        # Format raw rows for table.
+        section_formatters = {
+            'Stack': lambda rows: [[
+                row[0],
+                self.colored_status(row[1]),
+                self.colored_drift_status(row[2]),
+                self.format_datetime(row[3]),
+                self.format_datetime(row[4]) if row[4] is not None else '-',
+                self.format_datetime(row[5]) if row[5] is not None else '-',
+                self.shorten(row[6], 70, 0)
+            ] for row in rows],
+            'Parameters': lambda rows: rows,
+            'Outputs': lambda rows: [[row[0], row[1], self.shorten(row[2], 70, 0) if row[2] is not None else '-'] for row in rows],
+            'Events': lambda rows: [[
+                self.format_datetime(row[0]),
+                self.colored_status(row[1]),
+                row[2],
+                row[3],
+                self.shorten(row[4], 70, 0) if row[4] is not None else ''
+            ] for row in rows],
+            'Resources': lambda rows: [[
+                row[0],
+                self.shorten(row[1], 40, 5),
+                row[2],
+                self.colored_status(row[3]),
+                self.format_datetime(row[4])
+            ] for row in rows],
+            'Drifts': lambda rows: self.__format_resource_drift_rows(rows)
+        }
+
+        def fetch_formatted_sections():
+            sections = fetch_sections()
+            if sections is None:
+                return None
+            return dict((section_name, section_formatters[section_name](sections[section_name])) for section_name in section_columns)
+
+        if self.in_fan_out():
+            columns = ['Region', 'Account']
+            targets_sections = []
+            for region, account_id, sections in self.fan_out(fetch_formatted_sections):
+                if sections is None:
+                    print(yellow('Stack %s does not exists in %s (%s).' % (stack_name, region, account_id)))
+                else:
+                    targets_sections.append(([region, account_id], sections))
+            if not targets_sections:
+                return
+        else:
+            columns = []
+            sections = fetch_formatted_sections()
+            if sections is None:
+                print(yellow('Stack %s does not exists.' % stack_name))
+                return
+            targets_sections = [([], sections)]
+
+        def rows_of(section_name):
+            return [prefix + row for prefix, sections in targets_sections for row in sections[section_name]]
+
         print(blue('Stack:', bold = True))
-        table = PrettyTable()
-        table.add_column('StackName', [stack.stack_name])
+        table = PrettyTable(columns + section_columns['Stack'])
         table.align['StackName'] = 'l'
-        table.add_column('Status', [self.colored_status(stack.stack_status)])
-        table.add_column('DriftStatus', [self.colored_drift_status(stack.drift_information['StackDriftStatus'])])
-        table.add_column('CreatedTime', [self.format_datetime(stack.creation_time)])
-        table.add_column('UpdatedTime', [self.format_datetime(stack.last_updated_time)])
-        table.add_column('DriftDetectedTime', [self.format_datetime(stack.drift_information['LastCheckTimestamp']) if 'LastCheckTimestamp' in stack.drift_information else '-'])
-        table.add_column('Description', [self.shorten(stack.description, 70, 0)])
+        for row in rows_of('Stack'):
+            table.add_row(row)
         print(table)
 
         print(blue('Parameters:', bold = True))
-        if stack.parameters is None:
+        rows = rows_of('Parameters')
+        if not rows:
             print('No parameters.')
         else:
-            table = PrettyTable(['Key', 'Value'])
+            table = PrettyTable(columns + section_columns['Parameters'])
             table.align['Key'] = 'l'
             table.align['Value'] = 'l'
-            for param in stack.parameters:
-                table.add_row([
-                    param['ParameterKey'],
-                    param['ParameterValue']
-                ])
+            for row in rows:
+                table.add_row(row)
             print(table)
 
         print(blue('Outputs:', bold = True))
-        if stack.outputs is None:
+        rows = rows_of('Outputs')
+        if not rows:
             print('No outputs.')
         else:
-            table = PrettyTable(['Key', 'Value', 'Description'])
+            table = PrettyTable(columns + section_columns['Outputs'])
             table.align['Key'] = 'l'
             table.align['Value'] = 'l'
             table.align['Description'] = 'l'
-            for output in stack.outputs:
-                table.add_row([
-                    output['OutputKey'],
-                    output['OutputValue'],
-                    self.shorten(output['Description'], 70, 0) if output.has_key('Description') else '-'
-                ])
+            for row in rows:
+                table.add_row(row)
             print(table)
 
-        print(blue('Events(last 20):', bold = True))
-        table = PrettyTable(['Timestamp', 'Status', 'Type', 'LogicalID', 'StatusReason'])
+        print(blue('Events(last %d):' % events, bold = True))
+        table = PrettyTable(columns + section_columns['Events'])
         table.align['Timestamp'] = 'l'
         table.align['Type'] = 'l'
         table.align['LogicalID'] = 'l'
         table.align['StatusReason'] = 'l'
-        # Show latest 20 events.
-        for event in list(stack.events.all())[:20]:
-            table.add_row([
-                self.format_datetime(event.timestamp),
-                self.colored_status(event.resource_status),
-                event.resource_type,
-                event.logical_resource_id,
-                self.shorten(event.resource_status_reason, 70, 0) if event.resource_status_reason is not None else ''
-            ])
+        for row in rows_of('Events'):
+            table.add_row(row)
         print(table)
 
-    def detect_drift(self, alias_or_stackname):
+        if resources:
+            print(blue('Resources:', bold = True))
+            table = PrettyTable(columns + section_columns['Resources'])
+            table.align['LogicalID'] = 'l'
+            table.align['PhysicalID'] = 'l'
+            table.align['Type'] = 'l'
+            for row in rows_of('Resources'):
+                table.add_row(row)
+            print(table)
+
+        if drifts:
+            print(blue('Drifts:', bold = True))
+            table = PrettyTable(columns + section_columns['Drifts'])
+            table.align['PhysicalID'] = 'l'
+            table.align['Type'] = 'l'
+            table.align['Property'] = 'l'
+            table.align['Expected'] = 'l'
+            table.align['Actual'] = 'l'
+            for row in rows_of('Drifts'):
+                table.add_row(row)
+            print(table)
+
+    def colored_resource_drift_status(self, status):
+        if status == 'IN_SYNC':
+            return green(status)
+        elif status == 'MODIFIED':
+            return yellow(status)
+        elif status == 'DELETED':
+            return red(status)
+        else:
+            return status
+
+    def colored_diff(self, diff):
+        if diff == 'ADD':
+            return blue(diff)
+        elif diff == 'REMOVE':
+            return red(diff)
+        else:
+            return yellow(diff)
+
+    def __wait_for_drift_detections(self, drift_ids):
+        """
+        Wait for drift detections to complete. Poll all detections in one loop.
+
+        :param drift_ids: {Stack name, Drift detection ID}
+        :return: {Stack name, Drift detection status}
+        """
+        results = {}
+        pending = dict(drift_ids)
+        intervals = backoff_intervals(maximum = 15)
+        while True:
+            for stack_name, drift_id in pending.items():
+                result = self.cfn_client().describe_stack_drift_detection_status(
+                    StackDriftDetectionId = drift_id
+                )
+                if result['DetectionStatus'] != 'DETECTION_IN_PROGRESS':
+                    results[stack_name] = result
+                    del pending[stack_name]
+            if not pending:
+                return results
+            time.sleep(next(intervals))
+
+    def __iter_resource_drifts(self, stack_name):
+        """
+        Fetch resource drifts of the stack page by page, and make raw rows.
+
+        :param stack_name: Stack name.
+        :return: Generator of raw rows. [PhysicalID, Type, Status, Property, Diff, Expected, Actual]
+        """
+        request = dict(StackName = stack_name)
+        while True:
+            result = self.cfn_client().describe_stack_resource_drifts(**request)
+            for drift in result['StackResourceDrifts']:
+                if drift['PropertyDifferences']:
+                    for diff in drift['PropertyDifferences']:
+                        yield [
+                            drift['PhysicalResourceId'],
+                            drift['ResourceType'],
+                            drift['StackResourceDriftStatus'],
+                            diff['PropertyPath'],
+                            diff['DifferenceType'],
+                            diff['ExpectedValue'],
+                            diff['ActualValue'],
+                        ]
+                else:
+                    yield [
+                        drift['PhysicalResourceId'],
+                        drift['ResourceType'],
+                        drift['StackResourceDriftStatus'],
+                        None,
+                        None,
+                        None,
+                        None,
+                    ]
+            if not result.get('NextToken'):
+                break
+            request['NextToken'] = result['NextToken']
+
+    def __resource_drift_rows(self, stack_name):
+        """
+        Fetch resource drifts of the stack, and make table rows.
+
+        :param stack_name: Stack name.
+        :return: Table rows. [PhysicalID, Type, Status, Property, Diff, Expected, Actual]
+        """
+        return self.__format_resource_drift_rows(self.__iter_resource_drifts(stack_name))
+
+    def __format_resource_drift_rows(self, raw_rows):
+        """
+        Sort and color raw rows of resource drifts for table.
+        """
+        rows = []
+        for row in sorted(raw_rows, key = lambda x: x[0], reverse = True):
+            physical_id, resource_type, status, property_path, diff, expected, actual = row
+            if property_path is None:
+                rows.append([physical_id, resource_type, self.colored_resource_drift_status(status), '-', '-', '-', '-'])
+            else:
+                rows.append([
+                    physical_id,
+                    resource_type,
+                    self.colored_resource_drift_status(status),
+                    property_path,
+                    self.colored_diff(diff),
+                    expected,
+                    actual
+                ])
+        return rows
+
+    def detect_drift(self, alias_or_stackname, output = None):
         """
         List detected drifts. (Different resource property between Stack and Actual resource).
 
         :param alias_or_stackname: Stack alias or Stack name.
+        :param output: Write drifts as soon as fetched, in the format 'jsonl' or 'csv'. (OPTIONAL. Default table)
         """
 
         if self.stack_defs.has_key(alias_or_stackname):
@@ -497,23 +3013,18 @@ class StackGroup(object):
         else:
             stack_name = alias_or_stackname
 
-        def detect_drift(_stack_name):
+        if not output:
             print('Detecting draft for the stack %s...' % stack_name)
-            result = self.cfn_client().detect_stack_drift(
-                StackName = _stack_name
-            )
-            return result['StackDriftDetectionId']
-
-        def wait_for_drift_to_detected(_stack_name, drift_id):
-            def get_drift_status():
-                return self.cfn_client().describe_stack_drift_detection_status(
-                    StackDriftDetectionId = drift_id
-                )
-
-            result = get_drift_status()
+        drift_id = self.cfn_client().detect_stack_drift(
+            StackName = stack_name
+        )['StackDriftDetectionId']
 
+        result = self.cfn_client().describe_stack_drift_detection_status(
+            StackDriftDetectionId = drift_id
+        )
+        if not output:
             table = PrettyTable()
-            table.add_column('StackName', [_stack_name])
+            table.add_column('StackName', [stack_name])
             table.align['StackName'] = 'l'
             table.add_column('DriftDetectionId', [result['StackDriftDetectionId']])
             table.align['DriftDetectionId'] = 'l'
@@ -523,162 +3034,563 @@ class StackGroup(object):
 
             print('')
             print('Waiting for detection to complete...')
-            while result['DetectionStatus'] == 'DETECTION_IN_PROGRESS':
-                time.sleep(10)
-                result = get_drift_status()
-
-        def show_drifts(_stack_name):
-            def colored_status(s):
-                if s == 'IN_SYNC':
-                    return green(s)
-                elif s == 'MODIFIED':
-                    return yellow(s)
-                elif s == 'DELETED':
-                    return red(s)
-                else:
-                    return s
+        if result['DetectionStatus'] == 'DETECTION_IN_PROGRESS':
+            self.__wait_for_drift_detections({stack_name: drift_id})
+        self.forget_stack_state()
+
+        if output:
+            writer = RowWriter(output)
+            columns = ['StackName', 'PhysicalID', 'Type', 'Status', 'Property', 'Diff', 'Expected', 'Actual']
+            for row in self.__iter_resource_drifts(stack_name):
+                writer.write(columns, [stack_name] + row)
+            return
 
-            def colored_diff(s):
-                if s == 'ADD':
-                    return blue(s)
-                elif s == 'REMOVE':
-                    return red(s)
-                else:
-                    return yellow(s)
+        table = PrettyTable(['PhysicalID', 'Type', 'Status', 'Property', 'Diff', 'Expected', 'Actual'])
+        table.align['PhysicalID'] = 'l'
+        table.align['Type'] = 'l'
+        table.align['Property'] = 'l'
+        table.align['Expected'] = 'l'
+        table.align['Actual'] = 'l'
+        for row in self.__resource_drift_rows(stack_name):
+            table.add_row(row)
+        print(blue('Drifts:', bold = True))
+        print(table)
 
-            result = self.cfn_client().describe_stack_resource_drifts(
-                StackName = _stack_name
-            )
+    def detect_drift_all(self, workers = 8, nested = False):
+        """
+        List detected drifts of all defined stacks. Detections run at the same time.
 
-            table = PrettyTable(['PhysicalID', 'Type', 'Status', 'Property', 'Diff', 'Expected', 'Actual'])
-            table.align['PhysicalID'] = 'l'
-            table.align['Type'] = 'l'
-            table.align['Property'] = 'l'
-            table.align['Expected'] = 'l'
-            table.align['Actual'] = 'l'
-            for drift in sorted(result['StackResourceDrifts'], key = lambda x: x['PhysicalResourceId'], reverse = True):
-                if drift['PropertyDifferences']:
-                    for diff in drift['PropertyDifferences']:
-                        table.add_row([
-                            drift['PhysicalResourceId'],
-                            drift['ResourceType'],
-                            colored_status(drift['StackResourceDriftStatus']),
-                            diff['PropertyPath'],
-                            colored_diff(diff['DifferenceType']),
-                            diff['ExpectedValue'],
-                            diff['ActualValue'],
-                        ])
+        :param workers: Number of stacks to request at the same time. (Default 8)
+        :param nested: Set True to detect drifts of nested stacks too, and roll up them into their root stack. (Default False)
+        """
+        nested = nested == True or nested == 'True'
+        # {Stack name, Names of the stack and its nested stacks}
+        trees = OrderedDict((stack_def.actual_stack_name(), None) for stack_def in self.stack_defs.values())
+        hierarchy = self.stack_hierarchy() if nested else None
+        for stack_name in trees:
+            trees[stack_name] = hierarchy.tree_stack_names(stack_name) if nested else [stack_name]
+        stack_names = list(itertools.chain.from_iterable(trees.values()))
+
+        def start_detection(stack_name):
+            try:
+                return stack_name, self.cfn_client().detect_stack_drift(
+                    StackName = stack_name
+                )['StackDriftDetectionId']
+            except botocore.exceptions.ClientError as e:
+                # Stack does not exists. Other errors (e.g. throttling, access denied) are not ignored.
+                if not is_stack_not_found(e):
+                    raise
+                return stack_name, None
+
+        print('Detecting drift for %d stacks...' % len(stack_names))
+        drift_ids = OrderedDict(
+            (stack_name, drift_id) for stack_name, drift_id in self.parallel_map(start_detection, stack_names, workers) if drift_id is not None
+        )
+
+        print('Waiting for detection to complete...')
+        results = self.__wait_for_drift_detections(drift_ids)
+        self.forget_stack_state()
+
+        print('Fetching drifts...')
+        detected_stack_names = [stack_name for stack_name in drift_ids if results[stack_name]['DetectionStatus'] == 'DETECTION_COMPLETE']
+        drift_rows = dict(zip(detected_stack_names, self.parallel_map(self.__resource_drift_rows, detected_stack_names, workers)))
+
+        table = PrettyTable(['StackAlias', 'StackName', 'DetectionStatus', 'DriftStatus', 'DriftedResources'])
+        table.align['StackAlias'] = 'l'
+        table.align['StackName'] = 'l'
+        for stack_def in self.stack_defs.values():
+            stack_name = stack_def.actual_stack_name()
+            result = results.get(stack_name)
+            if result is None:
+                table.add_row([stack_def.stack_alias, stack_name, 'Not created', '-', '-'])
+                continue
+            # Roll up nested stacks into the root stack.
+            tree_results = [results[name] for name in trees[stack_name] if name in results]
+            detection_statuses = [tree_result['DetectionStatus'] for tree_result in tree_results]
+            drift_statuses = [tree_result.get('StackDriftStatus') for tree_result in tree_results]
+            table.add_row([
+                stack_def.stack_alias,
+                stack_name if len(tree_results) == 1 else '%s (+%d nested)' % (stack_name, len(tree_results) - 1),
+                self.colored_status('DETECTION_FAILED' if 'DETECTION_FAILED' in detection_statuses else result['DetectionStatus']),
+                self.colored_drift_status('DRIFTED' if 'DRIFTED' in drift_statuses else result.get('StackDriftStatus', '-')),
+                sum(tree_result.get('DriftedStackResourceCount', 0) for tree_result in tree_results) if 'DriftedStackResourceCount' in result else '-'
+            ])
+        print(blue('DriftDetections:', bold = True))
+        print(table)
+
+        table = PrettyTable(['StackName', 'PhysicalID', 'Type', 'Status', 'Property', 'Diff', 'Expected', 'Actual'])
+        table.align['StackName'] = 'l'
+        table.align['PhysicalID'] = 'l'
+        table.align['Type'] = 'l'
+        table.align['Property'] = 'l'
+        table.align['Expected'] = 'l'
+        table.align['Actual'] = 'l'
+        for stack_name in detected_stack_names:
+            for row in drift_rows[stack_name]:
+                table.add_row([stack_name] + row)
+        print(blue('Drifts:', bold = True))
+        print(table)
+
+    def dependency_graph(self):
+        """
+        Build dependency graph of defined stacks.
+        Dependencies are declared by define_stack(depends_on = [...]), and inferred from Fn::ImportValue / Export in templates
+        and references to outputs of stacks in parameters.
+
+        :return: {Stack alias, Set of stack aliases that the stack depends on}
+        """
+        templates = {}
+        exporters = {}
+        for stack_def in self.stack_defs.values():
+            template = stack_def.load_local_template()
+            templates[stack_def.stack_alias] = template
+            if template is None:
+                continue
+            for output in (template.get('Outputs') or {}).values():
+                if isinstance(output, dict) and isinstance(output.get('Export'), dict):
+                    exporters[intrinsic_key(output['Export'].get('Name'))] = stack_def.stack_alias
+
+        graph = OrderedDict()
+        for stack_def in self.stack_defs.values():
+            depends = set()
+            for depend_alias in stack_def.depends_on:
+                if not self.stack_defs.has_key(depend_alias):
+                    abort(red('Stack %s depends on undefined stack %s.' % (stack_def.stack_alias, depend_alias)))
+                depends.add(depend_alias)
+            template = templates[stack_def.stack_alias]
+            if template is not None:
+                for import_key in find_import_values(template):
+                    exporter = exporters.get(import_key)
+                    if exporter is not None and exporter != stack_def.stack_alias:
+                        depends.add(exporter)
+            # Parameters referring outputs of other stacks. ({{stack:ALIAS.Outputs.KEY}})
+            specified_params = stack_def.specified_params(parameters_from_template(template) if template is not None else None)
+            for value in specified_params.values():
+                for depend_alias, output_key in stack_output_references(value):
+                    if not self.stack_defs.has_key(depend_alias):
+                        abort(red('Stack %s refers undefined stack %s.' % (stack_def.stack_alias, depend_alias)))
+                    if depend_alias != stack_def.stack_alias:
+                        depends.add(depend_alias)
+            graph[stack_def.stack_alias] = depends
+        return graph
+
+    def __execute_in_parallel(self, operation_name, workers, reverse = False):
+        """
+        Execute stack operation for all defined stacks on worker threads.
+        A stack is started after all stacks that it depends on are completed.
+
+        :param operation_name: 'create', 'update' or 'delete'.
+        :param workers: Number of worker threads.
+        :param reverse: Set True to execute in reverse dependency order. (For delete)
+        """
+        from multiprocessing.pool import ThreadPool
+        import Queue
+
+        graph = self.dependency_graph()
+        if reverse:
+            reversed_graph = OrderedDict((alias, set()) for alias in graph)
+            for alias, depends in graph.items():
+                for depend_alias in depends:
+                    reversed_graph[depend_alias].add(alias)
+            graph = reversed_graph
+
+        # Detect circular dependencies. (Kahn's algorithm)
+        in_degrees = dict((alias, len(depends)) for alias, depends in graph.items())
+        dependents = dict((alias, []) for alias in graph)
+        for alias, depends in graph.items():
+            for depend_alias in depends:
+                dependents[depend_alias].append(alias)
+        sorted_aliases = [alias for alias, degree in in_degrees.items() if degree == 0]
+        for alias in sorted_aliases:
+            for dependent in dependents[alias]:
+                in_degrees[dependent] -= 1
+                if in_degrees[dependent] == 0:
+                    sorted_aliases.append(dependent)
+        if len(sorted_aliases) != len(graph):
+            abort(red('Circular dependency between stacks %s.' % ', '.join(a for a in graph if a not in sorted_aliases)))
+
+        # Boto3 clients are shared by worker threads, so create them before start.
+        self.cfn_client()
+        self.cfn_resource()
+        if operation_name in ['create', 'update']:
+            self.prefetch_stack_params(self.stack_defs.values())
+
+        waiting = OrderedDict((alias, set(depends)) for alias, depends in graph.items())
+        results = OrderedDict((alias, 'Not executed') for alias in graph)
+        completed = Queue.Queue()
+        pool = ThreadPool(max(1, int(workers)))
+
+        def run(alias):
+            try:
+                return alias, getattr(self.stack_defs[alias], operation_name)()['Status'], None
+            except (Exception, SystemExit) as e:
+                return alias, None, e
+
+        def skip_dependents(alias):
+            for dependent in dependents[alias]:
+                if waiting.has_key(dependent):
+                    del waiting[dependent]
+                    results[dependent] = 'SKIPPED'
+                    skip_dependents(dependent)
+
+        running = 0
+        env.Unattended = True
+        try:
+            while True:
+                for alias, depends in waiting.items():
+                    if not depends:
+                        del waiting[alias]
+                        print(blue('Start %s stack %s.' % (operation_name, alias), bold = True))
+                        pool.apply_async(run, (alias,), callback = completed.put)
+                        running += 1
+                if running == 0:
+                    break
+
+                # Wait with timeout, to accept ctrl+C.
+                while True:
+                    try:
+                        alias, status, error = completed.get(timeout = 1)
+                        break
+                    except Queue.Empty:
+                        pass
+                running -= 1
+                if error is None:
+                    # Exists stack (create) and not exists stack (delete) are nothing to do, so dependents are started.
+                    results[alias] = status if status in ['NO_CHANGES', 'EXISTS', 'NOT_EXISTS'] else 'COMPLETE'
+                    print(green('Finish %s stack %s.' % (operation_name, alias), bold = True))
+                    for depends in waiting.values():
+                        depends.discard(alias)
                 else:
-                    table.add_row([
-                        drift['PhysicalResourceId'],
-                        drift['ResourceType'],
-                        colored_status(drift['StackResourceDriftStatus']),
-                        '-',
-                        '-',
-                        '-',
-                        '-',
-                    ])
-            print(blue('Drifts:', bold = True))
-            print(table)
+                    results[alias] = 'FAILED'
+                    print(red('Failed %s stack %s. %s' % (operation_name, alias, error), bold = True))
+                    skip_dependents(alias)
+        finally:
+            env.Unattended = False
+            pool.terminate()
+
+        table = PrettyTable(['StackAlias', 'StackName', 'Result'])
+        table.align['StackAlias'] = 'l'
+        table.align['StackName'] = 'l'
+        for alias, result in results.items():
+            table.add_row([
+                alias,
+                self.stack_defs[alias].actual_stack_name(),
+                green(result) if result == 'COMPLETE' else red(result) if result == 'FAILED' else yellow(result)
+            ])
+        print(blue('Results:', bold = True))
+        print(table)
+
+        if 'FAILED' in results.values():
+            abort(red('Failed to %s some stacks.' % operation_name))
+
+    def create_all(self, workers = 4, **kwparams):
+        """
+        Create all defined stacks in parallel. (Respects dependencies between stacks)
+
+        :param workers: Number of stacks to create at the same time. (Default 4)
+        :param kwparams: Stack parameters.
+        """
+        self.params(**kwparams)
+        self.__execute_in_parallel('create', workers)
+
+    @confirm
+    def update_all(self, workers = 4, **kwparams):
+        """
+        Update all defined stacks in parallel. (Respects dependencies between stacks)
+
+        :param workers: Number of stacks to update at the same time. (Default 4)
+        :param kwparams: Stack parameters.
+        """
+        self.params(**kwparams)
+        self.__execute_in_parallel('update', workers)
+
+    @confirm
+    def delete_all(self, workers = 4):
+        """
+        Delete all defined stacks in parallel. (Reverse order of dependencies between stacks)
+
+        :param workers: Number of stacks to delete at the same time. (Default 4)
+        """
+        self.__execute_in_parallel('delete', workers, reverse = True)
+
+    def plan(self, workers = 4, **kwparams):
+        """
+        Create change sets for all defined stacks in parallel, and record them to local state dir.
+        Execute recorded change sets by 'apply' task.
+
+        :param workers: Number of stacks to plan at the same time. (Default 4)
+        :param kwparams: Stack parameters.
+        """
+        self.params(**kwparams)
+
+        def plan_stack(stack_def):
+            try:
+                return stack_def.stack_alias, stack_def.plan(), None
+            except (Exception, SystemExit) as e:
+                return stack_def.stack_alias, None, e
+
+        print('Planning %d stacks...' % len(self.stack_defs))
+        # Boto3 clients are shared by worker threads, so create them before start.
+        self.cfn_client()
+        self.prefetch_stack_params(self.stack_defs.values())
+        env.Unattended = True
+        try:
+            results = self.parallel_map(plan_stack, self.stack_defs.values(), workers)
+        finally:
+            env.Unattended = False
+
+        planned_stacks = OrderedDict((alias, planned) for alias, planned, error in results if planned is not None)
+        self.save_plan(dict(
+            Profile = self.session_key()[0],
+            Region = self.session().region_name,
+            CreatedTime = datetime.datetime.utcnow().isoformat() + 'Z',
+            Stacks = planned_stacks
+        ))
+
+        table = PrettyTable(['StackAlias', 'StackName', 'Type', 'Changes', 'Result'])
+        table.align['StackAlias'] = 'l'
+        table.align['StackName'] = 'l'
+        table.align['Result'] = 'l'
+        for alias, planned, error in results:
+            stack_name = self.stack_defs[alias].actual_stack_name()
+            if error is not None:
+                table.add_row([alias, stack_name, '-', '-', red('FAILED %s' % error)])
+            elif planned is None:
+                table.add_row([alias, stack_name, '-', 0, yellow('No changes')])
+            else:
+                table.add_row([alias, stack_name, planned['ChangeSetType'], len(planned['Changes']), green('PLANNED')])
+        print(blue('Plan:', bold = True))
+        print(table)
+
+        self.show_planned_changes(planned_stacks)
+
+        if any(error is not None for alias, planned, error in results):
+            abort(red('Failed to plan some stacks.'))
+        if planned_stacks:
+            print('Run apply task to execute planned change sets.')
+
+    def show_planned_changes(self, planned_stacks):
+        """
+        Show changes of planned change sets.
+
+        :param planned_stacks: {Stack alias, Planned change set}
+        """
+        table = PrettyTable(['StackAlias', 'Action', 'LogicalID', 'ResourceType', 'Replacement'])
+        table.align['StackAlias'] = 'l'
+        table.align['LogicalID'] = 'l'
+        table.align['ResourceType'] = 'l'
+        for alias, planned in planned_stacks.items():
+            for change in planned['Changes']:
+                table.add_row([alias, change['Action'], change['LogicalResourceId'], change['ResourceType'], change.get('Replacement', '-')])
+        print(blue('Changes:', bold = True))
+        print(table)
+
+    @confirm
+    def apply(self, workers = 4):
+        """
+        Execute change sets recorded by plan task, in parallel. (Respects dependencies between stacks)
+
+        :param workers: Number of stacks to apply at the same time. (Default 4)
+        """
+        plan = self.load_plan()
+        if not plan.get('Stacks'):
+            abort(red('No planned change sets. Run plan task at first.'))
+        if plan['Profile'] != self.session_key()[0] or plan['Region'] != self.session().region_name:
+            abort(red('Change sets were planned for profile %s, region %s.' % (plan['Profile'], plan['Region'])))
+        print('Applying change sets planned at %s.' % plan['CreatedTime'])
+        self.show_planned_changes(OrderedDict(
+            (alias, plan['Stacks'][alias]) for alias in self.stack_defs if plan['Stacks'].has_key(alias)
+        ))
+
+        self.__plan = plan
+        try:
+            self.__execute_in_parallel('apply', workers)
+        finally:
+            self.__plan = None
+
+    def planned_change_set(self, alias):
+        """
+        Get planned change set of the stack, while applying plan.
+
+        :param alias: Stack alias.
+        :return: Planned change set. None if not planned.
+        """
+        with self.__plan_lock:
+            return self.__plan['Stacks'].get(alias) if self.__plan is not None else None
 
-        drift_id = detect_drift(stack_name)
-        wait_for_drift_to_detected(stack_name, drift_id)
-        show_drifts(stack_name)
+    def forget_planned_change_set(self, alias):
+        """
+        Remove executed change set from the plan.
+
+        :param alias: Stack alias.
+        """
+        with self.__plan_lock:
+            del self.__plan['Stacks'][alias]
+            self.save_plan(self.__plan)
 
+    def iter_resource_rows(self, alias = None, workers = 8, nested = False):
+        """
+        Iterate rows of existing stack resources. Resources of the stacks are fetched in parallel.
 
-# TODO Bulk create all stacks.
-    # TODO Bulk update all stacks.
-    # TODO Bulk delete all stacks.
+        :param alias: Stack alias.(OPTIONAL. Default all stacks)
+        :param workers: Number of stacks to fetch at the same time. (Default 8)
+        :param nested: Set True to include resources of nested stacks, after their root stack. (Default False)
+        :return: Generator of rows. (Columns are RESOURCE_COLUMNS)
+        """
+        if alias is None:
+            stack_defs = self.stack_defs.values()
+        elif self.stack_defs.has_key(alias):
+            stack_defs = [self.stack_defs[alias]]
+        else:
+            abort(red('Stack %s is not defined.' % alias))
 
-    def list_resources(self):
+        def fetch_resources(stack_name):
+            summaries = []
+            try:
+                paginator = self.cfn_client().get_paginator('list_stack_resources')
+                for page in paginator.paginate(StackName = stack_name):
+                    summaries.extend(page['StackResourceSummaries'])
+            except botocore.exceptions.ClientError:
+                # Ignore this stack if exception occurred.
+                pass
+            return stack_name, summaries
+
+        stack_names = [stack_def.actual_stack_name() for stack_def in stack_defs]
+        if nested:
+            hierarchy = self.stack_hierarchy()
+            stack_names = list(itertools.chain.from_iterable(hierarchy.tree_stack_names(stack_name) for stack_name in stack_names))
+        # Rows of a stack are available as soon as the stack is fetched.
+        for stack_name, summaries in self.parallel_imap(fetch_resources, stack_names, workers):
+            for summary in summaries:
+                yield [
+                    stack_name,
+                    summary['LogicalResourceId'],
+                    summary['PhysicalResourceId'],
+                    summary['ResourceType'],
+                    summary['ResourceStatus'],
+                    summary['LastUpdatedTimestamp']
+                ]
+
+    def list_resources(self, alias = None, workers = 8, output = None, nested = False):
         """
         List existing stack resources.
+
+        :param alias: Stack alias.(OPTIONAL. Default all stacks)
+        :param workers: Number of stacks to fetch at the same time. (Default 8)
+        :param output: Write rows as soon as fetched, in the format 'jsonl' or 'csv'. (OPTIONAL. Default table)
+        :param nested: Set True to include resources of nested stacks. (Default False)
         """
-        paginator = self.cfn_client().get_paginator('list_stack_resources')
+        if alias is not None and not self.stack_defs.has_key(alias):
+            abort(red('Stack %s is not defined.' % alias))
+
+        nested = nested == True or nested == 'True'
+        columns = self.RESOURCE_COLUMNS
+        iter_rows = lambda: self.iter_resource_rows(alias, workers, nested)
+
+        if output:
+            self.stream_rows(output, columns, iter_rows)
+            return
 
-        table = PrettyTable(['StackName', 'LogicalID', 'PhysicalID', 'Type', 'Status', 'UpdatedTime'])
+        def format_row(row):
+            stack_name, logical_id, physical_id, resource_type, status, updated_time = row
+            return [
+                stack_name,
+                logical_id,
+                self.shorten(physical_id, 40, 5),
+                resource_type,
+                self.colored_status(status),
+                self.format_datetime(updated_time)
+            ]
+
+        print('Fetching resources...')
+        extra_columns, rows = self.collect_rows(lambda: [format_row(row) for row in iter_rows()])
+
+        table = PrettyTable(extra_columns + columns)
         table.align['StackName'] = 'l'
         table.align['LogicalID'] = 'l'
         table.align['PhysicalID'] = 'l'
         table.align['Type'] = 'l'
-
-        print('Fetching resources...')
-        for stack_def in self.stack_defs.values():
-            stack_name = stack_def.actual_stack_name()
-            try:
-                pages = []
-                next_token = None
-                while True:
-                    page_iter = paginator.paginate(
-                        StackName = stack_name,
-                        PaginationConfig = {
-                            'MaxItems': 500,
-                            'StartingToken': next_token
-                        }
-                    )
-                    for page in page_iter:
-                        pages.append(page)
-                    next_token = pages[-1].get('NextToken', None)
-                    if not next_token:
-                        break
-
-                for page in pages:
-                    summaries = page['StackResourceSummaries']
-                    for summary in summaries:
-                        table.add_row([
-                            stack_name,
-                            summary['LogicalResourceId'],
-                            self.shorten(summary['PhysicalResourceId'], 40, 5),
-                            summary['ResourceType'],
-                            self.colored_status(summary['ResourceStatus']),
-                            self.format_datetime(summary['LastUpdatedTimestamp'])
-                        ])
-            except botocore.exceptions.ClientError:
-                # Ignore this stack if exception occurred.
-              pass
+        for row in rows:
+            table.add_row(row)
 
         print(blue('Resrouces:', bold = True))
         print(table)
 
-    def list_exports(self):
+    def __list_exports(self):
+        paginator = self.cfn_client().get_paginator('list_exports')
+        for page in paginator.paginate():
+            for export in page.get('Exports', []):
+                yield export
+
+    def iter_exports(self):
         """
-        List exports.
+        Iterate exports page by page, or from local stack state index.
+
+        :return: Iterator of exports.
         """
-        def get_exported_stack_name(export):
-            exportingStackId = export['ExportingStackId']
-            for stack_def in self.stack_defs.values():
-                stack_name = stack_def.actual_stack_name()
-                if stack_name in exportingStackId:  # Contains stack name in exporting stack name.
-                    return stack_name
-            return None
+        store, target = self.fresh_stack_state()
+        if store is None:
+            return self.__list_exports()
+        exports, stale_stack_names = store.exports(target)
+        # Describing a changed stack costs 1 call, listing exports costs 1 call per 100 exports.
+        if exports is None or len(stale_stack_names) > len(exports) // 100 + 1:
+            exports = list(self.__list_exports())
+            store.put_exports(target, exports)
+            return iter(exports)
+        if stale_stack_names:
+            def describe(stack_name):
+                try:
+                    return stack_name, self.cfn_client().describe_stacks(StackName = stack_name)['Stacks'][0]
+                except botocore.exceptions.ClientError:
+                    # Stack has been deleted.
+                    return stack_name, None
+
+            for stack_name, description in self.parallel_map(describe, stale_stack_names, 8):
+                store.put_description(target, stack_name, description)
+            exports, stale_stack_names = store.exports(target)
+        return iter(exports)
+
+    def iter_export_rows(self):
+        """
+        Iterate rows of exports by defined stacks page by page.
 
-        def recursive_list_exports():
-            def _recursive(a, res = []):
-                res = res + a.get("Exports", [])
-                nt = a.get("NextToken", None)
-                exists_next = nt is not None and len(nt) > 0
-                if exists_next:
-                    b = self.cfn_client().list_exports(NextToken = nt)
-                    return _recursive(b, res)
-                else:
-                    return res
-            return _recursive(self.cfn_client().list_exports())
+        :return: Generator of rows. (Columns are EXPORT_COLUMNS)
+        """
+        # {Actual stack name, Stack alias}
+        defined_stack_aliases = self.stack_name_index()
+        for export in self.iter_exports():
+            # arn:aws:cloudformation:REGION:ACCOUNT:stack/STACK_NAME/ID
+            exported_stack_name = export['ExportingStackId'].split('/')[1]
+            defined_stack_name = find_defined_stack_name(defined_stack_aliases, exported_stack_name)
+            if defined_stack_name is not None:
+                yield [
+                    defined_stack_aliases[defined_stack_name] if defined_stack_name == exported_stack_name else '',
+                    exported_stack_name,
+                    export['Name'],
+                    export['Value']
+                ]
+
+    def list_exports(self, output = None):
+        """
+        List exports.
+
+        :param output: Write rows as soon as fetched, in the format 'jsonl' or 'csv'. (OPTIONAL. Default table)
+        """
+        columns = self.EXPORT_COLUMNS
+        if output:
+            self.stream_rows(output, columns, self.iter_export_rows)
+            return
 
         print('Fetching exports...')
-        exports = recursive_list_exports()
+        extra_columns, rows = self.collect_rows(lambda: list(self.iter_export_rows()))
 
-        table = PrettyTable(['ExportedStackName', 'ExportName', 'ExportValue'])
+        table = PrettyTable(extra_columns + columns)
+        table.align['StackAlias'] = 'l'
         table.align['ExportedStackName'] = 'l'
         table.align['ExportName'] = 'l'
         table.align['ExportValue'] = 'l'
-        for export in exports:
-            exported_stack_name = get_exported_stack_name(export)
-            if exported_stack_name is not None:
-                table.add_row([
-                    exported_stack_name,
-                    export['Name'],
-                    export['Value']
-                ])
+        for row in rows:
+            table.add_row(row)
         print(blue('Exports:', bold = True))
         print(table)
 
@@ -695,17 +3607,123 @@ class StackGroup(object):
     def in_dryrun(self):
         return True if (env.has_key('DryRun') and env.DryRun == True) else False
 
+    def in_unattended(self):
+        return True if (env.has_key('Unattended') and env.Unattended == True) or in_async_call() else False
+
+    def async_executor(self):
+        """
+        Executor that runs blocking boto3 calls of *_async methods.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with self.__async_executor_lock:
+            if self.__async_executor is None:
+                self.__async_executor = ThreadPoolExecutor(max_workers = self.async_workers)
+            return self.__async_executor
+
+    def run_async(self, func, **kwparams):
+        """
+        Run function on executor, without prompt and confirm.
+        Stack parameters are applied to this call only, instead of Fabric env.
+
+        :param func: Function without arguments.
+        :param kwparams: Stack parameters.
+        :return: concurrent.futures.Future of the result.
+        """
+        target = getattr(self.__target, 'value', None)
+
+        def call():
+            self.__target.value = target
+            _async_context.params = kwparams
+            try:
+                return func()
+            except SystemExit as e:
+                # Do not exit caller process by abort().
+                raise Exception(getattr(e, 'message', None) or 'Aborted.')
+            finally:
+                self.__target.value = None
+                _async_context.params = None
+
+        return self.async_executor().submit(call)
+
+    def __stack_def(self, alias):
+        if not self.stack_defs.has_key(alias):
+            abort(red('Stack %s is not defined.' % alias))
+        return self.stack_defs[alias]
+
+    def create_async(self, alias, **kwparams):
+        """
+        Create stack. Same as create_xxx task, but runs on executor without prompt.
+
+        :param alias: Stack alias.
+        :param kwparams: Stack parameters. (Unspecified parameters use default value)
+        :return: Future of {StackAlias, StackName, StackId, Status}
+        """
+        return self.run_async(lambda: self.__stack_def(alias).create(), **kwparams)
+
+    def update_async(self, alias, **kwparams):
+        """
+        Update stack. Same as update_xxx task, but runs on executor without prompt.
+
+        :param alias: Stack alias.
+        :param kwparams: Stack parameters. (Unspecified parameters use previous or default value)
+        :return: Future of {StackAlias, StackName, StackId, Status}
+        """
+        return self.run_async(lambda: self.__stack_def(alias).update(), **kwparams)
+
+    def delete_async(self, alias):
+        """
+        Delete stack. Same as delete_xxx task, but runs on executor without confirm.
+
+        :param alias: Stack alias.
+        :return: Future of {StackAlias, StackName, StackId, Status}
+        """
+        return self.run_async(lambda: self.__stack_def(alias).delete())
+
+    def __rows_as_dicts(self, columns, iter_rows):
+        extra_columns, rows = self.collect_rows(lambda: list(iter_rows()))
+        return [OrderedDict(zip(extra_columns + columns, row)) for row in rows]
+
+    def list_stacks_async(self, nested = False):
+        """
+        Same as list_stacks task, but runs on executor and returns rows.
+
+        :param nested: Set True to include nested stacks. (Default False)
+        :return: Future of list of {STACK_COLUMNS} (With Region and Account while fan out)
+        """
+        return self.run_async(lambda: self.__rows_as_dicts(self.STACK_COLUMNS, lambda: self.iter_stack_rows(nested)))
+
+    def list_resources_async(self, alias = None, workers = 8, nested = False):
+        """
+        Same as list_resources task, but runs on executor and returns rows.
+
+        :param alias: Stack alias.(OPTIONAL. Default all stacks)
+        :param workers: Number of stacks to fetch at the same time. (Default 8)
+        :param nested: Set True to include resources of nested stacks. (Default False)
+        :return: Future of list of {RESOURCE_COLUMNS} (With Region and Account while fan out)
+        """
+        return self.run_async(lambda: self.__rows_as_dicts(self.RESOURCE_COLUMNS, lambda: self.iter_resource_rows(alias, workers, nested)))
+
+    def list_exports_async(self):
+        """
+        Same as list_exports task, but runs on executor and returns rows.
+
+        :return: Future of list of {EXPORT_COLUMNS} (With Region and Account while fan out)
+        """
+        return self.run_async(lambda: self.__rows_as_dicts(self.EXPORT_COLUMNS, self.iter_export_rows))
+
 
 class StackDef(object):
-    def __init__(self, stack_group, stack_alias, stack_name, template_path, **kwargs):
+    def __init__(self, stack_group, stack_alias, stack_name, template_path, depends_on = None, **kwargs):
         self.stack_group = stack_group
         self.stack_alias = stack_alias
         self.stack_name = stack_name
         self.template_path = template_path
+        self.depends_on = list(depends_on or [])
         self.kwargs = kwargs
 
     def actual_stack_name(self):
-        return self.stack_name % env
+        return self.stack_name % self.stack_group.effective_env()
 
     def template_s3_url(self):
         return 'https://s3.amazonaws.com/%s/%s/%s' % (
@@ -714,113 +3732,266 @@ class StackDef(object):
             self.template_path
         )
 
-    def __merge_stack_args(self, **kwargs):
-        copied = self.stack_group.default_stack_args_.copy()
-        copied.update(**kwargs)  # Override default args by specified args.
-        return copied
+    def load_local_template(self):
+        """
+        Load template on local dir.
 
-    def create(self, **kwparams):
-        # Override Fabric env with task parameter.
-        self.stack_group.params(**kwparams)
+        :return: Template as dict. None if template does not exists or can not parse.
+        """
+        template_local_path = self.stack_group.template_local_path(self.template_path)
+        if not os.path.isfile(template_local_path):
+            return None
+        try:
+            template = load_template(template_local_path)
+        except yaml.YAMLError as e:
+            print(yellow('Can not parse template %s. %s' % (template_local_path, e)))
+            return None
+        return template if isinstance(template, dict) else None
+
+    def template_parameters(self):
+        """
+        Get parameter definitions of the template on S3.
+        1. Parse template on local dir, if it is same as synchronized template.
+        2. Use cached template summary of synchronized template.
+        3. Call get_template_summary API.
 
-        # Get template definition.
-        template = self.stack_group.cfn_client().get_template_summary(
+        :return: Parameter definitions.
+        """
+        template_local_path = self.stack_group.template_local_path(self.template_path)
+        synced_hash = self.stack_group.load_synced_manifest().get(self.stack_group.template_s3_location(self.template_path))
+        if synced_hash is not None:
+            if os.path.isfile(template_local_path) and self.stack_group.local_template_hash(self.template_path) == synced_hash:
+                template = self.load_local_template()
+                if template is not None:
+                    return parameters_from_template(template)
+
+            param_defs = self.stack_group.template_summary_cache().get(synced_hash)
+            if param_defs is not None:
+                return param_defs
+
+        param_defs = self.stack_group.cfn_client().get_template_summary(
             TemplateURL = self.template_s3_url()
-        )
+        )['Parameters']
+        if synced_hash is not None:
+            self.stack_group.template_summary_cache().put(synced_hash, param_defs)
+        return param_defs
 
-        # Resolve parameters from task parameter, fabric env, prompt.
+    def specified_params(self, param_defs = None):
+        """
+        Stack parameters specified by fabric env or parameter file. (Fabric env takes precedence)
+        References to SSM Parameter Store and outputs of stacks are not resolved.
+
+        :param param_defs: Parameter definitions of template summary. (OPTIONAL. Default parameters in parameter file and references in fabric env)
+        :return: {Parameter key, Value}
+        """
+        file_params = self.stack_group.parameter_file_params(self.stack_alias)
+        env_params = self.stack_group.effective_env()
+        if param_defs is None:
+            param_keys = set(file_params) | set(
+                key for key, value in env_params.items() if ssm_parameter_name(value) is not None or stack_output_references(value)
+            )
+        else:
+            param_keys = [param_def['ParameterKey'] for param_def in param_defs]
+
+        specified_params = {}
+        for param_key in param_keys:
+            if param_key in env_params:
+                specified_params[param_key] = env_params[param_key]
+            elif param_key in file_params:
+                specified_params[param_key] = file_params[param_key]
+        return specified_params
+
+    def __resolve_stack_params(self, param_defs, get_previous_param_value = None, require_value = False):
+        """
+        Resolve stack parameters from fabric env, parameter file, previous value (update only), prompt.
+        In unattended mode (bulk tasks), use previous or default value instead of prompt.
+        Previous value is passed as UsePreviousValue, because values of NoEcho parameters are masked by DescribeStacks.
+
+        :param param_defs: Parameter definitions of template summary.
+        :param get_previous_param_value: Function that returns previous parameter value.(OPTIONAL)
+        :param require_value: Set True to raise Exception if value is empty.
+        :return: Stack parameters.
+        """
+        specified_params = self.stack_group.resolve_params(self.specified_params(param_defs))
         stack_params = []
-        for param_def in template['Parameters']:
+        for param_def in param_defs:
             param_key = param_def['ParameterKey']
-            if env.has_key(param_key):
+            if param_key in specified_params:
                 # Use specified parameter.
-                param_value = env[param_key]
+                param_value = specified_params[param_key]
             else:
-                if param_def.has_key('DefaultValue'):
+                prev_value = get_previous_param_value(param_key) if get_previous_param_value else None
+                if prev_value is not None:
+                    default_value = prev_value
+                elif param_def.has_key('DefaultValue'):
                     default_value = param_def['DefaultValue']
-                    if param_def.has_key('Description'):
-                        # Prompt parameter with description, default value.
-                        param_value = prompt('%s? - %s' % (param_key, param_def['Description']), default = default_value)
-                    else:
-                        # Prompt parameter with default value.
-                        param_value = prompt('%s?' % param_key, default = default_value)
+                else:
+                    default_value = None
+
+                if self.stack_group.in_unattended():
+                    if default_value is None:
+                        raise Exception('Missing require parameter %s.' % (param_key))
+                    param_value = default_value
                 else:
                     if param_def.has_key('Description'):
-                        # Prompt parameter with description.
-                        param_value = prompt('%s? - %s' % (param_key, param_def['Description']))
+                        message = '%s? - %s' % (param_key, param_def['Description'])
                     else:
-                        # Prompt parameter.
-                        param_value = prompt('%s?' % param_key)
-
-                if not param_value:
+                        message = '%s?' % param_key
+                    if default_value is not None:
+                        # Prompt parameter with previous / default value.
+                        param_value = prompt(message, default = default_value)
+                    else:
+                        param_value = prompt(message)
+
+                if prev_value is not None and param_value == prev_value:
+                    stack_params.append({
+                        'ParameterKey': param_key,
+                        'UsePreviousValue': True
+                    })
+                    continue
+                if require_value and not param_value:
                     raise Exception('Missing require parameter %s.' % (param_key))
 
             stack_params.append({
                 'ParameterKey': param_key,
                 'ParameterValue': param_value
             })
+        return stack_params
+
+    def fingerprint(self, stack_params, stack_args):
+        """
+        Fingerprint of deployment. Hash of the template object version on S3 (ETag or VersionId), parameters and stack arguments.
+        The object on S3 is read, because templates may be synchronized by other checkouts or CI.
+
+        :param stack_params: Resolved stack parameters. (Value of UsePreviousValue parameter is None)
+        :param stack_args: Merged stack arguments.
+        :return: Fingerprint. None if the template object on S3 can not be read.
+        """
+        import hashlib
+
+        template_version = self.stack_group.template_s3_version(self.template_path)
+        if template_version is None:
+            return None
+        params = sorted((param['ParameterKey'], param.get('ParameterValue')) for param in stack_params)
+        return hashlib.sha256(json.dumps(
+            [self.template_s3_url(), template_version, params, stack_args], sort_keys = True, default = str
+        )).hexdigest()
+
+    def __is_up_to_date(self, stack, param_defs, get_previous_param_value, stack_args):
+        """
+        Check the deployed stack has the same fingerprint.
+        Parameters are resolved without prompt. (Specified, previous or default value)
+
+        :param stack: Result of describe_stacks.
+        :param param_defs: Parameter definitions of template summary.
+        :param get_previous_param_value: Function that returns previous parameter value.
+        :param stack_args: Merged stack arguments.
+        :return: True if up to date.
+        """
+        deployed_fingerprint = self.stack_group.deployed_fingerprint(stack)
+        if deployed_fingerprint is None:
+            return False
+        specified_params = self.stack_group.resolve_params(self.specified_params(param_defs))
+        stack_params = []
+        for param_def in param_defs:
+            param_key = param_def['ParameterKey']
+            if param_key in specified_params:
+                param_value = specified_params[param_key]
+            elif get_previous_param_value(param_key) is not None:
+                # Same as __resolve_stack_params.
+                stack_params.append({'ParameterKey': param_key, 'UsePreviousValue': True})
+                continue
+            else:
+                param_value = param_def.get('DefaultValue')
+            if param_value is None:
+                return False
+            stack_params.append({'ParameterKey': param_key, 'ParameterValue': param_value})
+        return self.fingerprint(stack_params, stack_args) == deployed_fingerprint
+
+    def __result(self, stack_id, status, change_set = None):
+        """
+        Result of create / update / delete.
+
+        :param stack_id: Stack ID. None if the stack does not exist.
+        :param status: Terminal status of the stack, 'NO_CHANGES', 'EXISTS', 'NOT_EXISTS' or 'DRY_RUN'.
+        :param change_set: Computed change set. (DRY-RUN only)
+        :return: {StackAlias, StackName, StackId, Status, Changes(DRY-RUN only)}
+        """
+        result = OrderedDict([
+            ('StackAlias', self.stack_alias),
+            ('StackName', self.actual_stack_name()),
+            ('StackId', stack_id),
+            ('Status', status)
+        ])
+        if change_set is not None:
+            result['Changes'] = change_set.get('Changes', [])
+        return result
+
+    def __merge_stack_args(self, **kwargs):
+        copied = self.stack_group.default_stack_args_.copy()
+        copied.update(**kwargs)  # Override default args by specified args.
+        return copied
+
+    def create(self, **kwparams):
+        # Override Fabric env with task parameter.
+        self.stack_group.params(**kwparams)
+
+        # Skip exists stack.
+        try:
+            stack_id = self.stack_group.cfn_client().describe_stacks(StackName = self.actual_stack_name())['Stacks'][0]['StackId']
+        except botocore.exceptions.ClientError as e:
+            if not is_stack_not_found(e):
+                raise
+        else:
+            echo(yellow('Stack %s already exists.' % self.actual_stack_name()))
+            return self.__result(stack_id, 'EXISTS')
+
+        # Resolve parameters from task parameter, fabric env, prompt.
+        stack_params = self.__resolve_stack_params(self.template_parameters(), require_value = True)
 
-        # TODO Async execution.
         # TODO Refactor.
         stack_args = self.__merge_stack_args(**self.kwargs)
         # DRY-RUN. Create ChangeSet and show it.
         if self.stack_group.in_dryrun():
             # Create ChangeSet.
-            print('Creating stack (DRY-RUN)...')
-            print('  Stack Name: %s' % self.actual_stack_name())
-            print('  Template  : %s' % self.template_s3_url())
-            print('  Parameters: %s' % stack_params)
-            print("  Arguments : %s" % stack_args)
-            changeset_name = "dryrun-%s" % ("{0:%Y%m%d%H%M%S}".format(datetime.datetime.now()))
-            self.stack_group.cfn_client().create_change_set(
-                StackName = self.actual_stack_name(),
-                ChangeSetName = changeset_name,
-                ChangeSetType = 'CREATE',
-                TemplateURL = self.template_s3_url(),
-                Parameters = stack_params,
-                **stack_args
-            )
-
-            # Wait create ChangeSet complete.
-            print('Computing changes...')
-            self.stack_group.cfn_client().get_waiter('change_set_create_complete').wait(
-                StackName = self.actual_stack_name(),
-                ChangeSetName = changeset_name
-            )
+            echo('Creating stack (DRY-RUN)...')
+            echo('  Stack Name: %s' % self.actual_stack_name())
+            echo('  Template  : %s' % self.template_s3_url())
+            echo('  Parameters: %s' % self.stack_group.masked_params(stack_params))
+            echo("  Arguments : %s" % stack_args)
+            echo('Computing changes...')
+            change_set = self.__create_change_set('CREATE', 'dryrun', stack_params, stack_args)
 
             # Show ChangeSet.
-            change_set = self.stack_group.cfn_client().describe_change_set(
-                StackName = self.actual_stack_name(),
-                ChangeSetName = changeset_name
-            )
             self.__show_change_set(change_set)
-
-            # # Delete ChangeSet with Stack.
-            # self.stack_group.cfn_resource().Stack(self.actual_stack_name()).delete(
-            #     self.__filter_stack_args_for_delete(**stack_args)
-            # )
+            result = self.__result(change_set['StackId'], 'DRY_RUN', change_set)
 
         # Create stack.
         else:
-            print('Creating stack...')
-            print('  Stack Name: %s' % self.actual_stack_name())
-            print('  Template  : %s' % self.template_s3_url())
-            print('  Parameters: %s' % stack_params)
-            print("  Arguments : %s" % stack_args)
-            self.stack_group.cfn_resource().create_stack(
+            echo('Creating stack...')
+            echo('  Stack Name: %s' % self.actual_stack_name())
+            echo('  Template  : %s' % self.template_s3_url())
+            echo('  Parameters: %s' % self.stack_group.masked_params(stack_params))
+            echo("  Arguments : %s" % stack_args)
+            stack_id = self.stack_group.cfn_client().create_stack(
               StackName = self.actual_stack_name(),
               TemplateURL = self.template_s3_url(),
               Parameters = stack_params,
               **stack_args
-            )
+            )['StackId']
 
             # Wait create complete.
-            print('Waiting for complete... (ctrl+C to exit)')
-            self.stack_group.cfn_client().get_waiter('stack_create_complete').wait(
-                StackName = self.actual_stack_name()
-            )
+            echo('Waiting for complete... (ctrl+C to exit)')
+            try:
+                status = StackEventTracker(self.stack_group, stack_id).wait('CREATE_COMPLETE')
+            finally:
+                self.stack_group.forget_stack_state()
+                self.stack_group.forget_stack_outputs(self.stack_alias)
+            self.stack_group.record_fingerprint(stack_id, self.fingerprint(stack_params, stack_args))
+            result = self.__result(stack_id, status)
 
-        print('Finish.')
+        echo('Finish.')
+        return result
 
     @confirm
     def update(self, **kwparams):
@@ -829,6 +4000,7 @@ class StackDef(object):
 
         # Get exists stack.
         stack = self.stack_group.cfn_resource().Stack(self.actual_stack_name())
+        stack.load()
 
         def get_previous_param_value(param_key):
             for param in stack.parameters:
@@ -836,102 +4008,46 @@ class StackDef(object):
                     return param['ParameterValue']
             return None
 
-        # Get template definition.
-        template = self.stack_group.cfn_client().get_template_summary(
-            TemplateURL = self.template_s3_url()
-        )
+        param_defs = self.template_parameters()
+        stack_args = self.__merge_stack_args(**self.kwargs)
 
-        # Resolve parameters from task parameter, fabric env, prompt.
-        stack_params = []
-        for param_def in template['Parameters']:
-            param_key = param_def['ParameterKey']
-            if env.has_key(param_key):
-                # Use specified parameter.
-                param_value = env[param_key]
-            else:
-                prev_value = get_previous_param_value(param_key)
-                if prev_value is not None:
-                    if param_def.has_key('Description'):
-                        # Prompt parameter with description, previous value.
-                        param_value = prompt('%s? - %s' % (param_key, param_def['Description']), default = prev_value)
-                    else:
-                        # Prompt parameter with previous value.
-                        param_value = prompt('%s?' % param_key, default = prev_value)
-                elif param_def.has_key('DefaultValue'):
-                    default_value = param_def['DefaultValue']
-                    if param_def.has_key('Description'):
-                        # Prompt parameter with description, default value.
-                        param_value = prompt('%s? - %s' % (param_key, param_def['Description']), default = default_value)
-                    else:
-                        # Prompt parameter with default value.
-                        param_value = prompt('%s?' % param_key, default = default_value)
-                else:
-                    if param_def.has_key('Description'):
-                        # Prompt parameter with description.
-                        param_value = prompt('%s? - %s' % (param_key, param_def['Description']))
-                    else:
-                        # Prompt parameter.
-                        param_value = prompt('%s?' % param_key)
+        # Skip without prompt and update, if nothing changed since last deployment.
+        if not self.stack_group.in_dryrun() and self.__is_up_to_date(stack.meta.data, param_defs, get_previous_param_value, stack_args):
+            echo(yellow('No changes. (Same template, parameters and arguments as deployed)'))
+            echo('Finish.')
+            return self.__result(stack.stack_id, 'NO_CHANGES')
 
-            stack_params.append({
-                'ParameterKey': param_key,
-                'ParameterValue': param_value
-            })
+        # Resolve parameters from task parameter, fabric env, prompt.
+        stack_params = self.__resolve_stack_params(param_defs, get_previous_param_value)
 
-        # TODO Async execution.
-        # TODO Refactor.
-        stack_args = self.__merge_stack_args(**self.kwargs)
         if self.stack_group.in_dryrun():
             # Create ChangeSet and show it.
-            print('Updating stack (DRY-RUN)...')
-            print('  Stack Name: %s' % self.actual_stack_name())
-            print('  Template  : %s' % self.template_s3_url())
-            print('  Parameters: %s' % stack_params)
-            print('  Arguments : %s' % stack_args)
-            changeset_name = "dryrun-%s" % ("{0:%Y%m%d%H%M%S}".format(datetime.datetime.now()))
-            self.stack_group.cfn_client().create_change_set(
-                StackName = self.actual_stack_name(),
-                ChangeSetName = changeset_name,
-                ChangeSetType = 'UPDATE',
-                TemplateURL = self.template_s3_url(),
-                Parameters = stack_params,
-                **stack_args
-            )
-
-            # Wait create ChangeSet complete.
-            print('Computing changes...')
-            try:
-                self.stack_group.cfn_client().get_waiter('change_set_create_complete').wait(
-                    StackName = self.actual_stack_name(),
-                    ChangeSetName = changeset_name
-                )
-            except botocore.exceptions.WaiterError as e:
-                # Raise WaiterError when no changes. Ignore it.
-                pass
+            echo('Updating stack (DRY-RUN)...')
+            echo('  Stack Name: %s' % self.actual_stack_name())
+            echo('  Template  : %s' % self.template_s3_url())
+            echo('  Parameters: %s' % self.stack_group.masked_params(stack_params))
+            echo('  Arguments : %s' % stack_args)
+            echo('Computing changes...')
+            change_set = self.__create_change_set('UPDATE', 'dryrun', stack_params, stack_args)
 
             # Show ChangeSet.
-            change_set = self.stack_group.cfn_client().describe_change_set(
-                StackName = self.actual_stack_name(),
-                ChangeSetName = changeset_name
-            )
-            if change_set.has_key('StatusReason') and 'didn\'t contain changes' in change_set['StatusReason']:
-                print(yellow('No changes.'))
+            if self.__has_no_changes(change_set):
+                echo(yellow('No changes.'))
+                self.stack_group.cfn_client().delete_change_set(ChangeSetName = change_set['ChangeSetId'])
             else:
                 self.__show_change_set(change_set)
-
-            # # Delete ChaneSet.
-            # self.stack_group.cfn_client().delete_change_set(
-            #     StackName = self.actual_stack_name(),
-            #     ChangeSetName = changeset_name
-            # )
+            result = self.__result(change_set['StackId'], 'DRY_RUN', change_set)
 
         # Update stack.
         else:
-            print('Updating stack...')
-            print('  Stack Name: %s' % self.actual_stack_name())
-            print('  Template  : %s' % self.template_s3_url())
-            print('  Parameters: %s' % stack_params)
-            print('  Arguments : %s' % stack_args)
+            echo('Updating stack...')
+            echo('  Stack Name: %s' % self.actual_stack_name())
+            echo('  Template  : %s' % self.template_s3_url())
+            echo('  Parameters: %s' % self.stack_group.masked_params(stack_params))
+            echo('  Arguments : %s' % stack_args)
+            # Stack resource reloads attributes after update. Keep ID before it.
+            stack_id = stack.stack_id
+            tracker = StackEventTracker.from_latest_event(self.stack_group, stack_id)
             try:
                 stack.update(
                     TemplateURL = self.template_s3_url(),
@@ -940,36 +4056,183 @@ class StackDef(object):
                 )
             except botocore.exceptions.ClientError as e:
                 if 'No updates are to be performed' in e.args[0]:
-                    print(yellow('No changes.'))
+                    echo(yellow('No changes.'))
+                    status = 'NO_CHANGES'
                 else:
                     raise e
             else:
                 # Wait update complete.
-                print('Waiting for complete... (ctrl+C to exit)')
-                self.stack_group.cfn_client().get_waiter('stack_update_complete').wait(
-                    StackName = self.actual_stack_name()
-                )
-
-        print('Finish.')
+                echo('Waiting for complete... (ctrl+C to exit)')
+                try:
+                    status = tracker.wait('UPDATE_COMPLETE')
+                finally:
+                    self.stack_group.forget_stack_state()
+                    self.stack_group.forget_stack_outputs(self.stack_alias)
+            self.stack_group.record_fingerprint(stack_id, self.fingerprint(stack_params, stack_args))
+            result = self.__result(stack_id, status)
+
+        echo('Finish.')
+        return result
 
     @confirm
     def delete(self):
-        # TODO Async execution.
         # Delete stack.
         stack_args = self.__filter_stack_args_for_delete(**self.__merge_stack_args(**self.kwargs))
-        print('Deleting stack...')
-        print('  Stack Name: %s' % self.actual_stack_name())
-        print('  Arguments : %s' % stack_args)
-        self.stack_group.cfn_resource().Stack(self.actual_stack_name()).delete(
+        echo('Deleting stack...')
+        echo('  Stack Name: %s' % self.actual_stack_name())
+        echo('  Arguments : %s' % stack_args)
+        stack = self.stack_group.cfn_resource().Stack(self.actual_stack_name())
+        try:
+            stack_id = stack.stack_id
+        except botocore.exceptions.ClientError:
+            # Stack does not exists
+            echo(yellow('Stack %s does not exists.' % stack.name))
+            return self.__result(None, 'NOT_EXISTS')
+        tracker = StackEventTracker.from_latest_event(self.stack_group, stack_id)
+        stack.delete(
             **stack_args
         )
 
         # Wait delete complete.
-        print('Waiting for complete... (ctrl+C to exit)')
-        self.stack_group.cfn_client().get_waiter('stack_delete_complete').wait(
-            StackName = self.actual_stack_name()
-        )
-        print('Finish.')
+        echo('Waiting for complete... (ctrl+C to exit)')
+        try:
+            status = tracker.wait('DELETE_COMPLETE')
+        finally:
+            self.stack_group.forget_stack_state()
+            self.stack_group.forget_stack_outputs(self.stack_alias)
+        echo('Finish.')
+        return self.__result(stack_id, status)
+
+    def plan(self):
+        """
+        Create change set to create or update the stack, and wait for it to be computed.
+        Unattended, so use specified, previous or default parameter values.
+
+        :return: Planned change set. {StackName, StackId, ChangeSetId, ChangeSetName, ChangeSetType, Changes} None if no changes.
+        """
+        try:
+            stack = self.stack_group.cfn_client().describe_stacks(StackName = self.actual_stack_name())['Stacks'][0]
+        except botocore.exceptions.ClientError:
+            # Stack does not exists
+            stack = None
+
+        # Stack created by change set is REVIEW_IN_PROGRESS until the change set is executed.
+        if stack is None or stack['StackStatus'] == 'REVIEW_IN_PROGRESS':
+            change_set_type = 'CREATE'
+            stack_params = self.__resolve_stack_params(self.template_parameters(), require_value = True)
+        else:
+            change_set_type = 'UPDATE'
+            previous_params = dict((param['ParameterKey'], param['ParameterValue']) for param in stack.get('Parameters', []))
+            param_defs = self.template_parameters()
+            if self.__is_up_to_date(stack, param_defs, previous_params.get, self.__merge_stack_args(**self.kwargs)):
+                return None
+            stack_params = self.__resolve_stack_params(param_defs, previous_params.get)
+
+        stack_args = self.__merge_stack_args(**self.kwargs)
+        change_set = self.__create_change_set(change_set_type, 'plan', stack_params, stack_args)
+        if self.__has_no_changes(change_set):
+            self.stack_group.cfn_client().delete_change_set(ChangeSetName = change_set['ChangeSetId'])
+            return None
+        return OrderedDict([
+            ('StackName', change_set['StackName']),
+            ('StackId', change_set['StackId']),
+            ('ChangeSetId', change_set['ChangeSetId']),
+            ('ChangeSetName', change_set['ChangeSetName']),
+            ('ChangeSetType', change_set_type),
+            ('Fingerprint', self.fingerprint(stack_params, stack_args)),
+            ('Changes', [
+                OrderedDict([
+                    ('Action', change['ResourceChange']['Action']),
+                    ('LogicalResourceId', change['ResourceChange']['LogicalResourceId']),
+                    ('ResourceType', change['ResourceChange']['ResourceType']),
+                    ('Replacement', change['ResourceChange'].get('Replacement', '-'))
+                ]) for change in change_set.get('Changes', [])
+            ])
+        ])
+
+    def apply(self):
+        """
+        Execute the change set planned by plan task.
+        """
+        planned = self.stack_group.planned_change_set(self.stack_alias)
+        if planned is None:
+            echo('No planned change set for the stack %s.' % self.actual_stack_name())
+            return
+
+        echo('Applying change set...')
+        echo('  Stack Name: %s' % planned['StackName'])
+        echo('  Change Set: %s' % planned['ChangeSetName'])
+        tracker = StackEventTracker.from_latest_event(self.stack_group, planned['StackId'])
+        self.stack_group.cfn_client().execute_change_set(ChangeSetName = planned['ChangeSetId'])
+
+        # Wait complete.
+        echo('Waiting for complete... (ctrl+C to exit)')
+        try:
+            tracker.wait('CREATE_COMPLETE' if planned['ChangeSetType'] == 'CREATE' else 'UPDATE_COMPLETE')
+        finally:
+            self.stack_group.forget_stack_state()
+            self.stack_group.forget_stack_outputs(self.stack_alias)
+        self.stack_group.record_fingerprint(planned['StackId'], planned.get('Fingerprint'))
+        self.stack_group.forget_planned_change_set(self.stack_alias)
+        echo('Finish.')
+
+    def __create_change_set(self, change_set_type, name_prefix, stack_params, stack_args):
+        """
+        Create change set and wait for it to be computed.
+        Stale change sets created by dryrun, or with the same name prefix are deleted.
+
+        :param change_set_type: 'CREATE' or 'UPDATE'.
+        :param name_prefix: 'dryrun' or 'plan'.
+        :param stack_params: Stack parameters.
+        :param stack_args: Stack arguments.
+        :return: Result of describe_change_set.
+        :raise Exception: Change set failed except no changes.
+        """
+        client = self.stack_group.cfn_client()
+        change_set_name = '%s-%s' % (name_prefix, "{0:%Y%m%d%H%M%S}".format(datetime.datetime.now()))
+        change_set_id = client.create_change_set(
+            StackName = self.actual_stack_name(),
+            ChangeSetName = change_set_name,
+            ChangeSetType = change_set_type,
+            TemplateURL = self.template_s3_url(),
+            Parameters = stack_params,
+            **stack_args
+        )['Id']
+        self.__prune_change_sets(('dryrun-', name_prefix + '-'), change_set_id)
+
+        try:
+            client.get_waiter('change_set_create_complete').wait(ChangeSetName = change_set_id)
+        except botocore.exceptions.WaiterError:
+            # Raise WaiterError when no changes. Checked below.
+            pass
+        change_set = client.describe_change_set(ChangeSetName = change_set_id)
+        if change_set['Status'] == 'FAILED' and not self.__has_no_changes(change_set):
+            raise Exception('Change set %s failed. %s' % (change_set_name, change_set.get('StatusReason', '')))
+        return change_set
+
+    def __has_no_changes(self, change_set):
+        return change_set.has_key('StatusReason') and 'didn\'t contain changes' in change_set['StatusReason']
+
+    def __prune_change_sets(self, name_prefix, keep_change_set_id):
+        """
+        Delete stale change sets of the stack.
+
+        :param name_prefix: Name prefixes (tuple) of change sets to delete.
+        :param keep_change_set_id: Change set not to delete.
+        """
+        client = self.stack_group.cfn_client()
+        summaries = []
+        request = dict(StackName = self.actual_stack_name())
+        while True:
+            result = client.list_change_sets(**request)
+            summaries.extend(result['Summaries'])
+            if not result.get('NextToken'):
+                break
+            request['NextToken'] = result['NextToken']
+
+        for summary in summaries:
+            if summary['ChangeSetName'].startswith(name_prefix) and summary['ChangeSetId'] != keep_change_set_id:
+                client.delete_change_set(ChangeSetName = summary['ChangeSetId'])
 
     def __filter_stack_args_for_delete(self, **kwargs):
         accept_arg_names = ['RetainResources', 'RoleARN']
@@ -980,32 +4243,33 @@ class StackDef(object):
         return filtered
 
     def __show_change_set(self, change_set):
-        print(blue('Stack:', bold = True))
+        echo(blue('Stack:', bold = True))
         table = PrettyTable()
         table.add_column('StackName', [change_set['StackName']])
         table.align['StackName'] = 'l'
         table.add_column('ChangeSetName', [change_set['ChangeSetName']])
         table.align['ChangeSetName'] = 'l'
         table.add_column('ChangeSetStatus', [self.stack_group.colored_status(change_set['Status'])])
-        print(table)
+        echo(table)
 
-        print(blue('Parameters:', bold = True))
+        echo(blue('Parameters:', bold = True))
         if change_set.has_key('Parameters') is False:
-            print('No parameters.')
+            echo('No parameters.')
         else:
             table = PrettyTable(['Key', 'Value'])
             table.align['Key'] = 'l'
             table.align['Value'] = 'l'
-            for param in change_set['Parameters']:
+            # Values read from SecureString parameters are masked.
+            for param in self.stack_group.masked_params(change_set['Parameters']):
                 table.add_row([
                     param['ParameterKey'],
-                    param['ParameterValue']
+                    param.get('ParameterValue', '(Use previous value)')
                 ])
-            print(table)
+            echo(table)
 
-        print(blue('Changes:', bold = True))
+        echo(blue('Changes:', bold = True))
         if change_set.has_key('Changes') is False:
-            print(yellow('No changes.'))
+            echo(yellow('No changes.'))
         else:
             table = PrettyTable(['Action', 'LogicalID', 'PhysicalID', 'ResourceType', 'Replacement'])
             table.align['LogicalID'] = 'l'
@@ -1020,13 +4284,13 @@ class StackDef(object):
                     resource_change['ResourceType'],
                     resource_change['Replacement'] if resource_change.has_key('Replacement') else '-'
                 ])
-            print(table)
+            echo(table)
 
             if env.DryRunShowDetails:
-                print(blue('Details:', bold = True))
-                print('---------------------------------------------------------------------------------------')
-                print(json.dumps(change_set['Changes'], indent=2, sort_keys=True))
-                print('---------------------------------------------------------------------------------------')
+                echo(blue('Details:', bold = True))
+                echo('---------------------------------------------------------------------------------------')
+                echo(json.dumps(change_set['Changes'], indent=2, sort_keys=True))
+                echo('---------------------------------------------------------------------------------------')
 
     def get_stack_operations(self):
         return [self.create, self.update, self.delete]
@@ -15,6 +15,8 @@ setup(
   install_requires = [
     'fabric<2.0',
     'boto3>=1.9.43',
-    'prettytable'
+    'prettytable',
+    'PyYAML',
+    'futures; python_version < "3"'
   ]
 )